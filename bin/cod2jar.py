@@ -33,6 +33,7 @@ import os, sys, traceback, glob, time, zipfile
 from optparse import OptionParser
 from StringIO import StringIO
 import gc
+import multiprocessing, Queue
 import codlib
 
 
@@ -77,7 +78,10 @@ class Cod2Jar(object):
         'xml',
         'debugtext',
         'text',
+        'sqlite',
         'cache',
+        'pack',
+        'store',
         'jasmin',
         'class',
         'jar',
@@ -117,13 +121,38 @@ class Cod2Jar(object):
         self.application_dump = options.application_dump
         self.individual_mode = options.individual_mode
         self.max_module_count = options.max_module_count
-        if self._format == 'cache':
+        self._demand_load = options.demand_load
+        # planned batch mode: batches of CODs whose dependencies fit in this many bytes
+        self._memory_budget = options.memory_budget << 20
+        # pool mode: forked workers inheriting a loader warmed up with these base modules
+        self._pool_size = options.pool_size
+        self._pool_base = [x for x in options.pool_base.split(';') if x]
+        if self._pool_size:
+            if not hasattr(os, 'fork'):
+                self.log("WARNING: worker pools need fork(); reverting to individual dump mode")
+                self._pool_size = 0
+            elif format in ('sqlite', 'store'):
+                self.log("WARNING: '%s' dumps cannot be written by several workers; reverting to individual dump mode" % format)
+                self._pool_size = 0
+            self.individual_mode = True
+        # dependencies demand-loading never had to load (and everything loaded, across loader flushes)
+        self._avoided_modules = set()
+        self._loaded_modules = set()
+        if self._format in ('cache', 'pack'):
             if options.cache_root is not None:
                 self.log("ERROR: cannot specify a cache root for cache creation; aborting...")
             # we can use our cache as we are creating it to speed up loader flushes
             options.cache_root = self._out_path
             self.individual_mode = True
             self.log("WARNING: reverting to individual dump mode for cache creation")
+        elif self._format == 'store':
+            if not options.store_version:
+                self.log("ERROR: must name the version (-V) being added to a store; aborting...")
+                sys.exit(1)
+            self._store_dumper = codlib.StoreDumper(self._out_path, options.store_version, self._make_log)
+            self._reused_modules = 0
+            self.individual_mode = True
+            self.log("WARNING: reverting to individual dump mode for store creation")
 
         # Expand the list of COD files
         if (len(cods) == 1) and (cods[0].lower() == 'all'):
@@ -155,8 +184,8 @@ class Cod2Jar(object):
             else:
                 self._load_paths.append(lp)
 
-        # force our cache to always be read-only
-        self._read_only = True
+        # our cache is read-only unless batch-mode write-back was asked for
+        self._read_only = not options.write_back
         self._cache_root = None
         # Minor race condition here; don't run 2 cod2jars targeting the same cache root at the same time!
         if options.cache_root is not None:
@@ -169,6 +198,10 @@ class Cod2Jar(object):
                 if not os.path.isdir(cache_root):
                     if zipfile.is_zipfile(cache_root):
                         self._read_only = True    # Force read-only mode for zipped caches
+                    elif codlib.packfile.is_packfile(cache_root):
+                        self._read_only = True    # ...and for single-packfile caches
+                    elif codlib.store.is_manifest(cache_root):
+                        self._read_only = True    # ...and for one version of a store
                     else:
                         self.log("ERROR: invalid cache path; '%s' is neither a folder or a Zip; aborting..." % cache_root)
                         cache_root = None
@@ -179,6 +212,10 @@ class Cod2Jar(object):
             cache_root = None
             self._cache = False
 
+        if options.write_back and ((not self._cache) or self._read_only or self.individual_mode):
+            self.log("WARNING: cache write-back needs a folder cache (-c) and batch mode; ignoring it...")
+            self._read_only = True
+
         if (not self._cache) and (self._cods is None):
             self.log("ERROR: no [valid] cache path provided, but input is magic cache specifier 'ALL'; aborting...")
             self._cods = []
@@ -196,9 +233,19 @@ class Cod2Jar(object):
             cache_root=self._cache_root,
             name_db_path=self._names,
             auto_resolve=self.individual_mode,
-            log_file=self._loader_log
+            log_file=self._loader_log,
+            demand_load=self._demand_load
         )
 
+        # incremental mode keeps a manifest of what each dumped module was built from
+        if options.incremental:
+            self._manifest = codlib.BuildManifest(os.path.join(self._out_path, "build.manifest"), self._loader)
+        else:
+            self._manifest = None
+
+        # (dependency graph of the CODs on the load paths; built on demand and kept with the output)
+        self._graph = None
+
         #self._no_update = options.no_update
         self._hiscan = options.hiscan
         self._parse_only = False
@@ -220,6 +267,14 @@ class Cod2Jar(object):
             print "Caching enabled (cache root: '%s')" % self._cache_root
         if self._names:
             print "Stripped-member renaming enabled (name DB: '%s')" % self._name_db
+        if self._manifest is not None:
+            print "Incremental mode enabled (manifest: '%s')" % self._manifest.path
+        if self._demand_load:
+            print "Demand loading enabled (dependencies load only when referenced)"
+        if self._pool_size:
+            print "Pool mode enabled (%d workers forked after loading %s)" % (self._pool_size, ', '.join(self._pool_base))
+        elif self._memory_budget and not self.individual_mode:
+            print "Planned batch mode enabled (memory budget: %d MB)" % (self._memory_budget >> 20)
 
     def do_xml_dump(self, module):
         if self.application_dump:
@@ -249,10 +304,32 @@ class Cod2Jar(object):
             RD = codlib.ResolvedDumper(fd, self._make_log)
             RD.dump_module(module, True)
 
+    def do_sqlite_dump(self, module):
+        try:
+            SD = self._sqlite_dumper
+        except AttributeError:
+            self._sqlite_dumper = SD = codlib.SQLiteDumper(os.path.join(self._out_path, "cod2jar.sqlite"), self._make_log)
+        SD.dump_module(module)
+
     def do_cache_dump(self, module):
         SD = codlib.SerialDumper(self._out_path, self._make_log)
         SD.dump_module(module)
 
+    def do_pack_dump(self, module):
+        # one packfile per module (so a rebuilt module simply replaces its pack)
+        PD = codlib.PackfileDumper(self._out_path, self._make_log)
+        PD.dump_module(module)
+
+    def do_store_dump(self, module):
+        self._store_dumper.dump_module(module)
+
+    def _reuse_stored_module(self, cod_name):
+        '''Try to add a module already in our store (built from an identical COD) without rebuilding it.'''
+        if (self._format != 'store') or (not os.path.isfile(cod_name)):
+            return False
+        name = codlib.utils.quick_get_name(cod_name)
+        return self._store_dumper.reuse_module(name, codlib.utils.quick_get_hash(cod_name))
+
     def do_jasmin_dump(self, module):
         try:
             JD = self._jasmin_dumper
@@ -318,7 +395,10 @@ class Cod2Jar(object):
             ZF = zipfile.ZipFile(self._cache_root, 'r')
             return [mod[:-7] for mod in ZF.namelist() if mod.endswith(".cod.db")]
         else:
-            return  [os.path.basename(mod)[:-7] for mod in glob.glob(os.path.join(self._cache_root, "*.cod.db"))]
+            names = [os.path.basename(mod)[:-7] for mod in glob.glob(os.path.join(self._cache_root, "*.cod.db"))]
+            # (modules in packfiles are listed in the loader's pack index)
+            names += [x[:-7] for x in self._loader._packs if ('/' not in x) and x.endswith(".cod.db")]
+            return sorted(set(names))
 
     def _load_all_cached_cods(self):
         # Load all the modules in the module cache (either folder or Zip cache)
@@ -340,9 +420,92 @@ class Cod2Jar(object):
         print
         return loaded_mods
 
+    def _get_dependency_graph(self):
+        if self._graph is None:
+            self._graph = codlib.DependencyGraph(os.path.join(self._out_path, "depgraph.db"), self._make_log)
+            self._graph.scan(self._load_paths + (self._cods or []))
+            try:
+                self._graph.save()
+            except Exception as err:
+                self.log("WARNING: failed to save the dependency graph...")
+                traceback.print_exc(file=self._make_log)
+        return self._graph
+
+    def _order_cods(self, cods):
+        '''Order the CODs (or cached module names) to dump.
+
+            Cache dumps (and incremental rebuilds) go dependencies first, so
+            modules that are loaded to resolve later ones are already (re)built.
+        '''
+        cods = sorted(cods)
+        if (self._format not in ('cache', 'pack')) and (self._manifest is None):
+            return cods
+        graph = self._get_dependency_graph()
+        rank = dict((name, i) for i, name in enumerate(graph.topological_order()))
+        return sorted(cods, key=lambda c: rank.get(graph.resolve(c), len(rank)))
+
+    def _select_stale_cods(self, cods):
+        '''Drop the CODs (or cached module names) whose previous dump is still up to date.'''
+        P = Progress("Checking for changes", len(cods))
+        stale = []
+        ticks = 0
+        P.update(ticks)
+        for c in cods:
+            try:
+                name = codlib.utils.quick_get_name(c) if os.path.isfile(c) else c
+                if self._manifest.is_stale(name):
+                    stale.append(c)
+                elif (self._format in ('cache', 'pack')) and (not self._loader.is_cache_current(name)):
+                    # (Cache dumps must also rebuild entries whose stamps no longer match)
+                    stale.append(c)
+            except KeyboardInterrupt:
+                raise
+            except Exception as err:
+                self.log("ERROR: failed to check COD '%s' for changes; rebuilding it..." % c)
+                traceback.print_exc(file=self._make_log)
+                stale.append(c)
+            ticks += 1
+            P.update(ticks)
+        print
+        print "\t(%d of %d CODs up to date; rebuilding %d)" % (len(cods) - len(stale), len(cods), len(stale))
+        return stale
+
+    def _record_build(self, module):
+        if self._manifest is None:
+            return
+        try:
+            self._manifest.record(module)
+        except KeyboardInterrupt:
+            raise
+        except Exception as err:
+            self.log("ERROR: failed to record build inputs of module %s; it will be rebuilt next time..." % module)
+            traceback.print_exc(file=self._make_log)
+            self._manifest.forget(module.name)
+
+    def _write_back(self, writer, module):
+        try:
+            writer.dump_module(module)
+        except KeyboardInterrupt:
+            raise
+        except Exception as err:
+            self.log("ERROR: failed to finish caching module '%s'..." % module)
+            traceback.print_exc(file=self._make_log)
+
     def run(self):
-        if self.individual_mode:
+        if self._manifest is not None:
+            if self._cods is None:
+                self._cods = self._get_cached_module_names()
+            self._cods = self._select_stale_cods(self._cods)
+            if not self._cods:
+                print "Nothing to rebuild; halting..."
+                return
+
+        if self._pool_size:
+            self.run_pool_mode()
+        elif self.individual_mode:
             self.run_individual_mode()
+        elif self._memory_budget and (self._cods is not None):
+            self.run_planned_mode()
         else:
             self.run_batch_mode()
 
@@ -354,6 +517,45 @@ class Cod2Jar(object):
             basis, but we can easily run out of memory by batch
             processing a large group of CODs.
         """
+        errors = self._run_batch()
+        if errors is None:
+            return
+
+        self.wrap_up()
+        if errors:
+            print
+            print 'There were %d errors while dumping modules.  See the log files in "%s" for details.' % (errors, self._out_path)
+        print
+
+    def run_planned_mode(self):
+        """ Planned mode splits the CODs into batches whose combined
+            dependency closures (estimated from their headers) fit the
+            memory budget, then runs each batch in batch mode with a
+            fresh loader.  Targets sharing dependencies end up in the
+            same batch, so those load once per batch instead of once
+            per loader flush.
+        """
+        planner = codlib.BatchPlanner(budget=self._memory_budget, log_file=self._make_log, graph=self._get_dependency_graph())
+        batches = planner.plan(self._cods)
+        print "Planned %d batches for %d CODs (see the log for details)" % (len(batches), len(self._cods))
+
+        errors = 0
+        for i, batch in enumerate(batches):
+            print
+            print "Batch %d of %d (%d CODs):" % (i + 1, len(batches), len(batch))
+            if i:
+                self._flush_loader()
+            self._cods = batch
+            errors += self._run_batch() or 0
+
+        self.wrap_up()
+        if errors:
+            print
+            print 'There were %d errors while dumping modules.  See the log files in "%s" for details.' % (errors, self._out_path)
+        print
+
+    def _run_batch(self):
+        '''Load and process all our CODs in batch (returns the error count, or None if nothing loaded).'''
         # Parse (but do not resolve, yet) all the cods we have
         if self._cods is None:
             # Magic shortcut to simply load all cached modules
@@ -364,10 +566,11 @@ class Cod2Jar(object):
         # If we got no modules loaded, we're already done...
         if not loaded_cods:
             print "No CODs/Modules loaded; halting..."
-            return
+            return None
 
         # Resolve all modules/classes in turn
         num_classes = 0
+        writer = None
         if not self._parse_only:
             P = Progress("Resolving modules", len(loaded_cods))
             ticks = 0
@@ -383,6 +586,8 @@ class Cod2Jar(object):
                 len(self._loader._modules),
                 len(self._loader._classes)
             )
+            if self._demand_load:
+                print "\t(Demand loading: %d dependency modules deferred and not yet loaded)" % len(self._loader.get_avoided_modules())
 
             # Compute the number of classes/routines we have
             num_classes = sum(len(mod.classes) for mod in loaded_cods)
@@ -408,6 +613,14 @@ class Cod2Jar(object):
                 P.update(ticks)
             print
 
+            # If caching is enabled (and not read-only), stream each finished module to a
+            # background writer as we go (pickling/writing overlaps the rest of the pipeline)
+            if self._cache and (not self._read_only):
+                writer = codlib.BackgroundSerialDumper(self._cache_root, self._make_log)
+                if not self._hiscan:
+                    for m in loaded_cods:
+                        self._write_back(writer, m)
+
             # If hiscan is enabled, HIScan all the routines in all our loaded modules
             if self._hiscan:
                 hi_logger = codlib.HILogger(self._hiscan_log)
@@ -427,30 +640,11 @@ class Cod2Jar(object):
                         finally:
                             ticks += 1
                             P.update(ticks)
+                    if writer is not None:
+                        self._write_back(writer, m)
                 print
                 hi_logger.dump_stats()
                 hi_logger.dump_bad_subs()
-
-            # If caching is enabled (and not read-only), dump our loaded modules into the cache
-            # temporarily disabled to make things simpler
-            """
-            if self._cache and (not self._read_only):
-                P = Progress("Caching classes", num_classes)
-                ticks = 0
-                P.update(ticks)
-                for m in loaded_cods:
-                    try:
-                        self._serializer.dump_module(m)
-                    except KeyboardInterrupt:
-                            raise
-                    except Exception as err:
-                        self.log("ERROR: failed to finish caching module '%s'..." % m)
-                        traceback.print_exc(file=self._make_log)
-                    finally:
-                        ticks += len(m.classes)
-                        P.update(ticks)
-                print
-            """
         elif self._disasm_no_resolve:
             P = Progress("Disassembling modules", len(loaded_cods))
             ticks = 0
@@ -469,6 +663,7 @@ class Cod2Jar(object):
         for m in loaded_cods:
             try:
                 self._module_dumper(m)
+                self._record_build(m)
             except KeyboardInterrupt:
                 raise
             except Exception as err:
@@ -476,14 +671,63 @@ class Cod2Jar(object):
                 self.log("ERROR: failed to dump module %s in '%s' format" % (m, self._format))
                 traceback.print_exc(file=self._make_log)
             finally:
+                # (routines nobody looked at won't be now; don't hang on to their code)
+                m.release_code()
                 ticks += len(m.classes)
                 P.update(ticks)
 
-        self.wrap_up()
-        if errors:
+        if writer is not None:
             print
-            print 'There were %d errors while dumping modules.  See the log files in "%s" for details.' % (errors, self._out_path)
-        print
+            print "Waiting for cache write-back to finish..."
+            if writer.close():
+                self.log("ERROR: %d cache entries could not be written back" % writer.errors)
+        return errors
+
+    def _flush_loader(self):
+        '''Replace our loader with a fresh (empty) one.'''
+        stale_cache_entries = self._loader.stale_cache_entries
+        self._note_avoided_modules()
+        del self._loader
+        gc.collect()
+        self._loader = codlib.Loader(
+            self._load_paths,
+            cache_root=self._cache_root,
+            name_db_path=self._names,
+            auto_resolve=self.individual_mode,
+            log_file=self._loader_log,
+            demand_load=self._demand_load
+        )
+        self._loader.stale_cache_entries |= stale_cache_entries
+        if self._manifest is not None:
+            self._manifest.set_loader(self._loader)
+
+    def _build_module(self, cod_name, hi_logger=None):
+        '''Load (and resolve, disassemble, hiscan...) a single module, then dump it.'''
+        m = self._loader.load_module(cod_name)
+        if not self._parse_only:
+            # resolve, actualize, disassemble
+            m.resolve().actualize().disasm()
+            # hiscan if we need to
+            if self._hiscan:
+                for rdef in m.routines:
+                    try:
+                        H = codlib.HIScanner(rdef, hi_logger)
+                        H.scan()
+                    except KeyboardInterrupt:
+                        raise
+                    except Exception as err:
+                        self.log("ERROR: failed to finish scanning routine '%s'..." % rdef)
+                        traceback.print_exc(file=self._make_log)
+        elif self._disasm_no_resolve:
+            m.disasm(False)
+        # dump
+        try:
+            self._module_dumper(m)
+            self._record_build(m)
+        finally:
+            # (routines nobody looked at won't be now; don't hang on to their code)
+            m.release_code()
+        return m
 
     def run_individual_mode(self):
         """ Individual mode performs all steps on an individual COD
@@ -496,8 +740,9 @@ class Cod2Jar(object):
             cods_to_dump = self._cods
         else:
             cods_to_dump = self._get_cached_module_names()
-        cods_to_dump.sort()
+        cods_to_dump = self._order_cods(cods_to_dump)
 
+        hi_logger = None
         if self._hiscan:
             hi_logger = codlib.HILogger(self._hiscan_log)
         errors = 0
@@ -507,38 +752,18 @@ class Cod2Jar(object):
         while cods_to_dump:
             if len(self._loader._modules) > self.max_module_count:
                 self.log("WARNING: flushing loader with %d CODs loaded..." % len(self._loader._modules))
-                del self._loader
-                gc.collect()
-                self._loader = codlib.Loader(
-                    self._load_paths,
-                    cache_root=self._cache_root,
-                    name_db_path=self._names,
-                    auto_resolve=True,
-                    log_file=self._loader_log
-                )
+                self._flush_loader()
             cod_name = cods_to_dump.pop(0)
             self.log("Dumping '%s'" % os.path.basename(cod_name))
             try:
-                m = self._loader.load_module(cod_name)
-                if not self._parse_only:
-                    # resolve, actualize, disassemble
-                    m.resolve().actualize().disasm()
-                    # hiscan if we need to
-                    if self._hiscan:
-                        for rdef in m.routines:
-                            try:
-                                H = codlib.HIScanner(rdef, hi_logger)
-                                H.scan()
-                            except KeyboardInterrupt:
-                                raise
-                            except Exception as err:
-                                self.log("ERROR: failed to finish scanning routine '%s'..." % rdef)
-                                traceback.print_exc(file=self._make_log)
-                elif self._disasm_no_resolve:
-                    m.disasm(False)
-                # dump
-                self._module_dumper(m)
-                
+                if self._reuse_stored_module(cod_name):
+                    self.log("\t(unchanged; reusing stored module)")
+                    self._reused_modules += 1
+                    ticks += 1
+                    P.update(ticks)
+                    continue
+                self._build_module(cod_name, hi_logger)
+
                 # flush logs
                 self._make_log.flush()
                 self._loader_log.flush()
@@ -568,6 +793,164 @@ class Cod2Jar(object):
             print 'There were %d errors while dumping modules.  See the log files in "%s" for details.' % (errors, self._out_path)
         print
 
+    def _warm_up(self):
+        '''Load, resolve and actualize the pool's base modules (which every worker then inherits).'''
+        P = Progress("Warming up base modules", len(self._pool_base))
+        ticks = 0
+        P.update(ticks)
+        for name in self._pool_base:
+            try:
+                self._loader.load_module(name).resolve().actualize()
+            except KeyboardInterrupt:
+                raise
+            except Exception as err:
+                self.log("ERROR: failed to warm up base module '%s'..." % name)
+                traceback.print_exc(file=self._make_log)
+            ticks += 1
+            P.update(ticks)
+        print
+
+    def _pool_worker(self, slot, gen, tasks, results):
+        '''Body of a (forked) pool worker: dump the CODs we are handed until told to stop (or full).
+
+            Our messages carry our slot and generation (how many workers that slot has had
+            before us), so the parent can tell them from a predecessor's late ones.
+        '''
+        # every worker slot gets its own logs (replacement workers append to them)
+        self._make_log = open(os.path.join(self._out_path, "cod2jar.%d.log" % slot), 'at')
+        self._loader_log = self._loader._log = open(os.path.join(self._out_path, "loader.%d.log" % slot), 'at')
+        self._hiscan_log = open(os.path.join(self._out_path, "hiscan.%d.log" % slot), 'at')
+        hi_logger = None
+        if self._hiscan:
+            hi_logger = codlib.HILogger(self._hiscan_log)
+        try:
+            while True:
+                cod_name = tasks.get()
+                if cod_name is None:
+                    break
+                self.log("Dumping '%s'" % os.path.basename(cod_name))
+                ok, name, entry = True, None, None
+                try:
+                    m = self._build_module(cod_name, hi_logger)
+                    name = m.name
+                    if self._manifest is not None:
+                        # (our copy of the manifest dies with us; hand the parent what we recorded)
+                        entry = self._manifest.modules.get(name)
+                except MemoryError:
+                    self.log("ERROR: ran out of memory on module '%s' with %d CODs loaded..." % (cod_name, len(self._loader._modules)))
+                    results.put(('dumped', slot, gen, False, True, None, None))
+                    break
+                except KeyboardInterrupt:
+                    raise
+                except Exception as err:
+                    self.log("ERROR: failed to dump COD '%s'..." % cod_name)
+                    traceback.print_exc(file=self._make_log)
+                    ok = False
+                # (a fresh fork of the warm parent beats flushing our own loader)
+                retiring = len(self._loader._modules) > self.max_module_count
+                results.put(('dumped', slot, gen, ok, retiring, name, entry))
+                if retiring:
+                    self.log("Retiring worker with %d CODs loaded..." % len(self._loader._modules))
+                    break
+            if hi_logger is not None:
+                hi_logger.dump_stats()
+                hi_logger.dump_bad_subs()
+        finally:
+            for fd in (self._make_log, self._loader_log, self._hiscan_log):
+                fd.close()
+            results.put(('exit', slot, gen))
+
+    def _spawn_worker(self, slot, gen, results):
+        '''Fork a pool worker (with a task queue of its own); returns (process, task queue, generation).'''
+        # Don't let the children inherit (and re-flush) our buffered output
+        sys.stdout.flush()
+        for fd in (self._make_log, self._loader_log, self._hiscan_log):
+            fd.flush()
+        tasks = multiprocessing.Queue()
+        W = multiprocessing.Process(target=self._pool_worker, args=(slot, gen, tasks, results))
+        W.daemon = True
+        W.start()
+        return W, tasks, gen
+
+    def run_pool_mode(self):
+        """ Pool mode loads, resolves and actualizes the base
+            (platform) modules once, then forks workers that inherit
+            that loader copy-on-write and dump the CODs they are
+            handed, each as in individual mode.  A worker whose loader
+            fills up retires and is replaced by a fresh fork of the
+            (still warm) parent instead of flushing to a cold loader.
+        """
+        if self._cods:
+            cods_to_dump = self._cods
+        else:
+            cods_to_dump = self._get_cached_module_names()
+        cods_to_dump = self._order_cods(cods_to_dump)
+
+        self._warm_up()
+
+        # Hand out CODs one at a time, so we always know what each worker is busy with
+        results = multiprocessing.Queue()
+        workers = {}
+        current = {}
+        def dispatch(slot):
+            if cods_to_dump:
+                current[slot] = cods_to_dump.pop(0)
+                workers[slot][1].put(current[slot])
+            else:
+                workers[slot][1].put(None)
+        for slot in xrange(min(self._pool_size, len(cods_to_dump))):
+            workers[slot] = self._spawn_worker(slot, 0, results)
+            dispatch(slot)
+
+        errors = 0
+        P = Progress("Dumping modules (%d workers)" % len(workers), len(cods_to_dump) + len(current))
+        ticks = 0
+        P.update(ticks)
+        while workers:
+            try:
+                msg = results.get(timeout=1.0)
+            except Queue.Empty:
+                # Did a worker die on us (without a word)?
+                for slot, (W, tasks, gen) in workers.items():
+                    if not W.is_alive():
+                        msg = ('exit', slot, gen)
+                        break
+                else:
+                    continue
+            kind, slot, gen = msg[:3]
+            if (slot not in workers) or (workers[slot][2] != gen):
+                # (a late message from a worker we already buried)
+                continue
+            if kind == 'dumped':
+                ok, retiring, name, entry = msg[3:]
+                del current[slot]
+                if not ok:
+                    errors += 1
+                elif (self._manifest is not None) and (entry is not None):
+                    self._manifest.modules[name] = entry
+                ticks += 1
+                P.update(ticks)
+                if not retiring:
+                    dispatch(slot)
+            elif kind == 'exit':
+                workers.pop(slot)[0].join()
+                lost = current.pop(slot, None)
+                if lost is not None:
+                    self.log("ERROR: worker %d died while dumping COD '%s'..." % (slot, lost))
+                    errors += 1
+                    ticks += 1
+                    P.update(ticks)
+                if cods_to_dump:
+                    workers[slot] = self._spawn_worker(slot, gen + 1, results)
+                    dispatch(slot)
+        print
+
+        self.wrap_up()
+        if errors:
+            print
+            print 'There were %d errors while dumping modules.  See the log files in "%s" for details.' % (errors, self._out_path)
+        print
+
     def zip_up(self, path, out_filename, zip_extensions):
         try:
             zf = zipfile.ZipFile(out_filename, 'w', zipfile.ZIP_DEFLATED)
@@ -582,7 +965,26 @@ class Cod2Jar(object):
                     zf.write(source_file_path, relpath)
         zf.close()
 
+    def _note_avoided_modules(self):
+        '''Tally what demand-loading saved our current loader from loading.'''
+        if self._demand_load:
+            self._avoided_modules.update(self._loader.get_avoided_modules())
+            self._loaded_modules.update(self._loader._modules)
+
     def wrap_up(self):
+        if self._manifest is not None:
+            self._manifest.save()
+        if self._demand_load:
+            self._note_avoided_modules()
+            avoided = sorted(self._avoided_modules - self._loaded_modules)
+            self.log("Demand loading avoided loading %d dependency modules" % len(avoided))
+            for name in avoided:
+                self.log("\t%s" % name)
+        if self._loader.stale_cache_entries:
+            self.log("WARNING: bypassed %d stale cache entries (loaded from COD instead):" % len(self._loader.stale_cache_entries))
+            for entry in sorted(self._loader.stale_cache_entries):
+                self.log("\t%s" % entry)
+
         # for jar and cache formats we need to zip up our results
         # after dumping the modules
         if self._format == 'jar':
@@ -600,6 +1002,18 @@ class Cod2Jar(object):
                     self._out_path + '.jar',
                     zip_extensions=['.class',],
                 )
+        elif self._format == 'sqlite':
+            try:
+                self._sqlite_dumper.close()
+            except AttributeError:
+                pass
+        elif self._format == 'store':
+            self._store_dumper.close()
+            self.log("Store: %d modules reused, %d records added, %d records shared (%d distinct records stored)" % (
+                self._reused_modules,
+                self._store_dumper.store.added,
+                self._store_dumper.store.shared,
+                len(self._store_dumper.store)))
         elif self._format == 'cache':
             # caches are always application level (dealt with internally)
             self.zip_up(
@@ -622,7 +1036,9 @@ if __name__ == "__main__":
     OP.add_option("-o", "--output", dest="out_path", default="", metavar="PATH",
                     help="save output dump in PATH")
     OP.add_option("-f", "--format", dest="format", default="jar", metavar="FORMAT",
-                    help="generate output dump a specific FORMAT: [%s]" % ', '.join(Cod2Jar.DUMP_FORMATS))
+                    help="generate output dump a specific FORMAT: [%s] ('pack' writes a packfile cache, 'store' adds a version to a class store)" % ', '.join(Cod2Jar.DUMP_FORMATS))
+    OP.add_option("-V", "--store-version", dest="store_version", default=None, metavar="VERSION",
+                    help="name of the OS VERSION being added to the class store at PATH (for the 'store' format)")
     OP.add_option("-a", "--application-dump", dest="application_dump", action="store_true", default=False,
                     help="Create dumps per application rather than a global dump (necessary between CODs with identical classpaths)")
     OP.add_option("-i", "--individual-mode", dest="individual_mode", action="store_true", default=False,
@@ -633,6 +1049,18 @@ if __name__ == "__main__":
     #                help="Do not update dump files if they already exist (always perform a backup if in doubt)")
     OP.add_option("-s", "--no-hiscan", dest="hiscan", action="store_false", default=True,
                     help="Do not use heuristic instruction scanning to resolve dynamic type information")
+    OP.add_option("-u", "--incremental", dest="incremental", action="store_true", default=False,
+                    help="Only rebuild the modules whose COD (or the classes they use from dependencies) changed since the last run into PATH")
+    OP.add_option("-w", "--write-back", dest="write_back", action="store_true", default=False,
+                    help="In batch mode, also write resolved/scanned modules back into the cache FOLDER given by -c (in the background)")
+    OP.add_option("-M", "--memory-budget", dest="memory_budget", type="int", default=0, metavar="MB",
+                    help="In batch mode, split the CODs into batches whose dependencies should fit in MB megabytes")
+    OP.add_option("-p", "--pool", dest="pool_size", type="int", default=0, metavar="WORKERS",
+                    help="Fork WORKERS processes (sharing a loader warmed up with the base modules) to dump CODs in parallel")
+    OP.add_option("-b", "--pool-base", dest="pool_base", default="net_rim_cldc", metavar="MODULES",
+                    help="semi-colon-delimited list of base MODULES to load/resolve once before forking a worker pool")
+    OP.add_option("-d", "--demand-load", dest="demand_load", action="store_true", default=False,
+                    help="Only load the imports/siblings of a module once a class reference, fixup or superclass actually points into them")
     #OP.add_option("-z", "--zip-cache", dest="zip_cache", default=None, metavar="ZIPFILE",
     #                help="compress cache into ZIPFILE after completing job")
     opts, args = OP.parse_args()
@@ -642,7 +1070,7 @@ if __name__ == "__main__":
         OP.error("Must specify at least one input COD file/folder (or the magic cache flag 'ALL')")
     if not opts.out_path:
         OP.error('Must specify an output path')
-    if os.path.exists(opts.out_path):
+    if os.path.exists(opts.out_path) and (not opts.incremental) and (opts.format.lower() != 'store'):
         OP.error("'%s' already exists!" % opts.out_path)
 
     Cod2Jar(args, opts).run()
@@ -146,8 +146,9 @@ class PackageNav(wx.TreeCtrl):
 
         if cod_name:
             package_name = self.get_package_name(self.menu_item)
-            cod = ce.cods[cod_name]
-            ce.function_flow_graph_package(package_name, cod)
+            cod = ce.load_cod(cod_name)
+            if cod:
+                ce.function_flow_graph_package(package_name, cod)
 
     def OnMenuFunctionGraph(self, event):
         global ce
@@ -155,7 +156,9 @@ class PackageNav(wx.TreeCtrl):
 
         if cod_name:
             package_name = self.get_package_name(self.menu_item)
-            cod = ce.cods[cod_name]
+            cod = ce.load_cod(cod_name)
+            if not cod:
+                return
             class_def = cod.load_class(package_name)
             routine_defs = {}
             for routine_def in class_def.routines:
@@ -212,36 +215,45 @@ class PackageNav(wx.TreeCtrl):
         self.PopupMenu(menu)
         menu.Destroy()
 
-    def add_package(self, class_def, cod_name):
+    def add_package(self, class_name, cod_name):
         cur = self.root
-        for name in str(class_def).split('/'):
-            # try to find it
-            matching_child = None
-            
-            (child, cookie) = self.GetFirstChild(cur)
-            while child.IsOk():
-                if self.GetItemText(child) == name:
-                    matching_child = child
-                    break
-                (child, cookie) = self.GetNextChild(cur, cookie)
-
-            if matching_child:
-                cur = matching_child
-            else:
+        path = ''
+        for name in class_name.split('/'):
+            path += '/' + name
+            try:
+                cur = self._nodes[path]
+            except KeyError:
                 # otherwise create it
-                cur = self.AppendItem(cur, name)
+                cur = self._nodes[path] = self.AppendItem(cur, name)
         self.SetPyData(cur, cod_name)
 
+    def add_module(self, cod_name, cod):
+        for class_def in cod.classes:
+            self.add_package(str(class_def), cod_name)
+
     def reset(self):
         self.DeleteAllItems()
-        self.root = self.AddRoot('Currently loaded packages')
+        self.root = self.AddRoot('Packages')
+        # (tree items by class/package path)
+        self._nodes = {}
 
     def update(self):
         global ce
         self.reset()
+        if ce.loader:
+            # Every class on the cod path(s), from the loader's class index (no need to load anything)
+            index = ce.loader.class_index
+            cod_names = {}
+            for module in index.modules():
+                cod_path = ce.loader._module_path_map.get(module)
+                if cod_path is not None:
+                    cod_names[module] = os.path.splitext(os.path.basename(cod_path))[0]
+            for class_name in index.names():
+                base_module_name, module = index.lookup(class_name)[0]
+                if cod_names.get(module) in ce.cod_filenames:
+                    self.add_package(class_name, cod_names[module])
         for cod_name in ce.cods:
-            for class_def in ce.cods[cod_name].classes:
-                self.add_package(class_def, cod_name)
+            self.add_module(cod_name, ce.cods[cod_name])
         self.Expand(self.root)
 
 
@@ -1263,6 +1275,13 @@ class CodExplorer(wx.Frame):
                     self.cod_names.append(cod_name)
                     self.cod_filenames[cod_name] = cod_filename
 
+        # (dependency graph of the cod path(s), kept next to the first one like the default cache)
+        self.graph = codlib.DependencyGraph(self.paths[0].rstrip('/\\') + '_depgraph.db', self.log).scan(self.paths)
+        try:
+            self.graph.save()
+        except (IOError, OSError) as err:
+            self.log.WriteText('Could not save dependency graph %s: %s\n' % (self.graph.path, err))
+
         self.cod_nav_tab.update()
         self.package_nav_tab.update()
 
@@ -1276,6 +1295,7 @@ class CodExplorer(wx.Frame):
         self.forward_history = []
         self.current_cod_name = None
         self.loader = None
+        self.graph = None
         self.paths = []
         self.cache_path = None
         self.set_text('')
@@ -1293,7 +1313,7 @@ class CodExplorer(wx.Frame):
                 cod.actualize()
                 cod.disasm()
                 self.cods[cod_name] = cod
-                self.package_nav_tab.update()
+                self.package_nav_tab.add_module(cod_name, cod)
                 self.sb.SetStatusText('Loaded %s (%s)' % (cod_name, self.cod_filenames[cod_name]))
                 self.log.WriteText("Loader cache: %d modules containing %d classes\n" % (len(self.loader._modules), len(self.loader._classes)))
             except Exception, e:
@@ -1575,11 +1595,15 @@ class CodExplorer(wx.Frame):
             self.log.WriteText('Export completed\n')
 
     def dependency_graph(self, title = 'Dependency flow graph'):
+        # (module name -> cod name)
+        cod_names = dict((self.graph.resolve(self.cod_filenames[cod_name]), cod_name) for cod_name in self.cod_names)
         dependencies = set()
-        for cod_name in self.cod_names:
-            deps = [n for n, v in codlib.utils.quick_get_imports(self.cod_filenames[cod_name])]
-            for dep in deps:
-                dependencies.add((cod_name, dep))
+        for name, cod_name in cod_names.iteritems():
+            if name is None:
+                continue
+            for dep in self.graph.imports(name):
+                dependencies.add((cod_name, cod_names.get(dep, dep)))
+        in_cycles = set(cod_names.get(name) for cycle in self.graph.cycles() for name in cycle)
 
         gdl_filename = 'dependency_graph.gdl'
         with open(gdl_filename, 'wt') as fd:
@@ -1588,7 +1612,7 @@ class CodExplorer(wx.Frame):
             #print >> fd, '/*layoutalgorithm: mindepth*/'
             for cod_name in self.cod_names:
                 label = "%s" % (cod_name)
-                border_col = 'black'
+                border_col = 'red' if cod_name in in_cycles else 'black'
                 print >> fd, 'node:{title:"%s" bordercolor:%s label:"%s"}' % (cod_name, border_col, label)
             for cod, cod_dep in dependencies:
                 extra = ''
@@ -0,0 +1,2 @@
+@REM Use Python to run the script from the current directory, passing all parameters
+@python %~dp0\cod_pack.py %*
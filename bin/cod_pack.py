@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2012, derrotehund361@googlemail.com
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met: 
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer. 
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution. 
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Import a zipped (or folder) class cache into a packfile, or export packfiles
+back into a zipped class cache.  A version manifest of a class store can be
+exported into a (stand-alone) packfile as well.
+"""
+
+import os, sys, glob
+from optparse import OptionParser
+from codlib import packfile, store
+
+if __name__ == '__main__':
+    usage = 'usage: %prog CACHE_ZIP_OR_FOLDER_OR_MANIFEST OUT.pack\n       %prog PACKFILE_OR_FOLDER [...] OUT.zip'
+    parser = OptionParser(usage)
+
+    (options, args) = parser.parse_args()
+    if len(args) < 2:
+        parser.error('incorrect number of arguments')
+
+    sources, dest_path = args[:-1], args[-1]
+    if os.path.exists(dest_path):
+        parser.error("'%s' already exists" % dest_path)
+
+    if dest_path.endswith('.pack'):
+        # Import
+        if len(sources) != 1:
+            parser.error('can only import one cache at a time')
+        if store.is_manifest(sources[0]):
+            count = store.export_version(sources[0], dest_path)
+        else:
+            count = packfile.pack_from_cache(sources[0], dest_path)
+        print 'Packed %d records into %s' % (count, dest_path)
+    elif dest_path.endswith('.zip'):
+        # Export
+        pack_paths = []
+        for source in sources:
+            if os.path.isdir(source):
+                pack_paths += sorted(glob.glob(os.path.join(source, '*.pack')))
+            elif packfile.is_packfile(source):
+                pack_paths.append(source)
+            else:
+                parser.error("'%s' is not a packfile (or a folder of them)" % source)
+        count = packfile.zip_from_packs(pack_paths, dest_path)
+        print 'Exported %d records from %d packfiles into %s' % (count, len(pack_paths), dest_path)
+    else:
+        parser.error('output must be a .pack (import) or .zip (export) file')
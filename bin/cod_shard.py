@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2012, derrotehund361@googlemail.com
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met: 
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer. 
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution. 
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Split a cod2jar run into closure-aware shards and coordinate the workers that
+process them through a shared directory (which may live on NFS, to spread the
+work across several boxes), then merge the shards' jars and logs.
+"""
+
+import os, sys, subprocess
+from optparse import OptionParser
+from codlib import BatchPlanner, DependencyGraph
+from codlib.shard import ShardQueue, ShardError, merge_jars, merge_logs
+
+COD2JAR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cod2jar.py')
+
+def do_plan(options, args):
+    shared_dir, cods = args[0], args[1:]
+    all_cods = []
+    for c in cods:
+        if os.path.isdir(c):
+            all_cods += sorted(os.path.join(c, x) for x in os.listdir(c) if x.endswith('.cod'))
+        else:
+            all_cods.append(c)
+    load_path = [x for x in options.load_path.split(';') if x]
+    graph = DependencyGraph(options.graph).scan(load_path + cods)
+    shards = BatchPlanner(graph=graph).shard(all_cods, options.shards)
+    ShardQueue(shared_dir).create(shards, options.load_path)
+    graph.save()
+    graph.save(os.path.join(shared_dir, 'depgraph.db'))
+    print 'Planned %d shards for %d CODs in %s' % (len(shards), len(all_cods), shared_dir)
+
+def do_work(options, args):
+    shared_dir, cod2jar_args = args[0], args[1:]
+    queue = ShardQueue(shared_dir)
+    load_path = queue.get_load_path()
+    worked = failed = 0
+    while True:
+        n = queue.claim()
+        if n is None:
+            break
+        cods = queue.get_cods(n)
+        print 'Working on shard %d (%d CODs)...' % (n, len(cods))
+        command = [sys.executable, COD2JAR] + cod2jar_args
+        if load_path:
+            command += ['-l', load_path]
+        command += ['-o', queue.output_path(n)] + cods
+        status = subprocess.call(command)
+        queue.finish(n, status)
+        worked += 1
+        if status:
+            failed += 1
+            print 'Shard %d failed (exit status %d)' % (n, status)
+    print 'Processed %d shards (%d failed); no shards left to claim' % (worked, failed)
+
+def do_status(options, args):
+    queue = ShardQueue(args[0])
+    counts = {}
+    for n in queue.shards():
+        state, detail = queue.get_status(n)
+        counts[state] = counts.get(state, 0) + 1
+        if state == 'done':
+            print '%3d: done (exit status %d)' % (n, detail)
+        elif state == 'claimed':
+            print '%3d: claimed by %s' % (n, detail)
+        else:
+            print '%3d: pending' % n
+    print ', '.join('%d %s' % (counts[s], s) for s in sorted(counts))
+
+def do_merge(options, args):
+    shared_dir, out_jar = args
+    queue = ShardQueue(shared_dir)
+    jar_paths = []
+    for n in queue.shards():
+        state, detail = queue.get_status(n)
+        if state != 'done':
+            raise ShardError('shard %d is not done yet (%s)' % (n, state))
+        if detail:
+            print 'WARNING: shard %d exited with status %d' % (n, detail)
+        jar_path = queue.output_path(n) + '.jar'
+        if os.path.isfile(jar_path):
+            jar_paths.append(jar_path)
+    entries, duplicates = merge_jars(jar_paths, out_jar)
+    print 'Merged %d entries from %d shard jars into %s (%d duplicates dropped)' % (entries, len(jar_paths), out_jar, duplicates)
+    for log_path in merge_logs(queue, shared_dir):
+        print 'Merged logs into %s' % log_path
+
+def do_release(options, args):
+    queue = ShardQueue(args[0])
+    for n in map(int, args[1:]):
+        queue.release(n)
+        print 'Released shard %d' % n
+
+COMMANDS = {
+    'plan': (do_plan, 2, None),
+    'work': (do_work, 1, None),
+    'status': (do_status, 1, 1),
+    'merge': (do_merge, 2, 2),
+    'release': (do_release, 2, None),
+}
+
+if __name__ == '__main__':
+    usage = '\n'.join([
+        'usage: %prog plan [-n SHARDS] [-l FOLDERS] [-g GRAPH] SHARED_DIR COD_PATH1 [COD_PATH2 [...]]',
+        '       %prog work SHARED_DIR [COD2JAR_OPTIONS]',
+        '       %prog status SHARED_DIR',
+        '       %prog merge SHARED_DIR OUT.jar',
+        '       %prog release SHARED_DIR SHARD [...]',
+    ])
+    parser = OptionParser(usage)
+    parser.add_option("-n", "--shards", dest="shards", type="int", default=4,
+                      help="number of SHARDS to split the CODs into (for plan)")
+    parser.add_option("-l", "--load-path", dest="load_path", default="", metavar="FOLDERS",
+                      help="semi-colon-delimited list of FOLDERS from which to load COD dependencies (for plan)")
+    parser.add_option("-g", "--graph", dest="graph", default=None, metavar="GRAPH",
+                      help="dependency GRAPH file to reuse and update (for plan; a copy is kept in SHARED_DIR)")
+
+    if (len(sys.argv) < 2) or (sys.argv[1] not in COMMANDS):
+        parser.error('must specify one of: %s' % ', '.join(sorted(COMMANDS)))
+    command = sys.argv[1]
+    if command == 'work':
+        # (anything after "work SHARED_DIR" is passed on to cod2jar as-is)
+        options, args = None, sys.argv[2:]
+    else:
+        (options, args) = parser.parse_args(sys.argv[2:])
+    func, min_args, max_args = COMMANDS[command]
+    if (len(args) < min_args) or ((max_args is not None) and (len(args) > max_args)):
+        parser.error('incorrect number of arguments')
+
+    try:
+        func(options, args)
+    except ShardError as ex:
+        parser.error(str(ex))
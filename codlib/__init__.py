@@ -33,11 +33,16 @@ from resolve import Module, Loader
 from utils import load_cod_file, load_cod_raw, decode_identifier
 from disasm import _OPCODES
 from dump import XMLDumper, UnresolvedDumper, ResolvedDumper
-from dump import PackageDumper, BinaryDumper, SerialDumper
-from dump import JasminDumper, ClassDumper
+from dump import PackageDumper, BinaryDumper, SerialDumper, BackgroundSerialDumper, PackfileDumper, StoreDumper
+from dump import JasminDumper, ClassDumper, SQLiteDumper
 import instruction_reference
 from analysis import Subroutine, BasicBlock
 from his import HILogger, HIScanner
+from incremental import BuildManifest
+from hierarchy import ClassHierarchy
+from depgraph import DependencyGraph
+from classindex import ClassIndex
+from planner import BatchPlanner
 import bytecleaver
 
 __all__ = ['utils', 'format', 'resolve', 'dump']
@@ -150,13 +150,13 @@ class BasicBlock:
 class Subroutine:
     def __init__(self, routine):
         self.routine = routine
+        self._instruction_numbers = dict((instruction.offset, inum) for inum, instruction in enumerate(routine.instructions))
         self.basic_blocks = self._get_basic_blocks()
         self.G = None
         
     def get_instruction_number(self, offset):
-        for inum, instruction in enumerate(self.routine.instructions):
-            if instruction.offset == offset:
-                return inum
+        if offset in self._instruction_numbers:
+            return self._instruction_numbers[offset]
         raise(AnalysisException('Unable to find instruction at offset %d in routine %s.%s' % (offset, str(self.routine.parent), self.routine.java_def())))
 
     def _get_basic_blocks(self):
@@ -0,0 +1,138 @@
+#! /usr/bin/env python
+
+# Copyright (c) 2012, derrotehund361@googlemail.com
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met: 
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer. 
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution. 
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+classindex: Searchable index of the (JTS) class names defined by a set of modules.
+
+Maps every fully qualified class name to the module (and base module, i.e.
+the first sibling) that defines it, without loading those modules: entries come
+from module cache records (which list their classes) or from a quick scan of
+each COD's class-def table.  Supports exact, prefix, glob and regex queries.
+"""
+
+import os
+import re
+import sys
+import bisect
+import fnmatch
+
+import utils
+
+class ClassIndex(object):
+    '''Index of class names -> [(base module name, module name), ...].'''
+
+    def __init__(self, log_file=sys.stderr):
+        self._log = log_file
+        self._owners = {}
+        # (sorted list of every class name, for prefix/glob queries; rebuilt on demand)
+        self._names = None
+        # module name -> base module name
+        self._base_names = {}
+
+    def log(self, msg):
+        print >> self._log, msg
+
+    def add_module(self, module_name, base_module_name, class_names):
+        '''Index the classes of one module (the first module to define a class is listed first).'''
+        if module_name in self._base_names:
+            return
+        self._base_names[module_name] = base_module_name
+        owner = (base_module_name, module_name)
+        for name in class_names:
+            self._owners.setdefault(name, []).append(owner)
+        self._names = None
+
+    def add_cached_module(self, record):
+        '''Index the classes listed by a module cache record (see SerialDumper).'''
+        self.add_module(record['name'], record['siblings'][0] if record['siblings'] else record['name'], record['classes'])
+
+    def add_cod(self, cod_path):
+        '''Index the classes defined by a COD (scanning just its class-def table).'''
+        try:
+            name = utils.quick_get_name(cod_path)
+            siblings = utils.quick_get_siblings(cod_path)
+            class_names = utils.quick_get_class_names(cod_path)
+        except Exception as ex:
+            self.log("Unable to read the class names of COD '%s': %s (%s)" % (cod_path, ex, type(ex)))
+            return None
+        self.add_module(name, siblings[0] if siblings else name, class_names)
+        return name
+
+    def scan(self, search_path):
+        '''Index the CODs in a list of folders (and/or COD files).'''
+        for path in search_path:
+            if os.path.isdir(path):
+                for filename in sorted(os.listdir(path)):
+                    if filename.endswith('.cod'):
+                        self.add_cod(os.path.join(path, filename))
+            elif os.path.isfile(path):
+                self.add_cod(path)
+        return self
+
+    # Queries
+    #----------------------------------------------------------
+    def __len__(self):
+        return len(self._owners)
+
+    def __contains__(self, class_name):
+        return class_name in self._owners
+
+    def names(self):
+        '''All indexed class names, sorted.'''
+        if self._names is None:
+            self._names = sorted(self._owners)
+        return self._names
+
+    def modules(self):
+        '''Names of the indexed modules.'''
+        return sorted(self._base_names)
+
+    def get_base_module_name(self, module_name):
+        return self._base_names[module_name]
+
+    def lookup(self, class_name):
+        '''The (base module name, module name) of every indexed definition of a class.'''
+        return self._owners.get(class_name, [])
+
+    def find_prefix(self, prefix):
+        '''Names of the classes starting with a prefix (e.g., a package: "net/rim/device/api/ui/").'''
+        names = self.names()
+        lo = bisect.bisect_left(names, prefix)
+        hi = lo
+        while (hi < len(names)) and names[hi].startswith(prefix):
+            hi += 1
+        return names[lo:hi]
+
+    def find_glob(self, pattern):
+        '''Names of the classes matching a shell-style pattern (e.g., "net/rim/*/ui/*Field").'''
+        # (only the names sharing the pattern's literal prefix can match)
+        literal = re.split(r'[*?\[]', pattern, 1)[0]
+        matches = re.compile(fnmatch.translate(pattern)).match
+        return [x for x in self.find_prefix(literal) if matches(x)]
+
+    def find_regex(self, pattern, flags=0):
+        '''Names of the classes in which a regular expression matches (anywhere; anchor it if need be).'''
+        search = re.compile(pattern, flags).search
+        return [x for x in self.names() if search(x)]
@@ -0,0 +1,291 @@
+#! /usr/bin/env python
+
+# Copyright (c) 2012, derrotehund361@googlemail.com
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met: 
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer. 
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution. 
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+depgraph: Module dependency graph built from (and kept in step with) COD headers.
+
+Nodes are modules (by their main name; aliases resolve to it), edges are the
+imports and siblings named in each COD's header.  The graph can be saved to
+disk; rescanning it only re-reads the headers of CODs whose size or mtime
+changed, so closure, reverse-dependency, ordering and cycle queries don't have
+to re-parse every COD every time.
+"""
+
+import os
+import sys
+import cPickle
+
+import utils
+
+class DependencyGraph(object):
+    '''Dependency graph of the modules in a set of CODs (see scan()).'''
+
+    VERSION = 1
+
+    def __init__(self, path=None, log_file=sys.stderr):
+        self.path = path
+        self._log = log_file
+        # COD path -> {'names':..., 'imports':..., 'siblings':..., 'size':..., 'mtime':...}
+        self._cods = {}
+        # COD paths in the order they were scanned (the order the loader searches them in)
+        self._order = []
+        if (path is not None) and os.path.isfile(path):
+            try:
+                with open(path, 'rb') as fd:
+                    G = cPickle.load(fd)
+                if G.get('version') == self.VERSION:
+                    self._cods = G['cods']
+                    self._order = G.get('order') or sorted(self._cods)
+            except Exception as ex:
+                self.log("WARNING: ignoring unreadable dependency graph '%s': %s (%s)" % (path, ex, type(ex)))
+        self._dirty = False
+        self._reindex()
+
+    def log(self, msg):
+        print >> self._log, msg
+
+    def _reindex(self):
+        # module name/alias -> main name, main name -> COD path
+        self._names = {}
+        self._paths = {}
+        self._edges = {}
+        self._rdeps = None
+        self._closures = {}
+        for cod_path in self._order:
+            self._index(cod_path, self._cods[cod_path]['names'])
+
+    def _index(self, cod_path, names):
+        if names[0] not in self._paths:
+            # (first COD of a name wins, as with the loader's search path)
+            self._paths[names[0]] = cod_path
+            for name in names:
+                self._names.setdefault(name, names[0])
+        self._edges = {}
+        self._rdeps = None
+        self._closures = {}
+
+    def add_cod(self, cod_path):
+        '''Index (or refresh) the header of one COD; returns its main module name (or None).'''
+        cod_path = os.path.abspath(cod_path)
+        try:
+            st = os.stat(cod_path)
+            entry = self._cods.get(cod_path)
+            if (entry is None) or (entry['size'], entry['mtime']) != (st.st_size, int(st.st_mtime)):
+                new_cod = entry is None
+                entry = self._cods[cod_path] = {
+                    'names': utils.quick_get_module_names(cod_path),
+                    'imports': [name for name, version in utils.quick_get_imports(cod_path)],
+                    'siblings': utils.quick_get_siblings(cod_path),
+                    'size': st.st_size,
+                    'mtime': int(st.st_mtime),
+                }
+                self._dirty = True
+                if new_cod:
+                    self._order.append(cod_path)
+                    self._index(cod_path, entry['names'])
+                else:
+                    self._reindex()
+        except Exception as ex:
+            self.log("Unable to read the header of COD '%s': %s (%s)" % (cod_path, ex, type(ex)))
+            return None
+        return self._cods[cod_path]['names'][0]
+
+    def scan(self, search_path):
+        '''Bring the graph up to date with the CODs in a list of folders (and/or COD files).'''
+        seen = set()
+        order = []
+        for path in search_path:
+            if os.path.isdir(path):
+                cod_paths = [os.path.join(path, x) for x in sorted(os.listdir(path)) if x.endswith('.cod')]
+            elif os.path.isfile(path):
+                cod_paths = [path]
+            else:
+                continue
+            for cod_path in cod_paths:
+                abs_path = os.path.abspath(cod_path)
+                if abs_path not in seen:
+                    seen.add(abs_path)
+                    order.append(abs_path)
+                self.add_cod(cod_path)
+        # Forget CODs that are gone
+        for cod_path in self._cods.keys():
+            if (cod_path not in seen) and (not os.path.isfile(cod_path)):
+                del self._cods[cod_path]
+                self._dirty = True
+        # (CODs we scanned come first, in scan order; any others keep their old order after them)
+        order = [x for x in order if x in self._cods]
+        order += [x for x in self._order if (x not in seen) and (x in self._cods)]
+        if order != self._order:
+            self._order = order
+            self._dirty = True
+        if self._dirty:
+            self._reindex()
+        return self
+
+    def save(self, path=None):
+        '''Save the graph (if it changed since it was loaded).'''
+        path = path or self.path
+        if (path is None) or ((not self._dirty) and os.path.isfile(path)):
+            return
+        with open(path, 'wb') as fd:
+            cPickle.dump({'version': self.VERSION, 'cods': self._cods, 'order': self._order}, fd, cPickle.HIGHEST_PROTOCOL)
+        self._dirty = False
+
+    # Queries
+    #----------------------------------------------------------
+    def resolve(self, name_or_path):
+        '''Get the main module name of a module name/alias or COD path (indexing the COD if need be).'''
+        try:
+            return self._names[name_or_path]
+        except KeyError:
+            pass
+        if name_or_path.endswith('.cod') and os.path.isfile(name_or_path):
+            return self.add_cod(name_or_path)
+        return None
+
+    def __contains__(self, name):
+        return name in self._names
+
+    def modules(self):
+        return sorted(self._paths)
+
+    def get_cod_path(self, name):
+        return self._paths[self._names[name]]
+
+    def get_size(self, name):
+        '''Size (in bytes) of a module's COD.'''
+        return self._cods[self.get_cod_path(name)]['size']
+
+    def imports(self, name):
+        '''Main names of the (known) modules a module imports.'''
+        entry = self._cods[self.get_cod_path(name)]
+        return [self._names[x] for x in entry['imports'] if x in self._names]
+
+    def dependencies(self, name):
+        '''Main names of the (known) modules a module imports or is a sibling of.'''
+        name = self._names[name]
+        try:
+            return self._edges[name]
+        except KeyError:
+            entry = self._cods[self._paths[name]]
+            deps = set(self._names[x] for x in entry['imports'] + entry['siblings'] if x in self._names)
+            deps.discard(name)
+            edges = self._edges[name] = sorted(deps)
+            return edges
+
+    def dependants(self, name):
+        '''Main names of the modules that directly import (or are siblings of) a module.'''
+        if self._rdeps is None:
+            self._rdeps = dict((x, []) for x in self._paths)
+            for x in self._paths:
+                for dep in self.dependencies(x):
+                    self._rdeps[dep].append(x)
+        return self._rdeps[self._names[name]]
+
+    def closure(self, name):
+        '''Main names of every module a module (transitively) depends on, itself included.'''
+        name = self._names[name]
+        try:
+            return self._closures[name]
+        except KeyError:
+            pass
+        seen = set([name])
+        todo = [name]
+        while todo:
+            for dep in self.dependencies(todo.pop()):
+                if dep not in seen:
+                    seen.add(dep)
+                    todo.append(dep)
+        closure = self._closures[name] = frozenset(seen)
+        return closure
+
+    def reverse_closure(self, names):
+        '''Main names of every module that (transitively) depends on any of the given ones, themselves included.'''
+        seen = set(self._names[x] for x in names if x in self._names)
+        todo = list(seen)
+        while todo:
+            for dependant in self.dependants(todo.pop()):
+                if dependant not in seen:
+                    seen.add(dependant)
+                    todo.append(dependant)
+        return seen
+
+    def _components(self, edges):
+        '''Strongly connected components (Tarjan's), each sorted, dependencies before dependants.'''
+        index = {}
+        low = {}
+        stack = []
+        on_stack = set()
+        components = []
+        for root in self.modules():
+            if root in index:
+                continue
+            index[root] = low[root] = len(index)
+            stack.append(root)
+            on_stack.add(root)
+            work = [(root, iter(edges(root)))]
+            while work:
+                node, successors = work[-1]
+                for succ in successors:
+                    if succ not in index:
+                        index[succ] = low[succ] = len(index)
+                        stack.append(succ)
+                        on_stack.add(succ)
+                        work.append((succ, iter(edges(succ))))
+                        break
+                    elif succ in on_stack:
+                        low[node] = min(low[node], index[succ])
+                else:
+                    work.pop()
+                    if work:
+                        parent = work[-1][0]
+                        low[parent] = min(low[parent], low[node])
+                    if low[node] == index[node]:
+                        component = []
+                        while True:
+                            x = stack.pop()
+                            on_stack.discard(x)
+                            component.append(x)
+                            if x == node:
+                                break
+                        components.append(sorted(component))
+        return components
+
+    def topological_order(self, names=None):
+        '''Order modules (all, or just the given ones) so dependencies come before their dependants.
+
+            Modules that depend on each other (e.g., siblings) can't be ordered
+            and simply come out next to each other.
+        '''
+        order = [x for component in self._components(self.dependencies) for x in component]
+        if names is None:
+            return order
+        wanted = set(self._names[x] for x in names if x in self._names)
+        return [x for x in order if x in wanted]
+
+    def cycles(self, include_siblings=False):
+        '''Groups of modules that (transitively) import each other.'''
+        edges = self.dependencies if include_siblings else self.imports
+        return [c for c in self._components(edges) if len(c) > 1]
@@ -31,6 +31,9 @@ from bytecleaver import *
 from utils import TypeToken, TypeList, Primitive
 from instruction_reference import branches, conditional_branches, compound_branches
 import sys
+import struct as _struct
+from array import array as _array
+from bisect import bisect_left
 from struct import unpack
 from StringIO import StringIO
 import traceback
@@ -228,6 +231,13 @@ _ARRAY_UNPACK_CODES = {
     11: 'f',
     12: 'd',
 }
+# array.array type codes with the same item size as each array type (for
+# keeping array-init blobs as compact arrays rather than lists of numbers)
+_ARRAY_BLOB_CODES = {}
+for _tc, _code in _ARRAY_UNPACK_CODES.iteritems():
+    _code = {'q': 'l'}.get(_code, _code)
+    if _array(_code).itemsize == _ARRAY_SIZES[_tc]:
+        _ARRAY_BLOB_CODES[_tc] = _code
 
 class BadOpcodeError(Exception): pass
 
@@ -254,6 +264,7 @@ LitOperand.register(int)
 LitOperand.register(long)
 LitOperand.register(float)
 LitOperand.register(basestring)
+LitOperand.register(_array)
 
 class BadOperand(object):
     def __init__(self, op):
@@ -266,9 +277,12 @@ class BadOperand(object):
         return "<bad-op: '%s'>" % self.op
 
 class Instruction(object):
-    __slots__ = ['offset', 'opcode', '_name', '_ops', '_fixups', 'operands',  'totos']
+    __slots__ = ['offset', 'opcode', '_name', '_ops', '_fixups', 'operands',  '_totos', '_home']
     
     def __init__(self, offset, opcode, operands, fixups):
+        # (stream, index) we were materialized from (see InstructionStream), if any
+        self._home = None
+        self._totos = None
         if (offset is None) and (opcode is None) and (operands is None) and (fixups is None): return
         self.offset = offset
         self.opcode = opcode
@@ -279,11 +293,36 @@ class Instruction(object):
         self._ops = operands
         self._fixups = fixups
         self.operands = self._ops[:]
-        
-        # Type-on-Top-of-Stack is always unknown initially
-        self.totos = None
     
-    def fixup(self, routine, auto_resolve = True):
+    def _get_totos(self):
+        return self._totos
+    
+    def _set_totos(self, totos):
+        self._totos = totos
+        if self._home is not None:
+            stream, index = self._home
+            if totos is None:
+                stream.totos.pop(index, None)
+            else:
+                stream.totos[index] = totos
+    
+    # Type-on-Top-of-Stack (always unknown initially)
+    totos = property(_get_totos, _set_totos)
+    
+    def set_operand(self, index, value):
+        '''Replace operand #<index> (writing the change back to our InstructionStream, if any).'''
+        self.operands[index] = value
+        if self._home is not None:
+            stream, i = self._home
+            stream.operands[i] = stream.table.intern(self.operands)
+    
+    def fixup(self, routine, auto_resolve = True, targets = None):
+        '''Replace our raw operands with the (resolved) objects they refer to.
+
+            <targets> is a list of (operand-index, fixup-target) pairs already found
+            for our fixup offsets (see fixup_instructions()); if None, we search
+            the module's fixup table ourselves.
+        '''
         parent = routine.parent
         mod = routine.module
         assert (mod is parent.module), "Module mismatch ('%s' vs. '%s') for routine '%s'!!!!" % (mod.name, parent.module.name, routine.name)
@@ -295,18 +334,20 @@ class Instruction(object):
         if auto_resolve:
             # Do we have a potentially-fixup-able field?
             if self._fixups:
-                _fmap = mod._fixup_map
-                # For each fixup we have...
-                for i, offset in enumerate(self._fixups):
-                    if not offset: continue
-                    # Search the module's fixup map for the offset
-                    try:
-                        self.operands[i] = _fmap[offset]
-                        _fixed[i] = True
-                        _num_fixed += 1
-                    except KeyError:
-                        # No cigar
-                        continue
+                if targets is None:
+                    # Search the module's fixup table for each fixup we have
+                    targets = []
+                    for i, offset in enumerate(self._fixups):
+                        if not offset: continue
+                        try:
+                            targets.append((i, mod.get_fixup(offset)))
+                        except KeyError:
+                            # No cigar
+                            continue
+                for i, target in targets:
+                    self.operands[i] = target
+                    _fixed[i] = True
+                    _num_fixed += 1
         
         # If we "fixed" all raw operands, bail now
         if _num_fixed == len(self._ops): return self
@@ -850,206 +891,365 @@ class Instruction(object):
             
 from utils import UnresolvedClass, UnresolvedLocalField, UnresolvedName, UnresolvedStaticField
 
+def fixup_instructions(routine, instructions, fixup_offsets, fixup_targets):
+    '''Fixup a routine's <instructions>, yielding each in turn.
+
+        <fixup_offsets> (ascending) and <fixup_targets> are the parallel arrays of
+        module fixups falling within the routine's code.  Instruction fixup offsets
+        ascend too, so both are walked together in a single merge pass.
+    '''
+    j, n = 0, len(fixup_offsets)
+    for instr in instructions:
+        targets = []
+        if instr._fixups:
+            for i, offset in enumerate(instr._fixups):
+                if not offset: continue
+                while (j < n) and (fixup_offsets[j] < offset):
+                    j += 1
+                if (j < n) and (fixup_offsets[j] == offset):
+                    targets.append((i, fixup_targets[j]))
+        yield instr.fixup(routine, auto_resolve=True, targets=targets)
+
+# Compact instruction storage
+#----------------------------------------------------------
+def _operand_key(op):
+    '''Hashable interning key for an operand (by value for literals, by identity otherwise).'''
+    t = type(op)
+    if (t is int) or (t is long) or (t is bool) or (t is str) or (t is unicode) or (op is None):
+        return (t, op)
+    elif t is float:
+        # (0.0 == -0.0, but they are different constants)
+        return (t, _struct.pack('<d', op))
+    elif (t is list) or (t is tuple):
+        return (t, tuple(_operand_key(x) for x in op))
+    else:
+        # Members, type tokens, blobs, etc. (TypeToken equality can walk class hierarchies)
+        return (t, id(op))
+
+class OperandTable(object):
+    '''Per-module table of interned (fixed-up) instruction operand lists.
+
+        Instructions sharing an operand list (the same field, routine, literal, local
+        slot...) share a single entry; entry 0 is always the empty list.
+    '''
+    __slots__ = ['items', '_index']
+
+    def __init__(self):
+        self.items = [()]
+        self._index = {(): 0}
+
+    def __len__(self):
+        return len(self.items)
+
+    def intern(self, operands):
+        '''Return the table index of <operands>, adding it if necessary.'''
+        key = tuple(_operand_key(op) for op in operands)
+        try:
+            return self._index[key]
+        except KeyError:
+            index = self._index[key] = len(self.items)
+            self.items.append(tuple(operands))
+            return index
+
+class InstructionStream(object):
+    '''Compact, read-mostly list of a routine's (fixed-up) instructions.
+
+        Offsets, opcodes and OperandTable indices are kept in parallel arrays, and
+        type-on-top-of-stack annotations in a sparse dict; an Instruction is only
+        materialized when an element is looked at.  Changes made through the
+        materialized Instruction's totos/set_operand() are written back.
+    '''
+    __slots__ = ['table', 'offsets', 'opcodes', 'operands', 'totos']
+
+    def __init__(self, table, instructions=()):
+        self.table = table
+        self.offsets = _array('i')
+        self.opcodes = _array('H')
+        self.operands = _array('i')
+        self.totos = {}
+        for instr in instructions:
+            self.append(instr)
+
+    def append(self, instr):
+        if instr.totos is not None:
+            self.totos[len(self.offsets)] = instr.totos
+        self.offsets.append(instr.offset)
+        self.opcodes.append(instr.opcode)
+        self.operands.append(self.table.intern(instr.operands))
+
+    def _materialize(self, index):
+        instr = Instruction(None, None, None, None)
+        instr.offset = self.offsets[index]
+        instr.opcode = self.opcodes[index]
+        instr._name = _OPCODES[instr.opcode]
+        instr.operands = list(self.table.items[self.operands[index]])
+        instr._totos = self.totos.get(index)
+        instr._home = (self, index)
+        return instr
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._materialize(i) for i in xrange(*index.indices(len(self.offsets)))]
+        if index < 0:
+            index += len(self.offsets)
+        if not (0 <= index < len(self.offsets)):
+            raise IndexError("instruction index out of range")
+        return self._materialize(index)
+
+    def __iter__(self):
+        for i in xrange(len(self.offsets)):
+            yield self._materialize(i)
+
+    def names(self):
+        '''Return the mnemonics of all instructions (without materializing them).'''
+        return [_OPCODES[opcode] for opcode in self.opcodes]
+
+    def index_of(self, offset):
+        '''Return the index of the instruction at code <offset> (ValueError if there is none).'''
+        i = bisect_left(self.offsets, offset)
+        if (i < len(self.offsets)) and (self.offsets[i] == offset):
+            return i
+        raise ValueError("no instruction at offset %d" % offset)
+
+# Table-driven operand decoding
+#----------------------------------------------------------
+# Every (escape, opcode) pair indexes a 512-entry table of decoders, each a
+# (layout, size, hook, fixups) tuple:
+#   layout  - precompiled struct.Struct for the operand bytes (None if there are none)
+#   size    - layout.size (0 if there is no layout)
+#   hook    - post-processing hook(D, values, code, pos, offset) -> (ops, pos), for
+#             operands that need more than the unpacked values (None: ops = list(values))
+#   fixups  - None, or the operand-fixup list tail following the first operand's offset
+# The first group to claim an opcode wins (as in an if/elif chain over the groups).
+
+class _DisasmState(object):
+    '''Per-routine context handed to the decoder hooks.'''
+    __slots__ = ['R', 'code_start']
+
+    def __init__(self, R, code_start):
+        self.R = R
+        self.code_start = code_start
+
+def _need(code, pos, size):
+    '''Raise EOFError if <code> has fewer than <size> bytes left at <pos>.'''
+    if pos + size > len(code):
+        raise EOFError()
+
+def _branch(D, v, code, pos, offset):
+    return [D.code_start + offset + (v[0] + 1)], pos
+
+def _branch_up(D, v, code, pos, offset):
+    return [D.code_start + offset + (-v[0] + 1)], pos
+
+def _string_array_init(D, v, code, pos, offset):
+    num_lits = v[0]
+    _need(code, pos, 2*num_lits)
+    lit_offsets = _struct.unpack_from('<%dH' % num_lits, code, pos)
+    return [[D.R.get_lit(off, needs_header=True) for off in lit_offsets],], pos + 2*num_lits
+
+def _array_init(D, v, code, pos, offset):
+    tc, length, blob_offset = v
+    blob = D.R.get_blob(blob_offset, length)
+    size = _ARRAY_SIZES[tc]
+    assert len(blob) % size == 0
+    if tc in _ARRAY_BLOB_CODES:
+        items = _array(_ARRAY_BLOB_CODES[tc], blob)
+        if sys.byteorder != 'little':
+            items.byteswap()
+    else:
+        unpack_string = '<' + _ARRAY_UNPACK_CODES[tc] * (len(blob)/size)
+        items = list(unpack(unpack_string, blob))
+    return [_ARRAY_TYPES[tc], items], pos
+
+def _lookupswitch(range_code):
+    def _hook(D, v, code, pos, offset):
+        num_lookups = v[0]
+        fmt = '<' + (range_code + 'h') * num_lookups + 'h'
+        size = _struct.calcsize(fmt)
+        _need(code, pos, size)
+        values = _struct.unpack_from(fmt, code, pos)
+        return [num_lookups, zip(values[0:-1:2], values[1:-1:2]), values[-1]], pos + size
+    return _hook
+
+def _tableswitch(D, v, code, pos, offset):
+    num_targets, default = v
+    _need(code, pos, 2*num_targets)
+    targets = list(_struct.unpack_from('<%dh' % num_targets, code, pos))
+    return [num_targets, default, targets], pos + 2*num_targets
+
+def _far_field(D, v, code, pos, offset):
+    return [v[0] + 256], pos
+
+def _class_fieldref(D, v, code, pos, offset):
+    return [UnresolvedClass((v[0], v[1])), v[2]], pos
+
+def _method_ref(D, v, code, pos, offset):
+    return [v], pos
+
+def _special_ref(D, v, code, pos, offset):
+    return [(v[0], v[1]), v[2]], pos
+
+def _invokevirtual_short(D, v, code, pos, offset):
+    bits = v[0]
+    return [bits >> 2, (bits & 3) + 1], pos
+
+def _ldc(D, v, code, pos, offset):
+    return [D.R.get_lit(v[0], is_unicode=False, needs_header=True)], pos
+
+def _ldc_unicode(D, v, code, pos, offset):
+    return [D.R.get_lit(v[1], is_unicode=True, needs_header=True)], pos
+
+def _class_ref(D, v, code, pos, offset):
+    return [UnresolvedClass(v)], pos
+
+def _class_ref_check(D, v, code, pos, offset):
+    return [UnresolvedClass((v[0], v[1])), v[2]], pos
+
+def _newarray(D, v, code, pos, offset):
+    return [_ARRAY_TYPES[v[0]],], pos
+
+def _multinewarray(D, v, code, pos, offset):
+    return [v[0], v[1], _ARRAY_TYPES[v[2]]], pos
+
+def _multinewarray_obj(D, v, code, pos, offset):
+    return [UnresolvedClass((v[0], v[1])), v[2], v[3]], pos
+
+def _checkcastbranch(D, v, code, pos, offset):
+    return [(v[0], v[1]), v[2]], pos
+
+def _typecheck_array(D, v, code, pos, offset):
+    dims, tc = v[0], v[1]
+    tt = TypeToken(None)
+    tt._object = False
+    tt._array = True
+    tt.code = tc
+    tt.type = Primitive(TypeToken.TYPE_NAME[tc])
+    tt.dims = dims
+    return [tt], pos
+
+def _typecheck_array_branch(D, v, code, pos, offset):
+    # (the type code is checked before the branch offset is read)
+    ops, pos = _typecheck_array(D, v, code, pos, offset)
+    _need(code, pos, 2)
+    ops.append(_struct.unpack_from('<h', code, pos)[0])
+    return ops, pos + 2
+
+def _local(hook):
+    '''Adapt a hook expecting a leading module byte for the (implied module 0) local variant.'''
+    def _hook(D, v, code, pos, offset):
+        return hook(D, (0,) + v, code, pos, offset)
+    return _hook
+
+def _bad_opcode(opcode):
+    def _hook(D, v, code, pos, offset):
+        raise BadOpcodeError("0x%02x @ 0x%04x" % (opcode, offset))
+    return _hook
+
+def _build_decoders(is_brittle):
+    # (opcodes, layout, hook, fixups[, extra opcodes, extra layout, extra hook])
+    groups = [
+        (_BRANCH_NEAR, '<b', _branch, None),
+        (_BRANCH_FAR, '<h', _branch, None),
+        (_BRANCH_UP, '<H', _branch_up, None),
+        (_BRANCH_DOWN, '<H', _branch, None),
+        (_SINGLE_UBYTE_OP, '<B', None, None),
+        (_SINGLE_SBYTE_OP, '<b', None, None),
+        (_SINGLE_SWORD_OP, '<h', None, None),
+        (_SINGLE_UWORD_OP, '<H', None, None),
+        (_SINGLE_INT_OP, '<i', None, None),
+        (_STRING_ARRAY_INIT_OP, '<H', _string_array_init, None),
+        (_ARRAY_INIT_OP, '<BHH', _array_init, None),
+        (_CONSTRAINTS_OP, '<BBB', None, None),
+        (_LOOKUPSWITCH_EXTRA, '<H', _lookupswitch('h'), None),
+        (_LOOKUPSWITCH_OP, '<H', _lookupswitch('i'), None),
+        (_TABLESWITCH_OP, '<Hi', _tableswitch, None),
+        (_TWO_BYTE_OP, '<Bb', None, None),
+        (_TWO_WORD_OP, '<Hh', None, None),
+        (_SINGLE_SLONG_OP, '<q', None, None),
+        (_CLASS_FIELDREF_EXTRA, '<BBH', _class_fieldref, []),
+        (_CLASS_FIELDREF_OP, '<BH', _local(_class_fieldref), []),
+        (_REL_FIELDREF_OP, '<B' if is_brittle else '<b', None, []),
+        (_REL_FAR_FIELDREF_OP, '<B' if is_brittle else '<b', None if is_brittle else _far_field, []),
+        (_INVOKESTATIC_EXTRA, '<BBH', _method_ref, []),
+        (_INVOKESTATIC_OP, '<BH', _local(_method_ref), []),
+        (_INVOKENATIVE_OP, '<BH', None, None),
+        (_JUMPSPECIAL_EXTRA, '<BH', _method_ref, []),
+        (_JUMPSPECIAL_OP, '<H', _local(_method_ref), []),
+        (_INVOKESPECIAL_EXTRA, '<BHB', _special_ref, [None]),
+        (_INVOKESPECIAL_OP, '<HB', _local(_special_ref), [None]),
+        (_INVOKEVIRTUAL_OP, '<hB', None, [0]),
+        (_INVOKEVIRTUAL_SHORT_OP, '<B', _invokevirtual_short, None),
+        (_INVOKEINTERFACE_OP, '<HBH', None, None),
+        (_LDC_EXTRA, '<HH', _ldc_unicode, None),
+        (_LDC_OP, '<H', _ldc, None),
+        (_CLASSREF_EXTRA, '<BB', _class_ref, []),
+        (_CLASSREF_OP, '<B', _local(_class_ref), []),
+        (_CLASSREF_CHECK_EXTRA, '<BBB', _class_ref_check, [None]),
+        (_CLASSREF_CHECK_OP, '<BB', _local(_class_ref_check), [None]),
+        (_NEWARRAY_OP, '<B', _newarray, None),
+        (_MULTINEWARRAY_OP, '<BBB', _multinewarray, None),
+        (_MULTINEWARRAY_OBJ_EXTRA, '<BBBB', _multinewarray_obj, []),
+        (_MULTINEWARRAY_OBJ_OP, '<BBB', _local(_multinewarray_obj), []),
+        (_CHECKCASTBRANCH_EXTRA, '<BBh', _checkcastbranch, []),
+        (_CHECKCASTBRANCH_OP, '<Bh', _local(_checkcastbranch), []),
+        (_TYPECHECK_ARRAY_OP_EXTRA, '<BB', _typecheck_array_branch, None),
+        (_TYPECHECK_ARRAY_OP, '<BB', _typecheck_array, None),
+    ]
+    # (a group's "extra" opcodes come first so they claim their entries from the group)
+    no_operands = (None, 0, None, None)
+    table = [None] * 512
+    for opcodes, layout, hook, fixups in groups:
+        st = _struct.Struct(layout)
+        for opcode in opcodes:
+            if table[opcode] is None:
+                table[opcode] = (st, st.size, hook, fixups)
+    for opcode in _BAD_OPS:
+        if table[opcode] is None:
+            table[opcode] = (None, 0, _bad_opcode(opcode), None)
+    return [entry or no_operands for entry in table]
+
+_DECODERS = _build_decoders(False)
+_BRITTLE_DECODERS = _build_decoders(True)
+
 def disassembly(routine):
-    R = routine.module._R
-    C = Context.fromstring(routine.code)
-    is_brittle = ('is_brittle' in routine.module.attrs)
+    '''Decode a routine's byte code, yielding an (un-fixed-up) Instruction at a time.'''
+    # (Read straight from the code section's buffer--no copy)
+    code = routine.code
+    end = len(code)
+    table = _BRITTLE_DECODERS if ('is_brittle' in routine.module.attrs) else _DECODERS
     _code_start = routine.code_offset
-    
-    esc = 0
-    while True:
-        # Read next opcode
-        try:
-            if esc == 0:
-                offset = C.tell()
-            opcode = BYTE(C)
-        except EOFError:
-            return
-        
+    D = _DisasmState(routine.module._R, _code_start)
+
+    pos = 0
+    while pos < end:
+        # Read next opcode (the escape byte selects the upper half of the table)
+        offset = pos
+        opcode = ord(code[pos])
+        pos += 1
         if opcode == _ESC_BYTE:
-            esc = 256
-            continue
-        else:
-            opcode, esc, fixups = opcode + esc, 0, None
-            
-            if opcode in _BRANCH_NEAR:
-                ops = [_code_start + offset + (signed_char(C) + 1)]
-                
-            elif opcode in _BRANCH_FAR:
-                ops = [_code_start + offset + (signed_short(C) + 1)]
-                
-            elif opcode in _BRANCH_UP:
-                ops = [_code_start + offset + (-WORD(C) + 1)]
-                
-            elif opcode in _BRANCH_DOWN:
-                ops = [_code_start + offset + (WORD(C) + 1)]
-                
-            elif opcode in _SINGLE_UBYTE_OP:
-                ops = [BYTE(C)]
-                
-            elif opcode in _SINGLE_SBYTE_OP:
-                ops = [signed_char(C)]
-                
-            elif opcode in _SINGLE_SWORD_OP:
-                ops = [signed_short(C)]
-                
-            elif opcode in _SINGLE_UWORD_OP:
-                ops = [WORD(C)]
-                
-            elif opcode in _SINGLE_INT_OP:
-                ops = [int_(C)]
-            
-            elif opcode in _STRING_ARRAY_INIT_OP:
-                num_lits = WORD(C)
-                ops = [[R.get_lit(off, needs_header=True) for off in array_f(WORD, num_lits)(C)],]
-            
-            elif opcode in _ARRAY_INIT_OP:
-                tc = BYTE(C)
-                length = WORD(C)
-                blob = R.get_blob(WORD(C), length)
-                size = _ARRAY_SIZES[tc]
-                assert len(blob) % size == 0
-                unpack_code = _ARRAY_UNPACK_CODES[tc]
-                unpack_string = '<' + unpack_code * (len(blob)/size)
-                inits = list(unpack(unpack_string, blob))
-                ops = [_ARRAY_TYPES[tc], inits]
-            
-            elif opcode in _CONSTRAINTS_OP:
-                ops = array_f(BYTE, 3)(C)
-            
-            elif opcode in _LOOKUPSWITCH_OP:
-                range_getter = signed_short if (opcode in _LOOKUPSWITCH_EXTRA) else signed_int
-                num_lookups = WORD(C)
-                lookups = []
-                for i in xrange(num_lookups):
-                    lookups.append((range_getter(C), signed_short(C)))
-                default = signed_short(C)
-                ops = [num_lookups, lookups, default]
-            
-            elif opcode in _TABLESWITCH_OP:
-                num_targets = WORD(C)
-                default = signed_int(C)
-                targets = array_f(signed_short, num_targets)(C)
-                ops = [num_targets, default, targets]
-            
-            elif opcode in _TWO_BYTE_OP:
-                ops = [BYTE(C), signed_char(C)]
-            
-            elif opcode in _TWO_WORD_OP:
-                ops = [WORD(C), signed_short(C)]
-            
-            elif opcode in _SINGLE_SLONG_OP:
-                ops = [signed_long_long(C)]
-            
-            elif opcode in _CLASS_FIELDREF_OP:
-                fixups = [C.tell() + _code_start]
-                mod_byte = BYTE(C) if (opcode in _CLASS_FIELDREF_EXTRA) else 0
-                class_byte = BYTE(C)
-                field_address = WORD(C)
-                ops = [UnresolvedClass((mod_byte, class_byte)), field_address]
-            
-            elif opcode in _REL_FIELDREF_OP:
-                fixups = [C.tell() + _code_start]
-                field_offset = BYTE(C) if is_brittle else signed_char(C)
-                ops = [field_offset]
-            
-            elif opcode in _REL_FAR_FIELDREF_OP:
-                fixups = [C.tell() + _code_start]
-                field_offset = BYTE(C) if is_brittle else (signed_char(C) + 256)
-                ops = [field_offset]
-            
-            elif opcode in _INVOKESTATIC_OP:
-                fixups = [C.tell() + _code_start]
-                mod_byte = BYTE(C) if (opcode in _INVOKESTATIC_EXTRA) else 0
-                class_byte = BYTE(C)
-                method_index = WORD(C)
-                ops = [(mod_byte, class_byte, method_index)]
-            
-            elif opcode in _INVOKENATIVE_OP:
-                ops = [BYTE(C), WORD(C)]
-            
-            elif opcode in _JUMPSPECIAL_OP:
-                fixups = [C.tell() + _code_start]
-                mod_byte = BYTE(C) if (opcode in _JUMPSPECIAL_EXTRA) else 0
-                method_word = WORD(C)
-                ops = [(mod_byte, method_word)]
-            
-            elif opcode in _INVOKESPECIAL_OP:
-                fixups = [C.tell() + _code_start, None]
-                mod_byte = BYTE(C) if (opcode in _INVOKESPECIAL_EXTRA) else 0
-                method_word = WORD(C)
-                local_count = BYTE(C)
-                ops = [(mod_byte, method_word), local_count]
-            
-            elif opcode in _INVOKEVIRTUAL_OP:
-                fixups = [C.tell() + _code_start, 0]
-                method_addr = signed_short(C)
-                local_count = BYTE(C)
-                ops = [method_addr, local_count]
-            
-            elif opcode in _INVOKEVIRTUAL_SHORT_OP:
-                bits = BYTE(C)
-                short_voffset = bits >> 2
-                local_count = (bits & 3) + 1
-                ops = [short_voffset, local_count]
-            
-            elif opcode in _INVOKEINTERFACE_OP:
-                ops = [WORD(C), BYTE(C), WORD(C)]
-            
-            elif opcode in _LDC_OP:
-                is_unicode = (opcode in _LDC_EXTRA)
-                _unused = WORD(C) if is_unicode else 0
-                ops = [R.get_lit(WORD(C), is_unicode=is_unicode, needs_header=True)]
-            
-            elif opcode in _CLASSREF_OP:
-                fixups = [C.tell() + _code_start]
-                mod_byte = BYTE(C) if (opcode in _CLASSREF_EXTRA) else 0
-                class_byte = BYTE(C)
-                ops = [UnresolvedClass((mod_byte, class_byte))]
-            
-            elif opcode in _CLASSREF_CHECK_OP:
-                fixups = [C.tell() + _code_start, None]
-                mod_byte = BYTE(C) if (opcode in _CLASSREF_CHECK_EXTRA) else 0
-                class_byte = BYTE(C)
-                dims_byte = BYTE(C)
-                ops = [UnresolvedClass((mod_byte, class_byte)), dims_byte]
-            
-            elif opcode in _NEWARRAY_OP:
-                ops = [_ARRAY_TYPES[BYTE(C)],]
+            while opcode == _ESC_BYTE:
+                if pos >= end:
+                    return
+                opcode = ord(code[pos])
+                pos += 1
+            opcode += 256
 
-            elif opcode in _MULTINEWARRAY_OP:
-                ops = [BYTE(C), BYTE(C), _ARRAY_TYPES[BYTE(C)]]
-            
-            elif opcode in _MULTINEWARRAY_OBJ_OP:
-                fixups = [C.tell() + _code_start]
-                mod_byte = BYTE(C) if (opcode in _MULTINEWARRAY_OBJ_EXTRA) else 0
-                class_byte = BYTE(C)
-                ops = [UnresolvedClass((mod_byte, class_byte)), BYTE(C), BYTE(C)]
-            
-            elif opcode in _CHECKCASTBRANCH_OP:
-                fixups = [C.tell() + _code_start]
-                mod_byte = BYTE(C) if (opcode in _CHECKCASTBRANCH_EXTRA) else 0
-                ops = [(mod_byte, BYTE(C)), signed_short(C)]
-            
-            elif opcode in _TYPECHECK_ARRAY_OP:
-                dims, tc = BYTE(C), BYTE(C)
-                tt = TypeToken(None)
-                tt._object = False
-                tt._array = True
-                tt.code = tc
-                tt.type = Primitive(TypeToken.TYPE_NAME[tc])
-                tt.dims = dims
-                
-                if opcode in _TYPECHECK_ARRAY_OP_EXTRA:
-                    ops = [tt, signed_short(C)]
-                else:
-                    ops = [tt]
+        st, size, hook, fixups = table[opcode]
+        if fixups is not None:
+            fixups = [pos + _code_start] + fixups
+        if st is None:
+            values = ()
+        else:
+            if pos + size > end:
+                raise EOFError()
+            values = st.unpack_from(code, pos)
+            pos += size
+        if hook is None:
+            ops = list(values)
+        else:
+            ops, pos = hook(D, values, code, pos, offset)
 
-            elif opcode in _BAD_OPS:
-                raise BadOpcodeError("0x%02x @ 0x%04x" % (opcode, offset))
-            
-            else:
-                # No operands
-                ops = []
-            
-            yield Instruction(offset + _code_start, opcode, ops, fixups)
+        yield Instruction(offset + _code_start, opcode, ops, fixups)
@@ -30,7 +30,10 @@ dump: Tool for dumping the parsed and/or resolved contents of a COD file.
 import sys
 import os, os.path
 import time
+import threading, Queue
 from subprocess import Popen, PIPE
+import packfile
+import store
 
 class TextDumper(object):
     '''Base class for text-based dumpers.'''
@@ -121,8 +124,9 @@ class UnresolvedDumper(TextDumper):
 
             if hasattr(M, 'imports'):
                 self.out("Imported Modules:"); self.indent()
+                from resolve import module_name
                 for i, imp in enumerate(M.imports):
-                    self.out("%4d: %s (%s)" % (i+1, imp, M.import_versions[M.imports.index(imp)]))
+                    self.out("%4d: %s (%s)" % (i+1, module_name(imp), M.import_versions[i]))
                 self.dedent(); self.out()
             else:
                 imports = [(M._R.get_escaped_lit(n), M._R.get_escaped_lit(v)) for n,v in M._cf.data.modules[1:]]
@@ -289,8 +293,9 @@ class ResolvedDumper(TextDumper):
 
             if hasattr(M, 'imports'):
                 self.out("Imported Modules:"); self.indent()
+                from resolve import module_name
                 for i, imp in enumerate(M.imports):
-                    self.out("%4d: %s (%s)" % (i+1, imp, M.import_versions[M.imports.index(imp)]))
+                    self.out("%4d: %s (%s)" % (i+1, module_name(imp), M.import_versions[i]))
                 self.dedent(); self.out()
             else:
                 imports = [(M._R.get_escaped_lit(n), M._R.get_escaped_lit(v)) for n,v in M._cf.data.modules[1:]]
@@ -443,80 +448,91 @@ class SerialDumper(object):
     def log(self, msg):
         print >> self._log, msg
 
-    def dump_module(self, M):
+    def _disk_path(self, rel_path):
+        path = os.path.join(self._root, *rel_path.split('/'))
+        dirpath = os.path.dirname(path)
+
+        # POTENTIAL RACE CONDITION (which I don't really care about...)
+        if not os.path.exists(dirpath):
+            os.makedirs(dirpath)
+        return path
+
+    def _write_file(self, path, record):
         import cPickle
 
-        # Dump a module-index db file (a pickled-dictionary)
-        module_db_path = os.path.join(self._root, M.name + ".cod.db")
         try:
-            with open(module_db_path, 'wt') as fd:
-                cPickle.dump({
-                    'name': M.name,
-                    'version': M.version,
-                    'timestamp': M.timestamp,
-                    'attrs': M.attrs.keys(),
-                    'siblings': M.siblings,
-                    'imports': [I.name for I in M.imports],
-                    'import_versions': M.import_versions,
-                    'aliases': M.aliases,
-                    'exports': [X.serialize() for X in M.exports],
-                    'entry_points': [EP.serialize() for EP in M.entry_points],
-                    'statics': M.statics,
-                    'classes': map(str, M.classes),
-                    'routines': [R.serialize() for R in M.routines],
-                    'signatures': [S.serialize() for S in M.signatures]
-                }, fd)
+            with open(path, 'wt') as fd:
+                cPickle.dump(record, fd)
         except:
-            os.remove(module_db_path)
+            os.remove(path)
             raise
 
-        # Then dump all the classes as .cache files (organized by package/class hierarchy)
-        for C in M.classes:
-            self.dump_class(C, M.name)
+    def _write(self, rel_path, record):
+        '''Store a cache record under its cache-relative path (e.g. "<base_module>/<class>.cache").'''
+        self._write_file(self._disk_path(rel_path), record)
 
-    def _class_cache_file(self, class_def):
-        packpath = class_def.package.replace('/', os.path.sep)
-        dirpath = os.path.join(self._root, class_def.module.get_base_module_name(), packpath)
+    def dump_module(self, M):
+        from resolve import module_name
 
-        # POTENTIAL RACE CONDITION (which I don't really care about...)
-        if not os.path.exists(dirpath):
-            os.makedirs(dirpath)
+        # Stamp everything with what it was built from (so stale entries can be detected)
+        stamp = M._L.get_cache_stamp(M)
 
-        filename = "%s.cache" % class_def.short_name
-        return os.path.join(dirpath, filename)
+        # Dump a module-index db file (a pickled-dictionary)
+        self._write(M.name + ".cod.db", {
+            'stamp': stamp,
+            'name': M.name,
+            'version': M.version,
+            'timestamp': M.timestamp,
+            'attrs': M.attrs.keys(),
+            'siblings': M.siblings,
+            'imports': map(module_name, M.imports),
+            'import_versions': M.import_versions,
+            'aliases': M.aliases,
+            'exports': [X.serialize() for X in M.exports],
+            'entry_points': [EP.serialize() for EP in M.entry_points],
+            'statics': M.statics,
+            'classes': map(str, M.classes),
+            'routines': [R.serialize() for R in M.routines],
+            'signatures': [S.serialize() for S in M.signatures]
+        })
 
-    def dump_class(self, C, module_name):
-        import cPickle
+        # Then dump all the classes as .cache files (organized by package/class hierarchy)
+        for C in M.classes:
+            self.dump_class(C, M.name, stamp)
+
+    def _class_cache_key(self, class_def):
+        # (Organized by package/class hierarchy under the base module)
+        return "%s/%s.cache" % (class_def.module.get_base_module_name(), class_def.name)
+
+    def dump_class(self, C, module_name, stamp=None):
+        if stamp is None:
+            stamp = C.module._L.get_cache_stamp(C.module)
 
         # NOTE: we could make this more efficient by making *_modules
         # an index into the imports list +1 rather than the full name
         # TODO: delete *_modules
-        try:
-            with open(self._class_cache_file(C), 'wt') as fd:
-                cPickle.dump({
-                    'module': module_name,
-                    'name': str(C),
-                    'superclass': str(C.superclass) if C.superclass else None,
-                    'superclass_module': str(C.superclass.module.get_base_module_name()) if C.superclass else None,
-                    'ifaces': map(str, C.ifaces),
-                    'ifaces_modules': [str(iface.module.get_base_module_name()) for iface in C.ifaces],
-                    'attrs': C.attrs.keys(),
-                    'fields': [F.serialize() for F in C.fields],
-                    'static_fields': [F.serialize() for F in C.static_fields],
-                    'virtual_methods': map(self.dump_method, C.virtual_methods),
-                    'nonvirtual_methods': map(self.dump_method, C.nonvirtual_methods),
-                    'static_methods': map(self.dump_method, C.static_methods),
-                    'vft': [vm.to_jts(False) for vm in C.vft],
-                    'vft_modules': [vm.module.get_base_module_name() for vm in C.vft],
-                    'fft': [f.to_jts(False) for f in C.fft],
-                    'fft_modules': [f.parent.module.get_base_module_name() for f in C.fft],
-                }, fd)
-        except:
-            os.remove(self._class_cache_file(C))
-            raise
+        self._write(self._class_cache_key(C), {
+            'stamp': stamp,
+            'module': module_name,
+            'name': str(C),
+            'superclass': str(C.superclass) if C.superclass else None,
+            'superclass_module': str(C.superclass.module.get_base_module_name()) if C.superclass else None,
+            'ifaces': map(str, C.ifaces),
+            'ifaces_modules': [str(iface.module.get_base_module_name()) for iface in C.ifaces],
+            'attrs': C.attrs.keys(),
+            'fields': [F.serialize() for F in C.fields],
+            'static_fields': [F.serialize() for F in C.static_fields],
+            'virtual_methods': map(self.dump_method, C.virtual_methods),
+            'nonvirtual_methods': map(self.dump_method, C.nonvirtual_methods),
+            'static_methods': map(self.dump_method, C.static_methods),
+            'vft': [vm.to_jts(False) for vm in C.vft],
+            'vft_modules': [vm.module.get_base_module_name() for vm in C.vft],
+            'fft': [f.to_jts(False) for f in C.fft],
+            'fft_modules': [f.parent.module.get_base_module_name() for f in C.fft],
+        })
 
     def dump_method(self, M):
-        return {
+        record = {
             'name': M.name,
             'param_types': M.param_types.serialize(),
             'return_type': M.return_type.serialize(),
@@ -524,9 +540,314 @@ class SerialDumper(object):
             'limits': (M.max_locals, M.max_stack, M.stack_size),
             'stack_map': [SM.serialize() for SM in M.stack_map],
             'code_offset': M.code_offset,
-            'instructions': [I.serialize() for I in M.instructions],
-            'handlers': [H.serialize() for H in M.handlers],
         }
+        self._dump_body(M, record)
+        return record
+
+    def _serialize_body(self, M):
+        return [I.serialize() for I in M.instructions], [H.serialize() for H in M.handlers]
+
+    def _dump_body(self, M, record):
+        record['instructions'], record['handlers'] = self._serialize_body(M)
+
+class BackgroundSerialDumper(SerialDumper):
+    '''SerialDumper that pickles/writes its cache entries on a background thread.
+
+        Records are still built on the calling thread (they walk live, lazily-loaded
+        module objects); only the pickling and disk I/O are handed off.  Entries are
+        written to a temporary file and renamed into place, so a loader reading the
+        same cache never sees a half-written entry (on Windows, where a rename cannot
+        replace an existing file, an entry briefly goes missing instead).  Failures are
+        handed back to (and logged by) the calling thread.  Call close() when done.
+    '''
+    def __init__(self, cache_root='.', log_file=sys.stderr, max_pending=1024):
+        SerialDumper.__init__(self, cache_root, log_file)
+        self.errors = 0
+        self._failures = Queue.Queue()
+        self._queue = Queue.Queue(max_pending)
+        self._thread = threading.Thread(target=self._run, name="cache-writer")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _write(self, rel_path, record):
+        self._log_failures()
+        self._queue.put((rel_path, record))
+
+    def _log_failures(self):
+        while True:
+            try:
+                msg = self._failures.get_nowait()
+            except Queue.Empty:
+                break
+            self.errors += 1
+            self.log(msg)
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            rel_path, record = item
+            try:
+                path = self._disk_path(rel_path)
+                tmp_path = path + ".tmp"
+                self._write_file(tmp_path, record)
+                if (os.name == 'nt') and os.path.exists(path):
+                    os.remove(path)
+                os.rename(tmp_path, path)
+            except Exception as ex:
+                self._failures.put("ERROR: failed to write cache entry '%s': %s (%s)" % (rel_path, ex, type(ex)))
+
+    def close(self):
+        '''Wait for all queued entries to be written; returns the number of failures.'''
+        self._queue.put(None)
+        self._thread.join()
+        self._log_failures()
+        return self.errors
+
+class PackfileDumper(SerialDumper):
+    '''SerialDumper that writes its cache records into packfiles.
+
+        By default each module (and its classes) goes into its own "<module>.pack",
+        rewritten whenever the module is re-dumped.  Given a <pack_name>, every module
+        is appended to that one (e.g., per-firmware) pack instead; call close() when done.
+        Routine bodies are written as records of their own, decoded only on first use.
+    '''
+    def __init__(self, cache_root='.', log_file=sys.stderr, pack_name=None):
+        SerialDumper.__init__(self, cache_root, log_file)
+        self._shared = None
+        if pack_name is not None:
+            self._shared = packfile.PackWriter(os.path.join(cache_root, pack_name))
+        self._pack = self._shared
+
+    def dump_module(self, M):
+        if self._shared is not None:
+            return SerialDumper.dump_module(self, M)
+
+        pack_path = os.path.join(self._root, M.name + ".pack")
+        self._pack = packfile.PackWriter(pack_path, append=False)
+        try:
+            SerialDumper.dump_module(self, M)
+            self._pack.close()
+        except:
+            # Don't leave a half-dumped module behind (the old pack, if any, stays put)
+            self._pack.abort()
+            raise
+        finally:
+            self._pack = None
+
+    def dump_class(self, C, module_name, stamp=None):
+        self._body_prefix = self._class_cache_key(C)[:-len(".cache")]
+        self._body_count = 0
+        SerialDumper.dump_class(self, C, module_name, stamp)
+
+    def _dump_body(self, M, record):
+        if not (M.instructions or M.handlers):
+            return SerialDumper._dump_body(self, M, record)
+        # Routine bodies get records of their own (next to their class's), so a loader
+        # reading the (mapped) pack only decodes the ones that actually get used
+        rel_path = "%s.%d.body" % (self._body_prefix, self._body_count)
+        self._body_count += 1
+        self._write(rel_path, self._serialize_body(M))
+        record['body'] = rel_path
+
+    def _write(self, rel_path, record):
+        self._pack.append(rel_path, record)
+
+    def close(self):
+        if self._shared is not None:
+            self._shared.close()
+
+class StoreDumper(SerialDumper):
+    '''SerialDumper that files its cache records into a content-addressed store, as one <version>.
+
+        Records already stored (by this or any earlier version) are shared, not
+        rewritten.  Call close() when done to commit the records and the manifest.
+    '''
+    def __init__(self, store_root='.', version=None, log_file=sys.stderr):
+        SerialDumper.__init__(self, store_root, log_file)
+        self.store = store.ClassStore(store_root)
+        self.manifest = self.store.open_manifest(version)
+        self._entry = None
+
+    def reuse_module(self, name, source_hash):
+        '''Add an already-stored build of a module (from the same COD) to our version; returns success.'''
+        from resolve import Loader
+
+        entry = self.store.find_module(name, source_hash)
+        if (entry is None) or (entry['stamp'].get('cache_version') != Loader.CACHE_VERSION):
+            return False
+        self.manifest.add_module(name, entry)
+        return True
+
+    def dump_module(self, M):
+        self._entry = {'stamp': None, 'records': {}}
+        try:
+            SerialDumper.dump_module(self, M)
+            entry = self._entry
+        finally:
+            self._entry = None
+        self.manifest.add_module(M.name, entry)
+        if entry['stamp']['source_hash'] is not None:
+            self.store.add_module(M.name, entry['stamp']['source_hash'], entry)
+
+    def _write(self, rel_path, record):
+        # Stamps differ between builds of the same content; keep them in the manifest instead
+        record = dict(record)
+        self._entry['stamp'] = record.pop('stamp', None)
+        self._entry['records'][rel_path] = self.store.put(record)
+
+    def close(self):
+        self.store.close()
+        self.manifest.save()
+
+class SQLiteDumper(object):
+    '''Streams resolved/disassembled modules into an (indexed) SQLite database for analysis.
+
+        Each module goes in with batched inserts inside a single transaction; re-dumping
+        a module replaces its rows.  Call close() when done.
+    '''
+
+    SCHEMA = '''
+        PRAGMA foreign_keys = ON;
+        CREATE TABLE IF NOT EXISTS modules (
+            id INTEGER PRIMARY KEY, name TEXT UNIQUE, base_module TEXT,
+            version TEXT, timestamp INTEGER, attrs TEXT);
+        CREATE TABLE IF NOT EXISTS imports (
+            module_id INTEGER REFERENCES modules(id) ON DELETE CASCADE,
+            idx INTEGER, name TEXT, version TEXT);
+        CREATE TABLE IF NOT EXISTS classes (
+            id INTEGER PRIMARY KEY, module_id INTEGER REFERENCES modules(id) ON DELETE CASCADE,
+            name TEXT, package TEXT, attrs TEXT);
+        CREATE TABLE IF NOT EXISTS supertypes (
+            class_id INTEGER REFERENCES classes(id) ON DELETE CASCADE,
+            name TEXT, kind TEXT);
+        CREATE TABLE IF NOT EXISTS fields (
+            id INTEGER PRIMARY KEY, class_id INTEGER REFERENCES classes(id) ON DELETE CASCADE,
+            name TEXT, type TEXT, is_static INTEGER, address INTEGER, attrs TEXT);
+        CREATE TABLE IF NOT EXISTS methods (
+            id INTEGER PRIMARY KEY, class_id INTEGER REFERENCES classes(id) ON DELETE CASCADE,
+            name TEXT, signature TEXT, kind TEXT, attrs TEXT,
+            max_stack INTEGER, max_locals INTEGER, num_instructions INTEGER);
+        CREATE TABLE IF NOT EXISTS calls (
+            method_id INTEGER REFERENCES methods(id) ON DELETE CASCADE,
+            offset INTEGER, opcode TEXT, target_class TEXT, target TEXT);
+        CREATE TABLE IF NOT EXISTS field_accesses (
+            method_id INTEGER REFERENCES methods(id) ON DELETE CASCADE,
+            offset INTEGER, opcode TEXT, field_class TEXT, field TEXT);
+        CREATE TABLE IF NOT EXISTS strings (
+            method_id INTEGER REFERENCES methods(id) ON DELETE CASCADE,
+            offset INTEGER, value TEXT);
+        CREATE INDEX IF NOT EXISTS imports_module ON imports(module_id);
+        CREATE INDEX IF NOT EXISTS imports_name ON imports(name);
+        CREATE INDEX IF NOT EXISTS classes_module ON classes(module_id);
+        CREATE INDEX IF NOT EXISTS classes_name ON classes(name);
+        CREATE INDEX IF NOT EXISTS supertypes_class ON supertypes(class_id);
+        CREATE INDEX IF NOT EXISTS supertypes_name ON supertypes(name);
+        CREATE INDEX IF NOT EXISTS fields_class ON fields(class_id);
+        CREATE INDEX IF NOT EXISTS fields_name ON fields(name);
+        CREATE INDEX IF NOT EXISTS methods_class ON methods(class_id);
+        CREATE INDEX IF NOT EXISTS methods_name ON methods(name);
+        CREATE INDEX IF NOT EXISTS calls_method ON calls(method_id);
+        CREATE INDEX IF NOT EXISTS calls_target ON calls(target);
+        CREATE INDEX IF NOT EXISTS field_accesses_method ON field_accesses(method_id);
+        CREATE INDEX IF NOT EXISTS field_accesses_field ON field_accesses(field);
+        CREATE INDEX IF NOT EXISTS strings_method ON strings(method_id);
+        CREATE INDEX IF NOT EXISTS strings_value ON strings(value);
+    '''
+
+    def __init__(self, db_path, log_file=sys.stderr):
+        import sqlite3
+        self._log = log_file
+        self._db = sqlite3.connect(db_path)
+        self._db.executescript(self.SCHEMA)
+
+        # We hand out our own row ids (so everything can go in via executemany)
+        self._ids = {}
+        for table in ('modules', 'classes', 'fields', 'methods'):
+            self._ids[table] = self._db.execute("SELECT MAX(id) FROM %s" % table).fetchone()[0] or 0
+
+    def log(self, msg):
+        print >> self._log, msg
+
+    def _new_id(self, table):
+        self._ids[table] += 1
+        return self._ids[table]
+
+    @staticmethod
+    def _text(s):
+        # (sqlite3 refuses 8-bit bytestrings)
+        return s.decode('latin-1') if isinstance(s, str) else s
+
+    @staticmethod
+    def _attrs(attrs):
+        return ' '.join(sorted(attrs))
+
+    def dump_module(self, M):
+        from disasm import RefOperand
+        from resolve import RoutineDef, FieldDef, module_name
+
+        rows = dict((table, []) for table in (
+            'imports', 'classes', 'supertypes', 'fields', 'methods', 'calls', 'field_accesses', 'strings'))
+
+        module_id = self._new_id('modules')
+        module_row = (module_id, M.name, M.get_base_module_name(), M.version, M.timestamp, self._attrs(M.attrs))
+        for i, imp in enumerate(M.imports):
+            rows['imports'].append((module_id, i + 1, module_name(imp), M.import_versions[i]))
+
+        for C in M.classes:
+            class_id = self._new_id('classes')
+            rows['classes'].append((class_id, module_id, C.name, C.package, self._attrs(C.attrs)))
+            if C.superclass:
+                rows['supertypes'].append((class_id, str(C.superclass), 'extends'))
+            for iface in C.ifaces:
+                rows['supertypes'].append((class_id, str(iface), 'implements'))
+
+            for F in C.fields:
+                rows['fields'].append((self._new_id('fields'), class_id, F.name, str(F.type), 0, None, self._attrs(F.attrs)))
+            for F in C.static_fields:
+                rows['fields'].append((self._new_id('fields'), class_id, F.name, str(F.type), 1, F.address, self._attrs(F.attrs)))
+
+            for kind, methods in (('virtual', C.virtual_methods), ('nonvirtual', C.nonvirtual_methods), ('static', C.static_methods)):
+                for R in methods:
+                    method_id = self._new_id('methods')
+                    rows['methods'].append((method_id, class_id, R.name, R.to_jts(False), kind, self._attrs(R.attrs),
+                        R.max_stack, R.max_locals, len(R.instructions)))
+
+                    # Walk the code for call/field-access edges and string constants
+                    for I in R.instructions:
+                        for op in I.operands:
+                            try:
+                                if isinstance(op, RefOperand):
+                                    ot = op.TYPE()
+                                    if ot is RoutineDef:
+                                        rows['calls'].append((method_id, I.offset, I._name, op.parent.name, op.to_jts(False)))
+                                    elif ot is FieldDef:
+                                        rows['field_accesses'].append((method_id, I.offset, I._name, op.parent.name, op.to_jts(False)))
+                                elif isinstance(op, basestring):
+                                    rows['strings'].append((method_id, I.offset, self._text(op)))
+                                elif isinstance(op, list):
+                                    for s in op:
+                                        if isinstance(s, basestring):
+                                            rows['strings'].append((method_id, I.offset, self._text(s)))
+                            except Exception as ex:
+                                self.log("WARNING: skipping operand of %r in '%s': %s (%s)" % (I, R, ex, type(ex)))
+
+        # One transaction per module (replacing any earlier dump of it)
+        with self._db:
+            self._db.execute("DELETE FROM modules WHERE name = ?", (M.name,))
+            self._db.execute("INSERT INTO modules VALUES (?, ?, ?, ?, ?, ?)", module_row)
+            self._db.executemany("INSERT INTO imports VALUES (?, ?, ?, ?)", rows['imports'])
+            self._db.executemany("INSERT INTO classes VALUES (?, ?, ?, ?, ?)", rows['classes'])
+            self._db.executemany("INSERT INTO supertypes VALUES (?, ?, ?)", rows['supertypes'])
+            self._db.executemany("INSERT INTO fields VALUES (?, ?, ?, ?, ?, ?, ?)", rows['fields'])
+            self._db.executemany("INSERT INTO methods VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows['methods'])
+            self._db.executemany("INSERT INTO calls VALUES (?, ?, ?, ?, ?)", rows['calls'])
+            self._db.executemany("INSERT INTO field_accesses VALUES (?, ?, ?, ?, ?)", rows['field_accesses'])
+            self._db.executemany("INSERT INTO strings VALUES (?, ?, ?)", rows['strings'])
+
+    def close(self):
+        self._db.close()
 
 class XMLDumper(object):
     '''XML-dumper for raw (unresolved) COD parse trees.
@@ -576,6 +897,9 @@ class XMLDumper(object):
     def dump_field(self, name, value):
         from bytecleaver import Struct
 
+        if isinstance(value, memoryview):
+            # (e.g., routine byte code, which is a view into the code section)
+            value = value.tobytes()
         attrs = {'name': name}
         #try:
         #    attrs['raw'] = repr(value._C.get_range(value._start, value._end))
@@ -306,6 +306,10 @@ class CodCodeSection(Struct):
         _cs = self._start
         kw['code_section'] = self
 
+        # Read the entire code section into "raw"; routines get views of it (not copies)
+        self.raw = string_f(cod_file.hdr.code_size)(C)
+        self._view = memoryview(self.raw)
+
         # Read all routines from all classes defined in the data section
         _routines = []
         for class_def in cod_file.data.class_defs:
@@ -356,9 +360,11 @@ class CodRoutineDef(Struct):
             self.stack_map = array_f(CodStackMapEntry, self.stack_size)(C)
             C.revert()
 
-        # Read the byte code
+        # Get (a view of) the byte code from our code section's buffer
         self.code_offset = C.tell()
-        self.F('byte_code', string_f(self.code_size))
+        _code_start = self.code_offset - kw['code_section']._start
+        self.FV('byte_code', kw['code_section']._view[_code_start:_code_start + self.code_size])
+        C.skip(self.code_size)
 
         # Read the exception handlers
         _handlers = []
@@ -0,0 +1,318 @@
+#! /usr/bin/env python
+
+# Copyright (c) 2012, derrotehund361@googlemail.com
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met: 
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer. 
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution. 
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+hierarchy: A loader-wide index of the class hierarchy for fast subtype queries.
+"""
+
+class ClassHierarchy(object):
+    '''Index of every class a Loader has actualized (or loaded from cache).
+
+        Classes are keyed by [JTS] name and assigned small integer ids.  The
+        superclass tree is given pre/post-order numbers, so "is B an ancestor of
+        A?" is an interval test, and each class's interface closure is kept as
+        a bitset (a long indexed by class id).
+
+        Names we have only seen as a superclass/interface of some registered
+        class are placeholders: anything whose answer depends on a placeholder
+        comes back as None (i.e., "don't know"), and the caller should fall back
+        to walking the actual class objects.  So are names that two (base) modules
+        define differently: a by-name query cannot tell which of them is meant.
+    '''
+
+    # Re-number once this many classes have been added since the last numbering
+    # (classes added in between are answered by walking up to a numbered ancestor)
+    MIN_PENDING = 256
+
+    def __init__(self):
+        # name <-> id
+        self._ids = {}
+        self._names = []
+        # per-id superclass id (-1 for a root class, None for a placeholder)
+        self._parent = []
+        # per-id tuple of interface ids (None for a placeholder)
+        self._ifaces = []
+        # per-id (base) module name of the registered definition (None if not given)
+        self._owners = []
+        # ids of names defined differently by different modules (permanent placeholders)
+        self._ambiguous = set()
+        # per-id pre/post-order numbers (None if added since the last numbering)
+        # and whether the superclass chain is known all the way to its root
+        self._pre = []
+        self._post = []
+        self._rooted = []
+        self._numbered = 0
+        self._pending = 0
+        self._stale = False
+        # memoized interface closures, by id
+        self._closures = {}
+        # bumped whenever an already-registered class changes shape (so derived caches
+        # know to drop their results--merely adding classes never invalidates anything)
+        self.generation = 0
+        # memoized comparisons of types over this hierarchy
+        self.lattice = TypeLattice(self)
+
+    def __len__(self):
+        return len(self._names)
+
+    def __contains__(self, name):
+        i = self._ids.get(name)
+        return (i is not None) and (self._ifaces[i] is not None)
+
+    def _get_id(self, name):
+        i = self._ids.get(name)
+        if i is None:
+            i = self._ids[name] = len(self._names)
+            self._names.append(name)
+            self._parent.append(None)
+            self._ifaces.append(None)
+            self._owners.append(None)
+            self._pre.append(None)
+            self._post.append(None)
+            self._rooted.append(False)
+            self._pending += 1
+        return i
+
+    def add(self, name, superclass_name, iface_names, module=None):
+        '''Register a class by name, superclass name (None for a root) and interface names.
+
+            <module> is the (base) name of the module defining it, if known.
+        '''
+        i = self._get_id(name)
+        if i in self._ambiguous:
+            return i
+        parent = self._get_id(superclass_name) if superclass_name else -1
+        ifaces = tuple(self._get_id(n) for n in iface_names if n)
+        old_parent, old_ifaces = self._parent[i], self._ifaces[i]
+        if (old_parent == parent) and (old_ifaces == ifaces):
+            return i
+        owner = self._owners[i]
+        if (old_ifaces is not None) and (module is not None) and (owner is not None) and (module != owner):
+            # Another module's (different) class of the same name: answer "don't know" for it from now on
+            self._ambiguous.add(i)
+            self._parent[i] = self._ifaces[i] = None
+            self._closures.clear()
+            self._stale = True
+            self.generation += 1
+            return i
+        if module is not None:
+            self._owners[i] = module
+        if old_ifaces is not None:
+            # A redefinition: anything we derived may be wrong now
+            self._closures.clear()
+            self._stale = True
+            self.generation += 1
+        elif self._pre[i] is not None:
+            # A numbered placeholder gains a superclass--its whole subtree moves
+            self._stale = True
+        self._parent[i] = parent
+        self._ifaces[i] = ifaces
+        return i
+
+    def _renumber(self):
+        '''(Re)assign pre/post-order numbers to the whole superclass forest.'''
+        n = len(self._names)
+        children = [[] for _ in xrange(n)]
+        roots = []
+        for i, p in enumerate(self._parent):
+            if (p is None) or (p == -1):
+                roots.append(i)
+            else:
+                children[p].append(i)
+        pre, post, rooted = [None] * n, [None] * n, [False] * n
+        counter = 0
+        for root in roots:
+            is_rooted = (self._parent[root] == -1)
+            stack = [(root, iter(children[root]))]
+            pre[root] = counter
+            rooted[root] = is_rooted
+            counter += 1
+            while stack:
+                node, kids = stack[-1]
+                for kid in kids:
+                    if pre[kid] is None:
+                        pre[kid] = counter
+                        rooted[kid] = is_rooted
+                        counter += 1
+                        stack.append((kid, iter(children[kid])))
+                        break
+                else:
+                    post[node] = counter
+                    counter += 1
+                    stack.pop()
+        # (Superclass cycles--which are bogus anyway--are left unnumbered)
+        self._pre, self._post, self._rooted = pre, post, rooted
+        self._numbered = n
+        self._pending = 0
+        self._stale = False
+
+    def _refresh(self):
+        if self._stale or (self._pending > max(self.MIN_PENDING, self._numbered // 4)):
+            self._renumber()
+
+    def is_super(self, name, other_name):
+        '''Is other_name a (strict) superclass of name?  Returns True/False, or None if unknown.'''
+        a = self._ids.get(name)
+        if (a is None) or (self._ifaces[a] is None):
+            return None
+        self._refresh()
+        b = self._ids.get(other_name)
+        pre, parent = self._pre, self._parent
+        # Classes added since the last numbering: walk up to a numbered ancestor
+        # (giving up on anything that looks like a superclass cycle)
+        steps = len(parent)
+        while pre[a] is None:
+            a = parent[a]
+            if a is None:
+                return None
+            if a == -1:
+                return False
+            if a == b:
+                return True
+            steps -= 1
+            if not steps:
+                return None
+        if (b is not None) and (pre[b] is not None) and (pre[b] < pre[a]) and (self._post[a] < self._post[b]):
+            return True
+        return False if self._rooted[a] else None
+
+    def _closure(self, i):
+        '''Bitset of every interface (and every interface's superclass) that class i implements.
+
+            Follows the same rules as ClassDef.implements(): our own interfaces, their
+            superclasses and (recursively) their interfaces--but not our superclass's.
+            Returns None if any class involved is a placeholder.
+        '''
+        bits = self._closures.get(i)
+        if bits is not None:
+            return bits
+        ifaces, parent = self._ifaces, self._parent
+        if ifaces[i] is None:
+            return None
+        # (Mark ourselves in progress, so that bogus interface cycles terminate)
+        self._closures[i] = 0
+        bits = 0
+        for iface in ifaces[i]:
+            sub = self._closure(iface)
+            if sub is None:
+                del self._closures[i]
+                return None
+            bits |= sub
+            j = iface
+            while j != -1:
+                if j is None:
+                    del self._closures[i]
+                    return None
+                bits |= (1 << j)
+                j = parent[j]
+        self._closures[i] = bits
+        return bits
+
+    def implements(self, name, other_name):
+        '''Is other_name implemented by name?  Returns True/False, or None if unknown.'''
+        a = self._ids.get(name)
+        if a is None:
+            return None
+        bits = self._closure(a)
+        if bits is None:
+            return None
+        b = self._ids.get(other_name)
+        return (b is not None) and bool((bits >> b) & 1)
+
+    def is_ambiguous(self, name):
+        '''Is name defined (differently) by more than one module?'''
+        i = self._ids.get(name)
+        return (i is not None) and (i in self._ambiguous)
+
+# Result of comparing two types that have no order at all (e.g., bool and java/lang/String)
+INCOMPARABLE = object()
+
+class TypeLattice(object):
+    '''Memoized comparisons (and joins) of TypeTokens.
+
+        TypeToken.__cmp__ can be expensive (it may walk class hierarchies) and
+        HIScan asks it about the same few pairs of types over and over; we remember
+        every answer by the pair's JTS strings, with "apples and oranges" (the
+        ValueError case) recorded as INCOMPARABLE.  Answers are dropped whenever
+        our hierarchy's generation changes, and never kept for class names the
+        hierarchy finds ambiguous (their answers depend on which class is meant).
+    '''
+
+    def __init__(self, hierarchy):
+        self.hierarchy = hierarchy
+        self._generation = hierarchy.generation
+        self._cmps = {}
+        self.hits = self.misses = 0
+
+    def __len__(self):
+        return len(self._cmps)
+
+    def cmp(self, a, b):
+        '''Like cmp(a, b), except it returns INCOMPARABLE instead of raising ValueError.'''
+        if a is b:
+            return 0
+        if self._generation != self.hierarchy.generation:
+            self._cmps.clear()
+            self._generation = self.hierarchy.generation
+        key = (str(a), str(b))
+        try:
+            result = self._cmps[key]
+            self.hits += 1
+            return result
+        except KeyError:
+            pass
+        self.misses += 1
+        try:
+            result = cmp(a, b)
+        except ValueError:
+            result = INCOMPARABLE
+        if not (self.hierarchy._ambiguous and (self._is_ambiguous(key[0]) or self._is_ambiguous(key[1]))):
+            self._cmps[key] = result
+        return result
+
+    def _is_ambiguous(self, jts):
+        jts = jts.lstrip('[')
+        return jts.startswith('L') and jts.endswith(';') and self.hierarchy.is_ambiguous(jts[1:-1])
+
+    def join(self, a, b):
+        '''The more defined of two types (a if they are equivalent), or INCOMPARABLE.'''
+        result = self.cmp(b, a)
+        if result is INCOMPARABLE:
+            return INCOMPARABLE
+        return b if (result > 0) else a
+
+    def join_all(self, types):
+        '''Join a sequence of types (left to right, like max()); raises ValueError if any are incomparable.'''
+        it = iter(types)
+        try:
+            joined = it.next()
+        except StopIteration:
+            raise ValueError("join_all() arg is an empty sequence")
+        for t in it:
+            j = self.join(joined, t)
+            if j is INCOMPARABLE:
+                raise ValueError('Type compare mismatch: %s and %s' % (joined, t))
+            joined = j
+        return joined
@@ -30,6 +30,8 @@ his: Heuristic instruction scanner for RIM's JVM.
 import sys
 from utils import Primitive, TypeToken, TypeList
 from resolve import ClassDef, FieldDef, RoutineDef, LazyClassDef, LazyFieldDef, LazyRoutineDef
+from resolve import class_name as get_class_name
+from hierarchy import INCOMPARABLE
 from analysis import Subroutine
 import traceback, struct
 from itertools import combinations
@@ -206,6 +208,12 @@ class HIScanner(object):
             self._logfile = sys.stderr
             self._logger = HILogger(self._logfile)
         self.debug_level = debug_level
+
+        # All our type tokens are interned in our loader's pool (so never modify one!)
+        # and compared through its hierarchy's (memoizing) type lattice
+        self._pool = routine.module._L.type_tokens
+        self._hierarchy = routine.module._L.hierarchy
+        self._lattice = self._hierarchy.lattice
         
         # Precompute some common types
         self._tt = dict((k, self.mktt(v)) for k, v in self.CORE_TTS.iteritems())
@@ -219,12 +227,29 @@ class HIScanner(object):
     def count(self, kind):
         self._logger.count(kind)
 
+    def _ambiguous(self, jts):
+        '''Could this JTS name a class defined (differently) by more than one module?'''
+        jts = jts.lstrip('[')
+        return jts.startswith('L') and self._hierarchy.is_ambiguous(jts[1:-1])
+
     def mktt(self, tname, dims=0, class_name=False, base_module_name=None):
+        '''Get the interned TypeToken for a token, class, primitive, JTS/class name or type ordinal.
+
+            Equal types always get the very same token, so tokens must never be modified.
+            The pool only knows types by name, so a token for an explicit class (or for a
+            class name more than one module defines) is built fresh instead.
+        '''
+        pool = self._pool
+        shared = True
         if isinstance(tname, TypeToken):
-            # Clone type token
-            tt = tname.clone()
+            # Canonicalize a type token (copying it first if we need a new shape)
+            shared = not self._ambiguous(str(tname))
+            if not dims:
+                return pool.intern(tname) if shared else tname
+            tt = tname
         elif isinstance(tname, (ClassDef, LazyClassDef)):
             # Object TypeToken of a given class type
+            shared = False
             tt = TypeToken(None)
             tt._object = True
             tt._array = False
@@ -233,42 +258,65 @@ class HIScanner(object):
         elif isinstance(tname, Primitive):
             if str(tname) not in self._tt:
                 raise ValueError("Primitive type %s cannot be a valid type token for scanning" % tname)
-            tt = self._tt[str(tname)].clone()
+            tt = self._tt[str(tname)]
         elif isinstance(tname, basestring):
             if class_name:
                 # tname is a raw class name (i.e., "java/lang/String" instead of "Ljava/lang/String;")
-                tt = TypeToken(None)
-                tt._object = True
-                tt._array = False
-                tt.code = 7
-                if base_module_name:
-                    # we know the modules this class lives in
-                    tt.type = self.routine.module._L.ref_class(base_module_name, tname)
-                else:
-                    # we need to find this class from our module's context
-                    tt.type = self.routine.module.ref_class(tname)
+                shared = not (base_module_name or self._hierarchy.is_ambiguous(tname))
+                tt = pool.get('L%s;' % tname, True) if shared else None
+                if tt is None:
+                    tt = TypeToken(None)
+                    tt._object = True
+                    tt._array = False
+                    tt.code = 7
+                    if base_module_name:
+                        # we know the modules this class lives in
+                        tt.type = self.routine.module._L.ref_class(base_module_name, tname)
+                    else:
+                        # we need to find this class from our module's context
+                        tt.type = self.routine.module.ref_class(tname)
+                    if shared:
+                        tt = pool.intern(tt)
             elif tname == '?':
                 # Special null-object-ref wildcard (not just any type, any OBJECT type)
-                tt = TypeToken.from_jts('*')
-                tt._object = True
+                tt = pool.get('*', True)
+                if tt is None:
+                    tt = TypeToken.from_jts('*')
+                    tt._object = True
+                    tt = pool.intern(tt)
             else:
                 # Parse a fully-JTS-encoded type description
-                tt = TypeToken.from_jts(tname, self.routine.module)
+                shared = not self._ambiguous(tname)
+                tt = pool.get(tname) if shared else None
+                if tt is None:
+                    tt = TypeToken.from_jts(tname, self.routine.module)
+                    if shared:
+                        tt = pool.intern(tt)
         elif isinstance(tname, (int, long)):
             # Ordinal [primitive] type code
             assert (tname in self.TYPE_ORDINAL), "Invalid RIM JVM type ordinal for mktt(): %d" % tname
-            tt = TypeToken(None)
-            tt._object = False
-            tt._array = False
-            tt.code = tname
-            tt.type = Primitive(TypeToken.TYPE_NAME[tname])
+            tt = pool.get(self.TYPE_ORDINAL[tname])
+            if tt is None:
+                tt = TypeToken(None)
+                tt._object = False
+                tt._array = False
+                tt.code = tname
+                tt.type = Primitive(TypeToken.TYPE_NAME[tname])
+                tt = pool.intern(tt)
         else:
             raise ValueError("Invalid argument to mktt(): %s (%s)" % (tname, type(tname)))
         
         # Apply dimensions (which may change the initial type shape)
         if dims:
-            tt._array = True
-            tt.dims = dims
+            jts = ('[' * dims) + str(tt).lstrip('[')
+            arr_tt = pool.get(jts, tt._object) if shared else None
+            if arr_tt is None:
+                arr_tt = tt.clone()
+                arr_tt._array = True
+                arr_tt.dims = dims
+                if shared:
+                    arr_tt = pool.intern(arr_tt)
+            tt = arr_tt
         
         return tt
 
@@ -278,31 +326,38 @@ class HIScanner(object):
         #self.log('Merging types:')
         #for tt in tts:
         #    self.log('  %s' % tt)
+        lattice = self._lattice
         if not no_fail:
-            return max(tts)
+            return lattice.join_all(tts)
         else:
             try:
-                return max(tts)
+                return lattice.join_all(tts)
             except:
                 # we have incompatible types...
                 # first, remove lesser types for more specific
                 reduced_tts = set(tts)
                 for t1, t2 in combinations(reduced_tts, 2):
                     try:
-                        if cmp(t1, t2) == -1:
-                            # t2 is more specific
-                            reduced_tts.remove(t1)
-                        else:
-                            # t1 is more specific
-                            reduced_tts.remove(t2)
+                        order = lattice.cmp(t1, t2)
                     except:
+                        order = INCOMPARABLE
+                    if order is INCOMPARABLE:
                         # we need to keep both incompatible
-                        pass
+                        continue
+                    if order == -1:
+                        # t2 is more specific
+                        reduced_tts.discard(t1)
+                    else:
+                        # t1 is more specific
+                        reduced_tts.discard(t2)
                 # otherwise take the most common or most defined
+                counts = {}
+                for tt in tts:
+                    counts[tt] = counts.get(tt, 0) + 1
                 max_count = 0
                 max_tts = []
                 for tt in reduced_tts:
-                    count = tts.count(tt)
+                    count = counts[tt]
                     if count > max_count:
                         max_tts = [tt,]
                         max_count = count
@@ -874,7 +929,7 @@ class HIScanner(object):
                     assert str(field_type) not in 'JD', 'ERROR: expected category 1 computational type, instead got %s' % str(field_type)
                 
                 # Also, patchup the instruction's operand list accordingly
-                instr.operands[0] = fdef
+                instr.set_operand(0, fdef)
                 self.count("fields")
     _lgetfield = _lgetfield_wide = _getfield_wide = _getfield
 
@@ -1050,7 +1105,7 @@ class HIScanner(object):
                 tstack.push(vmethod.return_type[0])
             
             # Fix-up this instruction so we know what call to make in the future (more easily)
-            instr.operands[0] = vmethod
+            instr.set_operand(0, vmethod)
             self.count("virtuals")
         else:
             raise ValueError("Invalid virtual method: %r" % instr.operands[0])
@@ -1276,7 +1331,7 @@ class HIScanner(object):
                 except (IndexError, AssertionError) as err:
                     raise FieldPatchFailed("field (%d) lookup failed on type '%s'" % (field, this))
                 
-                instr.operands[0] = fdef
+                instr.set_operand(0, fdef)
                 self.count("fields")
     _putfield_wide = _putfield
     
@@ -0,0 +1,202 @@
+#! /usr/bin/env python
+
+# Copyright (c) 2012, derrotehund361@googlemail.com
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met: 
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer. 
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution. 
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+incremental: Dependency tracking for incremental (re)builds of COD dumps.
+"""
+
+import os
+import cPickle
+import hashlib
+import itertools
+import utils
+from resolve import ClassDef, RoutineDef, FieldDef, ClassRef
+from resolve import module_name as get_module_name
+from resolve import LazyClassDef, LazyClassDefFromContext, LazyRoutineDef, LazyFieldDef
+
+def _owner_class(obj):
+    '''Get the ClassDef an operand/type refers to (or that a member belongs to), if any.
+
+        (Uses type() rather than isinstance() so as not to trip lazy-loaders
+        on things that turn out to be plain operands.)
+    '''
+    t = type(obj)
+    if t in (ClassDef, ClassRef, LazyClassDef, LazyClassDefFromContext):
+        return obj.get_class()
+    elif t in (RoutineDef, FieldDef, LazyRoutineDef, LazyFieldDef):
+        return obj.parent
+    elif t is utils.TypeToken:
+        return _owner_class(obj.type)
+    return None
+
+def pulled_classes(module):
+    '''Find every class a (disassembled) module references in other modules.
+
+        Returns a {module_name: {class_name: ClassDef}} map, covering class
+        hierarchies, member/routine signatures, instruction operands and
+        exception handler types.
+    '''
+    own_names = set([module.name] + list(module.aliases))
+    pulled = {}
+
+    def _pull(obj):
+        try:
+            cdef = _owner_class(obj)
+            if cdef is None:
+                return
+            mod_name = cdef.module.name
+        except Exception:
+            # Unresolvable references can't be tracked (or be stale)
+            return
+        if mod_name not in own_names:
+            pulled.setdefault(mod_name, {})[cdef.name] = cdef
+
+    for cdef in module.classes:
+        _pull(cdef.superclass)
+        for iface in cdef.ifaces:
+            _pull(iface)
+        for f in itertools.chain(cdef.fields, cdef.static_fields):
+            for tt in f.type:
+                _pull(tt)
+        for r in cdef.routines:
+            for tt in itertools.chain(r.param_types, r.return_type):
+                _pull(tt)
+            for instr in r.instructions:
+                for op in instr.operands:
+                    _pull(op)
+            for xh in r.handlers:
+                _pull(xh.type)
+    return pulled
+
+def class_summary(cdef):
+    '''Digest the externally-visible shape of a class.
+
+        This is everything a dependant's output is derived from (hierarchy,
+        member names/types and their VFT/FFT order), so a dependant only needs
+        rebuilding when the summary of a class it pulled in changes.
+    '''
+    shape = (
+        cdef.name,
+        str(cdef.superclass),
+        [str(iface) for iface in cdef.ifaces],
+        sorted(cdef.attrs),
+        [(f.name, str(f.type), sorted(f.attrs)) for f in cdef.fields],
+        [(f.name, str(f.type), f.address, sorted(f.attrs)) for f in cdef.static_fields],
+        [(r.to_jts(False), sorted(r.attrs)) for r in cdef.virtual_methods],
+        [(r.to_jts(False), sorted(r.attrs)) for r in cdef.nonvirtual_methods],
+        [(r.to_jts(False), sorted(r.attrs)) for r in cdef.static_methods],
+    )
+    return hashlib.sha1(repr(shape)).hexdigest()
+
+class BuildManifest(object):
+    '''Record of what each dumped module in an output folder was built from.
+
+        For every module we keep its COD hash, imports and siblings, plus the
+        summaries of the classes it pulled from each dependency (and that
+        dependency's COD hash at the time).  A module is stale if its own COD
+        changed, or if a dependency's COD changed AND one of the classes we
+        pulled from it now summarizes differently.
+    '''
+
+    VERSION = 1
+
+    def __init__(self, path, loader):
+        self.path = path
+        self._L = loader
+        self._hashes = {}
+        self.modules = {}
+        if os.path.isfile(path):
+            try:
+                with open(path, 'rb') as fd:
+                    M = cPickle.load(fd)
+                if M.get('version') == self.VERSION:
+                    self.modules = M['modules']
+            except Exception as ex:
+                self._L.log("WARNING: ignoring unreadable build manifest '%s': %s (%s)" % (path, ex, type(ex)))
+
+    def set_loader(self, loader):
+        '''Switch to a new loader (e.g., after the old one was flushed).'''
+        self._L = loader
+
+    def get_cod_hash(self, module_name):
+        '''Get the hash of a module's COD (None if it only exists in a cache).'''
+        try:
+            return self._hashes[module_name]
+        except KeyError:
+            cod_path = self._L._module_path_map.get(module_name)
+            digest = utils.quick_get_hash(cod_path) if cod_path else None
+            self._hashes[module_name] = digest
+            return digest
+
+    def record(self, module):
+        '''Record the inputs of a module that has just been (successfully) dumped.'''
+        pulled = {}
+        for dep_name, classes in pulled_classes(module).iteritems():
+            pulled[dep_name] = {
+                'hash': self.get_cod_hash(dep_name),
+                'base': classes.itervalues().next().module.get_base_module_name(),
+                'classes': dict((name, class_summary(cdef)) for name, cdef in classes.iteritems()),
+            }
+        self.modules[module.name] = {
+            'hash': self.get_cod_hash(module.name),
+            'version': module.version,
+            'imports': map(get_module_name, module.imports),
+            'siblings': list(module.siblings),
+            'pulled': pulled,
+        }
+
+    def is_stale(self, module_name):
+        '''Does a module need to be rebuilt?'''
+        try:
+            entry = self.modules[module_name]
+        except KeyError:
+            return True
+        digest = self.get_cod_hash(module_name)
+        if (digest is None) or (digest != entry['hash']):
+            return True
+
+        for dep_name, dep in entry['pulled'].iteritems():
+            dep_digest = self.get_cod_hash(dep_name)
+            if dep_digest == dep['hash']:
+                continue
+            # The dependency changed; did anything we actually use from it?
+            for class_name, summary in dep['classes'].iteritems():
+                try:
+                    if class_summary(self._L.load_class(dep['base'], class_name)) != summary:
+                        return True
+                except Exception as ex:
+                    self._L.log("Class '%s' pulled by '%s' is no longer loadable: %s (%s)" % (class_name, module_name, ex, type(ex)))
+                    return True
+            # Nothing we use changed; don't bother re-checking this version again
+            dep['hash'] = dep_digest
+        return False
+
+    def forget(self, module_name):
+        '''Drop a module's entry (forcing its rebuild next time).'''
+        self.modules.pop(module_name, None)
+
+    def save(self):
+        with open(self.path, 'wb') as fd:
+            cPickle.dump({'version': self.VERSION, 'modules': self.modules}, fd, cPickle.HIGHEST_PROTOCOL)
@@ -0,0 +1,307 @@
+#! /usr/bin/env python
+
+# Copyright (c) 2012, derrotehund361@googlemail.com
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met: 
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer. 
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution. 
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+packfile: Single-file, random-access container for serialized cache records.
+
+A packfile is a header, a run of binary (protocol-2) pickle records, an index
+of {record name: (offset, length)} and a fixed-size footer locating the index.
+Record names are the same relative paths used by a folder/Zip cache (e.g.
+"net_rim_cldc.cod.db" or "net_rim_cldc/java/lang/Object.cache"), plus the
+routine bodies packs keep apart from their classes (".body" records).  Reads go
+through a (read-only) memory map.  Appends write their records and a new index
+after the old footer, which stays valid (and is found again by readers) until
+the new footer is committed; new packs are written aside and renamed into place.
+Many processes reading one pack thus share a single (page-cached) copy of it,
+each decoding only the classes and routine bodies it touches.
+"""
+
+import os
+import mmap
+import struct
+import cPickle
+import zipfile
+from collections import OrderedDict
+
+PACK_MAGIC = 'CODPACK\x00'
+PACK_VERSION = 1
+
+_HEADER = struct.Struct('<8sI')     # magic, version
+_FOOTER = struct.Struct('<QI4s')    # index offset, index length, end magic
+_END_MAGIC = 'KCAP'
+
+class PackError(Exception): pass
+
+def _read_footer(fd, end):
+    '''Get the (index_offset, index_length) of a footer ending at <end>, or None if there is none.'''
+    if end < _HEADER.size + _FOOTER.size:
+        return None
+    fd.seek(end - _FOOTER.size)
+    index_offset, index_length, end_magic = _FOOTER.unpack(fd.read(_FOOTER.size))
+    if (end_magic != _END_MAGIC) or (index_offset + index_length + _FOOTER.size != end):
+        return None
+    return index_offset, index_length
+
+def _read_index(fd):
+    '''Read the (header-checked) index of an open packfile; returns (index, index_offset, end).
+
+        <end> is where the last committed footer ends; anything after it was written
+        by an append that never committed its index, and is ignored.
+    '''
+    try:
+        fd.seek(0)
+        magic, version = _HEADER.unpack(fd.read(_HEADER.size))
+        if magic != PACK_MAGIC:
+            raise PackError("'%s' is not a packfile" % fd.name)
+        if version != PACK_VERSION:
+            raise PackError("'%s' is a version %d packfile (expected %d)" % (fd.name, version, PACK_VERSION))
+        fd.seek(0, 2)
+        end = fd.tell()
+        footer = _read_footer(fd, end)
+    except (struct.error, IOError):
+        raise PackError("'%s' is too short to be a packfile" % fd.name)
+    if footer is not None:
+        fd.seek(footer[0])
+        return cPickle.loads(fd.read(footer[1])), footer[0], end
+
+    # An interrupted append: fall back to the last footer that was committed
+    mm = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        pos = end
+        while True:
+            pos = mm.rfind(_END_MAGIC, _HEADER.size, pos + len(_END_MAGIC) - 1)
+            if pos < 0:
+                raise PackError("'%s' is truncated (no index footer)" % fd.name)
+            footer = _read_footer(fd, pos + len(_END_MAGIC))
+            if footer is not None:
+                try:
+                    index = cPickle.loads(mm[footer[0]:footer[0] + footer[1]])
+                except Exception:
+                    continue
+                if isinstance(index, dict):
+                    return index, footer[0], pos + len(_END_MAGIC)
+    finally:
+        mm.close()
+
+def is_packfile(path):
+    '''Quickly check a file for the packfile magic.'''
+    try:
+        with open(path, 'rb') as fd:
+            return fd.read(len(PACK_MAGIC)) == PACK_MAGIC
+    except IOError:
+        return False
+
+class PackWriter(object):
+    '''Writes (or appends) records to a packfile; call close() to commit the index.
+
+        Until then, readers of the pack see it as it was when we opened it.
+    '''
+
+    def __init__(self, path, append=True):
+        self.path = path
+        if append and os.path.isfile(path):
+            self._tmp_path = None
+            self._fd = open(path, 'r+b')
+            self._index, index_offset, self._end = _read_index(self._fd)
+            # New records go after the old footer (dropping any an interrupted append
+            # left behind); a fresh index/footer is written after them on close
+            self._fd.seek(self._end)
+            self._fd.truncate()
+        else:
+            # A new pack is written aside and renamed over the old one (if any) on close
+            self._tmp_path = path + '.tmp'
+            self._fd = open(self._tmp_path, 'w+b')
+            self._fd.write(_HEADER.pack(PACK_MAGIC, PACK_VERSION))
+            self._index = {}
+
+    def __contains__(self, name):
+        return name in self._index
+
+    def append_raw(self, name, data):
+        '''Append an already-pickled record (replacing any older record of that name).'''
+        offset = self._fd.tell()
+        self._fd.write(data)
+        self._index[name] = (offset, len(data))
+
+    def append(self, name, record):
+        self.append_raw(name, cPickle.dumps(record, 2))
+
+    def close(self):
+        if self._fd is None:
+            return
+        index = cPickle.dumps(self._index, 2)
+        index_offset = self._fd.tell()
+        self._fd.write(index)
+        self._fd.write(_FOOTER.pack(index_offset, len(index), _END_MAGIC))
+        self._fd.truncate()
+        self._fd.close()
+        self._fd = None
+        if self._tmp_path is not None:
+            _replace(self._tmp_path, self.path)
+
+    def abort(self):
+        '''Discard the records written since we were opened, leaving the pack as it was.'''
+        if self._fd is None:
+            return
+        if self._tmp_path is None:
+            self._fd.seek(self._end)
+            self._fd.truncate()
+        self._fd.close()
+        self._fd = None
+        if self._tmp_path is not None:
+            os.remove(self._tmp_path)
+
+def _replace(tmp_path, path):
+    '''Rename a freshly-written pack over <path>.'''
+    # (Readers re-check the file when they next map it)
+    PackReader.release(path)
+    if (os.name == 'nt') and os.path.exists(path):
+        # (A mapped file cannot be replaced--or renamed over--on Windows)
+        os.remove(path)
+    os.rename(tmp_path, path)
+
+def _file_stamp(fd):
+    st = os.fstat(fd.fileno())
+    return (st.st_ino, st.st_size, st.st_mtime)
+
+class PackReader(object):
+    '''Random-access (memory-mapped) reader of a packfile's records.
+
+        Maps are opened on first read; at most MAX_MAPPED packs stay mapped at
+        once (least-recently-used packs are unmapped) so that per-module packs
+        don't exhaust file handles.  If the pack has been replaced or appended to
+        by the time it is (re)mapped, its index is re-read.
+    '''
+
+    MAX_MAPPED = 64
+    _mapped = OrderedDict()
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as fd:
+            self.index = _read_index(fd)[0]
+            self._stamp = _file_stamp(fd)
+        self._mm = None
+
+    @classmethod
+    def release(cls, path):
+        '''Unmap any reader of the pack at <path> (so it can be replaced).'''
+        path = os.path.abspath(path)
+        for reader in cls._mapped.values():
+            if os.path.abspath(reader.path) == path:
+                reader.close()
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def names(self):
+        return self.index.keys()
+
+    def _map(self):
+        mapped = PackReader._mapped
+        if self._mm is None:
+            while len(mapped) >= self.MAX_MAPPED:
+                mapped.popitem(last=False)[1]._unmap()
+            with open(self.path, 'rb') as fd:
+                stamp = _file_stamp(fd)
+                if stamp != self._stamp:
+                    self.index = _read_index(fd)[0]
+                    self._stamp = stamp
+                self._mm = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            del mapped[id(self)]
+        mapped[id(self)] = self
+        return self._mm
+
+    def _unmap(self):
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+
+    def read(self, name):
+        '''Get the raw (pickled) bytes of a record.'''
+        mm = self._map()
+        offset, length = self.index[name]
+        return mm[offset:offset + length]
+
+    def load(self, name):
+        '''Get a record, unpickled.'''
+        return cPickle.loads(self.read(name))
+
+    def close(self):
+        PackReader._mapped.pop(id(self), None)
+        self._unmap()
+
+# Zip/folder cache import and export
+#----------------------------------------------------------
+def pack_from_cache(cache_path, pack_path):
+    '''Import a zipped (or folder) class cache into a single packfile.
+
+        Records are copied as-is (any pickle protocol loads the same way).
+        Returns the number of records packed.
+    '''
+    PW = PackWriter(pack_path, append=False)
+    count = 0
+    try:
+        if zipfile.is_zipfile(cache_path):
+            ZF = zipfile.ZipFile(cache_path, 'r')
+            for name in ZF.namelist():
+                if name.endswith('.cod.db') or name.endswith('.cache') or name.endswith('.body'):
+                    PW.append_raw(name, ZF.read(name))
+                    count += 1
+            ZF.close()
+        else:
+            for dirpath, dirnames, filenames in os.walk(cache_path):
+                for filename in filenames:
+                    if filename.endswith('.cod.db') or filename.endswith('.cache') or filename.endswith('.body'):
+                        disk_path = os.path.join(dirpath, filename)
+                        name = os.path.relpath(disk_path, cache_path).replace(os.path.sep, '/')
+                        with open(disk_path, 'rb') as fd:
+                            PW.append_raw(name, fd.read())
+                        count += 1
+        PW.close()
+    except:
+        # Don't publish a partial pack (an existing one stays put)
+        PW.abort()
+        raise
+    return count
+
+def zip_from_packs(pack_paths, zip_path):
+    '''Export the records of one or more packfiles as a zipped cache; returns the record count.'''
+    try:
+        ZF = zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED)
+    except RuntimeError:
+        # could not find zlib
+        ZF = zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_STORED)
+    seen = set()
+    for pack_path in pack_paths:
+        PR = PackReader(pack_path)
+        for name in sorted(PR.names()):
+            if name not in seen:
+                seen.add(name)
+                ZF.writestr(name, PR.read(name))
+        PR.close()
+    ZF.close()
+    return len(seen)
@@ -0,0 +1,129 @@
+#! /usr/bin/env python
+
+# Copyright (c) 2012, derrotehund361@googlemail.com
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met: 
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer. 
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution. 
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+planner: Memory-budgeted planning of batch-mode runs.
+
+Batch mode holds every target (and everything they load) at once; individual
+mode reloads the platform modules after every loader flush.  The planner takes
+the transitive import/sibling closure of every target from the dependency graph
+of the CODs on a search path and greedily groups targets into batches
+whose combined closures fit a memory budget, putting each target where its
+closure overlaps the most with what that batch already has to load.  The same
+closures can also split a run into shards for separate processes/hosts.
+"""
+
+import sys
+
+from depgraph import DependencyGraph
+
+class BatchPlanner(object):
+    '''Groups target CODs into batches whose dependency closures fit a memory budget.'''
+
+    # (Very) rough resident size of a loaded, resolved and disassembled module per
+    # byte of its COD; scale the budget (or this) to taste
+    BYTES_PER_COD_BYTE = 60
+
+    def __init__(self, search_path=[], budget=1024 << 20, log_file=sys.stderr, bytes_per_cod_byte=None, graph=None):
+        '''Plan over the CODs on search_path (or those of an already scanned DependencyGraph).'''
+        self.budget = budget
+        self._log = log_file
+        if bytes_per_cod_byte is not None:
+            self.BYTES_PER_COD_BYTE = bytes_per_cod_byte
+        if graph is None:
+            graph = DependencyGraph(log_file=log_file).scan(search_path)
+        self.graph = graph
+
+    def log(self, msg):
+        print >> self._log, msg
+
+    def add_cod(self, cod_path):
+        '''Index the header of a COD not on the search path.'''
+        self.graph.add_cod(cod_path)
+
+    def closure(self, cod):
+        '''Get the modules a target (COD path or module name) transitively imports or is a sibling of.'''
+        name = self.graph.resolve(cod)
+        if name is None:
+            return frozenset()
+        return self.graph.closure(name)
+
+    def estimate(self, modules):
+        '''Estimate the memory (in bytes) needed to hold a set of (indexed) modules.'''
+        return sum(self.graph.get_size(x) for x in modules) * self.BYTES_PER_COD_BYTE
+
+    def plan(self, targets):
+        '''Split targets (COD paths or module names) into batches; returns a list of target lists.'''
+        # Place the targets with the biggest closures first (they constrain the most)
+        closures = dict((t, self.closure(t)) for t in targets)
+        ordered = sorted(targets, key=lambda t: (-self.estimate(closures[t]), t))
+
+        batches = []    # [targets, closure, estimate]
+        for target in ordered:
+            closure = closures[target]
+            best, best_cost = None, None
+            for batch in batches:
+                cost = self.estimate(closure - batch[1])
+                if (batch[2] + cost <= self.budget) and ((best is None) or (cost < best_cost)):
+                    best, best_cost = batch, cost
+            if best is None:
+                if self.estimate(closure) > self.budget:
+                    self.log("WARNING: '%s' alone needs ~%d MB (over budget); giving it a batch of its own" % (target, self.estimate(closure) >> 20))
+                batches.append([[target], set(closure), self.estimate(closure)])
+            else:
+                best[0].append(target)
+                best[1].update(closure)
+                best[2] += best_cost
+
+        for i, (batch_targets, closure, cost) in enumerate(batches):
+            self.log("Batch %d: %d targets, %d modules to load (~%d MB)" % (i + 1, len(batch_targets), len(closure), cost >> 20))
+        return [sorted(batch[0]) for batch in batches]
+
+    def shard(self, targets, count):
+        '''Split targets into (at most) count shards, keeping targets that share dependencies together.'''
+        # Targets with the same closure (e.g., siblings) always go together
+        units = {}
+        for t in targets:
+            closure = self.closure(t)
+            # (but targets we know nothing about don't)
+            units.setdefault(closure or t, (closure, []))[1].append(t)
+        ordered = sorted(units.itervalues(), key=lambda u: (-self.estimate(u[0]), sorted(u[1])))
+
+        # Each unit goes to the shard whose total (estimated) work grows the least; this
+        # balances the shards while still favouring those that already load its dependencies
+        shards = [[[], set(), 0] for i in xrange(count)]
+        for closure, unit_targets in ordered:
+            best = min(shards, key=lambda s: (s[2] + self.estimate(closure - s[1]), len(s[0])))
+            best[2] += self.estimate(closure - best[1])
+            best[0].extend(unit_targets)
+            best[1].update(closure)
+
+        shards = [s for s in shards if s[0]]
+        loaded = sum(len(s[1]) for s in shards)
+        distinct = len(set().union(*[s[1] for s in shards])) if shards else 0
+        self.log("Split %d targets into %d shards (%d module loads for %d distinct modules)" % (len(targets), len(shards), loaded, distinct))
+        for i, (shard_targets, closure, cost) in enumerate(shards):
+            self.log("Shard %d: %d targets, %d modules to load (~%d MB)" % (i, len(shard_targets), len(closure), cost >> 20))
+        return [sorted(s[0]) for s in shards]
@@ -28,10 +28,16 @@ resolve: Tools for resolving the raw parsed bytes of a COD into high-level types
 """
 
 from bytecleaver import *
-import format, utils, disasm
+import format, utils, disasm, packfile, store
+from hierarchy import ClassHierarchy
+from classindex import ClassIndex
 import itertools
+import bisect
+import operator
+from array import array
 import sys
 import os.path
+import time
 import cPickle
 from struct import pack, unpack
 import zipfile
@@ -95,6 +101,23 @@ class LazyModule(LazyLoader):
             del self._lazy_name
         return ref
 
+class LazyDependency(LazyModule):
+    '''A lazy-loading handle to an import/sibling (see Loader.demand_load).'''
+    def _lazy_load(self):
+        ref = object.__getattribute__(self, '_lazy_ref')
+        if ref is None:
+            loader = object.__getattribute__(self, "_lazy_loader")
+            mod_name = object.__getattribute__(self, "_lazy_name")
+
+            # Load and set our internal reference (making sure it is resolved, too)
+            ref = self._lazy_ref = loader.load_dependency(mod_name)
+
+            # These are no longer needed here
+            del self._lazy_loader
+            del self._lazy_module_name
+            del self._lazy_name
+        return ref
+
 class LazyClassDef(LazyLoader):
     def _lazy_load(self):
         ref = object.__getattribute__(self, '_lazy_ref')
@@ -168,13 +191,36 @@ class LazyFieldDef(LazyLoader):
             del self._lazy_name
         return ref
 
+def class_name(cls):
+    '''Get the [JTS] name of a (possibly lazy-loading) class without forcing it to load.'''
+    if type(cls) is ClassDef:
+        return cls.name
+    if isinstance(cls, LazyLoader):
+        ref = object.__getattribute__(cls, '_lazy_ref')
+        if ref is None:
+            return object.__getattribute__(cls, '_lazy_name')
+        return class_name(ref)
+    return str(cls)
+
+def module_name(mod):
+    '''Get the name of a (possibly lazy-loading) module without forcing it to load.'''
+    if isinstance(mod, LazyLoader):
+        ref = object.__getattribute__(mod, '_lazy_ref')
+        if ref is None:
+            return object.__getattribute__(mod, '_lazy_name')
+        return ref.name
+    return mod.name
+
 
 class LoadError(Exception): pass
 
 class Loader(object):
     '''Context object used to manage the loading/resolving of COD modules (from COD or cache).'''
 
-    def __init__(self, search_path=[], cache_root=None, name_db_path=None, auto_resolve=True, log_file=sys.stderr):
+    # Version of the .cod.db/.cache layout (bump whenever SerialDumper's output changes)
+    CACHE_VERSION = 1
+
+    def __init__(self, search_path=[], cache_root=None, name_db_path=None, auto_resolve=True, log_file=sys.stderr, demand_load=False):
         if not isinstance(search_path, list):
             # in case we get '/home/user/blah'
             search_path = [search_path,]
@@ -185,9 +231,15 @@ class Loader(object):
             search_path = search_path + ['.',]
         self.search_path = search_path
         self.auto_resolve = auto_resolve
+        # in demand-load mode, imports/siblings are only loaded once something points into them
+        self.demand_load = demand_load
+        # names of the dependencies handed out as lazy handles (in demand-load mode)
+        self._deferred_modules = set()
         self._log = log_file
         # dict of [module_name]
         self._modules = {}
+        # dict of [module_name] -> disasm.OperandTable (shared by the module's InstructionStreams)
+        self._operand_tables = {}
         # dict of [base_module_name][classpath]
         self._classes = {}
         # dict of module_name -> base_module_name
@@ -206,8 +258,20 @@ class Loader(object):
         self._module_path_map = {}
         self._init_module_path_map()
         # a map of module names/aliases to their cache location, loaded or not
+        # (and the (name, base module name, class names) of every cached module, for our class index)
         self._module_cache_map = {}
+        self._cached_class_lists = []
         self._init_module_cache_map()
+        # index of the classes defined by every cached/searchable module (built on demand)
+        self._class_index = None
+        # memoized COD hashes and cache-stamp checks (and the cache entries found stale)
+        self._source_hashes = {}
+        self._stamp_checks = {}
+        self.stale_cache_entries = set()
+        # index of every class actualized/loaded so far (for subtype queries)
+        self.hierarchy = ClassHierarchy()
+        # interned type tokens (shared by every HIScanner working on our classes)
+        self.type_tokens = utils.TypeTokenPool()
 
     def _init_module_path_map(self):
         for search_path in self.search_path[::-1]:
@@ -230,15 +294,38 @@ class Loader(object):
                 cached_cod_names = self.cache_root.namelist()
                 cached_cod_names = [x[:-7] for x in cached_cod_names if '/' not in x and x.endswith('.cod.db')]
             else:
-                cached_cod_names = os.listdir(self.cache_root)
-                cached_cod_names = [x for x in cached_cod_names if os.path.isfile(os.path.join(self.cache_root, x))]
-                cached_cod_names = [x[:-7] for x in cached_cod_names if x.endswith('.cod.db')]
+                cached_cod_names = [x[:-7] for x in self._packs if '/' not in x and x.endswith('.cod.db')]
+                if os.path.isdir(self.cache_root):
+                    disk_names = os.listdir(self.cache_root)
+                    disk_names = [x for x in disk_names if os.path.isfile(os.path.join(self.cache_root, x))]
+                    cached_cod_names += [x[:-7] for x in disk_names if x.endswith('.cod.db')]
             for cached_cod_name in cached_cod_names:
                 M = self._unpickle(cached_cod_name + '.cod.db')
                 names = [M['name'],] + M['aliases']
                 for name in names:
                     self._module_cache_map[name] = cached_cod_name
+                self._cached_class_lists.append((M['name'], M['siblings'][0] if M['siblings'] else M['name'], M['classes']))
         
+    @property
+    def class_index(self):
+        '''Index of the classes of every cached module and every COD on the search path (a ClassIndex).
+
+            Built on first use from the cache's module records and (for modules
+            that aren't cached) the class-def tables of the CODs themselves.
+        '''
+        if self._class_index is None:
+            index = ClassIndex(self._log)
+            for name, base_module_name, class_names in self._cached_class_lists:
+                index.add_module(name, base_module_name, class_names)
+            cod_names = {}
+            for name, cod_path in self._module_path_map.iteritems():
+                cod_names.setdefault(cod_path, []).append(name)
+            for cod_path in sorted(cod_names):
+                if not any(name in self._module_cache_map for name in cod_names[cod_path]):
+                    index.add_cod(cod_path)
+            self._class_index = index
+        return self._class_index
+
     def _init_cache_root(self, cache_root):
         assert self.cache_root is None
         if (cache_root is not None):
@@ -248,10 +335,36 @@ class Loader(object):
                 self.cache_root = cache_root
         else:
             self.cache_root = cache_root
+        self._init_packs()
+
+    def _init_packs(self):
+        '''Index the records of every packfile in our cache (or of the packfile that IS our cache).'''
+        # dict of cache-relative record path -> PackReader
+        self._packs = {}
+        if (self.cache_root is None) or isinstance(self.cache_root, zipfile.ZipFile):
+            return
+        if os.path.isdir(self.cache_root):
+            pack_paths = [os.path.join(self.cache_root, x) for x in sorted(os.listdir(self.cache_root)) if x.endswith('.pack')]
+        else:
+            pack_paths = [self.cache_root]
+        for pack_path in pack_paths:
+            try:
+                if store.is_manifest(pack_path):
+                    # one version of a content-addressed store reads just like a packfile
+                    PR = store.VersionReader(pack_path)
+                else:
+                    PR = packfile.PackReader(pack_path)
+            except (IOError, packfile.PackError, store.StoreError) as ex:
+                self.log("Unable to open packfile '%s': %s (%s)" % (pack_path, ex, type(ex)))
+                continue
+            for name in PR.names():
+                self._packs[name] = PR
 
     def _can_unpickle(self, rel_path):
         if self.cache_root is None:
             raise Exception("No cache is available")
+        elif rel_path in self._packs:
+            return True
         elif isinstance(self.cache_root, zipfile.ZipFile):
             try:
                 self.cache_root.getinfo(rel_path)
@@ -265,6 +378,8 @@ class Loader(object):
     def _unpickle(self, rel_path):
         if self.cache_root is None:
             raise Exception("No cache is available")
+        elif rel_path in self._packs:
+            return self._packs[rel_path].load(rel_path)
         elif isinstance(self.cache_root, zipfile.ZipFile):
             return cPickle.loads(self.cache_root.read(rel_path))
         else:
@@ -272,6 +387,81 @@ class Loader(object):
             with open(disk_path, 'rt') as fd:
                 return cPickle.load(fd)
 
+    def _get_source_hash(self, cod_path, size, mtime):
+        key = (cod_path, size, mtime)
+        try:
+            return self._source_hashes[key]
+        except KeyError:
+            digest = self._source_hashes[key] = utils.quick_get_hash(cod_path)
+            return digest
+
+    def get_cache_stamp(self, module):
+        '''Get the validity stamp to store with a module's cache entries.
+
+            Records the cache format version, the module version/timestamp and the
+            hash (plus size/mtime) of the COD the module was loaded from.
+        '''
+        if module._stamp is not None:
+            # Came from the cache itself; still describes the same COD
+            return module._stamp
+        stamp = {
+            'cache_version': self.CACHE_VERSION,
+            'version': module.version,
+            'timestamp': module.timestamp,
+            'source_hash': None,
+            'source_size': None,
+            'source_mtime': None,
+        }
+        cod_path = self._module_path_map.get(module.name)
+        if cod_path is not None:
+            st = os.stat(cod_path)
+            stamp['source_size'], stamp['source_mtime'] = st.st_size, int(st.st_mtime)
+            stamp['source_hash'] = self._get_source_hash(cod_path, stamp['source_size'], stamp['source_mtime'])
+        return stamp
+
+    def check_cache_stamp(self, module_name, stamp):
+        '''Check a cache entry's stamp against the COD it was built from.
+
+            Cheap checks come first: format version, then COD size/mtime (a match
+            means the COD is untouched), then the COD header's version/timestamp;
+            the COD is only hashed if those are inconclusive.  A module with no
+            COD on the search path has nothing to be stale against.
+        '''
+        if (not stamp) or (stamp.get('cache_version') != self.CACHE_VERSION):
+            return False
+        cod_path = self._module_path_map.get(module_name)
+        if cod_path is None:
+            return True
+
+        key = (module_name, stamp['source_hash'], stamp['source_size'], stamp['source_mtime'])
+        try:
+            return self._stamp_checks[key]
+        except KeyError:
+            pass
+
+        st = os.stat(cod_path)
+        size, mtime = st.st_size, int(st.st_mtime)
+        if (size, mtime) == (stamp['source_size'], stamp['source_mtime']):
+            current = True
+        elif size != stamp['source_size']:
+            current = False
+        elif (utils.quick_get_version(cod_path), utils.quick_get_timestamp(cod_path)) != (stamp['version'], stamp['timestamp']):
+            current = False
+        else:
+            current = (self._get_source_hash(cod_path, size, mtime) == stamp['source_hash'])
+        self._stamp_checks[key] = current
+        return current
+
+    def is_cache_current(self, name):
+        '''Does a module have a current (i.e., non-stale) entry in our cache?'''
+        if (self.cache_root is None) or (name not in self._module_cache_map):
+            return False
+        try:
+            M = self._unpickle(self._module_cache_map[name] + ".cod.db")
+        except Exception:
+            return False
+        return self.check_cache_stamp(M['name'], M.get('stamp'))
+
     def _ds_export(self, export):
         '''Deserialize an ExportedItem from a depickled blob.'''
         X = ExportedItem(None, None)
@@ -307,11 +497,18 @@ class Loader(object):
             self.log("Unable to load module '%s' from cache: %s (%s)" % (name, ex, type(ex)))
             return None
 
+        # Don't trust it if it was built from a different COD (or by a different serializer)
+        if not self.check_cache_stamp(M['name'], M.get('stamp')):
+            self.log("Ignoring stale cache entry for module '%s'" % name)
+            self.stale_cache_entries.add(name + ".cod.db")
+            return None
+
         # Create an empty module object; populate its fields
         mod = Module(None, None)
         mod._R = None
         mod._L = self
         mod._resolved = mod._actualized = mod._disasmed = True
+        mod._stamp = M['stamp']
 
         mod.name, mod.version, mod.timestamp = M['name'], M['version'], M['timestamp']
         mod.attrs = dict((a, a) for a in M['attrs'])
@@ -348,7 +545,9 @@ class Loader(object):
             mod.method_fixups = mod.virtual_method_fixups = \
             mod.static_method_fixups = mod.class_ref_fixups = \
             mod.mod_ref_fixups = []
-        mod._crem = mod._mod_remap = {}
+        mod._crem = {}
+        mod._crtab = {}
+        mod._mod_remap = {}
 
         return mod
 
@@ -361,6 +560,23 @@ class Loader(object):
             # Otherwise, return a lazy-loading reference to the module
             return LazyModule(name, name, self)
 
+    def defer_module(self, name):
+        '''Return a lazy handle to a dependency that loads (and resolves) it on first use.'''
+        try:
+            return self._modules[name]
+        except KeyError:
+            self._deferred_modules.add(name)
+            return LazyDependency(name, name, self)
+
+    def load_dependency(self, name):
+        '''Load and resolve a dependency (what a lazy handle from defer_module() does on first use).'''
+        self.log("Loading deferred dependency '%s'" % name)
+        return self.load_module(name).resolve()
+
+    def get_avoided_modules(self):
+        '''Names of the dependencies deferred in demand-load mode that never had to be loaded.'''
+        return sorted(n for n in self._deferred_modules if n not in self._modules)
+
     def load_codfile(self, filename):
         '''Load a module from an explicitly-named COD file.'''
         filename = os.path.split(filename)[1]
@@ -424,6 +640,23 @@ class Loader(object):
             except KeyError:
                 pass
             del self._modules[name]
+        self._operand_tables.pop(name, None)
+
+    def get_operand_table(self, module):
+        '''Return the OperandTable interning the instruction operands of <module>.
+
+            (A lazy module reference is not loaded just to learn its name.)
+        '''
+        if issubclass(type(module), LazyLoader):
+            ref = object.__getattribute__(module, '_lazy_ref')
+            name = object.__getattribute__(module, '_lazy_name') if (ref is None) else ref.name
+        else:
+            name = module.name
+        try:
+            return self._operand_tables[name]
+        except KeyError:
+            table = self._operand_tables[name] = disasm.OperandTable()
+            return table
 
     def load_module(self, name):
         '''Load a module from the search path'''
@@ -581,13 +814,25 @@ class Loader(object):
         rd.stack_map = [self._ds_sme(x, parent.module) for x in method_data['stack_map']]
 
         # Instructions/exception handlers
-        rd.instructions = [self._ds_instruction(instr, parent.module) for instr in method_data['instructions']]
-        rd.handlers = map(self._ds_handler, method_data['handlers'])
+        if 'body' in method_data:
+            # (Stored as a record of its own; only decoded if/when somebody looks at it)
+            rd._body = (self, method_data['body'])
+        else:
+            rd.instructions = disasm.InstructionStream(self.get_operand_table(parent.module),
+                (self._ds_instruction(instr, parent.module) for instr in method_data['instructions']))
+            rd.handlers = map(self._ds_handler, method_data['handlers'])
 
         # All ready to go!
         rd._disasmed = rd._resolved = True
         return rd
 
+    def _ds_body(self, rd, rel_path):
+        '''Deserialize the (separately-cached) instructions/handlers of a routine; returns both lists.'''
+        instructions, handlers = self._unpickle(rel_path)
+        instructions = disasm.InstructionStream(self.get_operand_table(rd.module),
+            (self._ds_instruction(instr, rd.module) for instr in instructions))
+        return instructions, map(self._ds_handler, handlers)
+
     def _ds_class(self, base_module_name, name):
         '''Deserialize a ClassDef from a depickled blob.'''
         cache_path = "%s/%s" % (base_module_name, name + ".cache")
@@ -596,6 +841,10 @@ class Loader(object):
         except Exception as ex:
             self.log("Unable to load cached class from '%s': %s (%s)" % (cache_path, ex, type(ex)))
             return None
+        if not self.check_cache_stamp(C['module'], C.get('stamp')):
+            self.log("Ignoring stale cache entry for class '%s'" % cache_path)
+            self.stale_cache_entries.add(cache_path)
+            return None
 
         # Create an empty class def object (cache a reference to it)
         cd = ClassDef(None, None)
@@ -631,8 +880,13 @@ class Loader(object):
         # Populate VFT and FFT (i.e., re-actualize)
         cd.vft = [self._ds_jts_ref(C['vft_modules'][i], 'M', C['vft'][i]) for i in range(len(C['vft']))]
         cd.fft = [self._ds_jts_ref(C['fft_modules'][i], 'F', C['fft'][i]) for i in range(len(C['fft']))]
+        cd._vft_index = None
         cd._actualized = True
 
+        # Register with the class hierarchy index (by name, so nothing need be loaded)
+        self.hierarchy.add(cd.name, C['superclass'], C['ifaces'], base_module_name)
+        cd._hierarchy = self.hierarchy
+
         # Make sure this class ends up in the memory cache
         self.add_class_def(cd)
 
@@ -648,7 +902,7 @@ class Loader(object):
         # this function is an evil necessity because we don't fully
         # understand the mod_index in ClassRefs
         if module._resolved:
-            dependencies = [module.name,] + [x.name for x in module.imports]
+            dependencies = [module.name,] + map(module_name, module.imports)
         else:
             dependencies = [module.name,] + module.raw_imports
 
@@ -672,6 +926,16 @@ class Loader(object):
                 if self._can_unpickle(cache_path):
                     return base_module_name
 
+        # otherwise ask our class index which module defines it (if that's one
+        # of our dependencies or their siblings, just load that one)
+        dependency_bases = set(self._base_module_map[mod_name] for mod_name in dependencies if mod_name in self._base_module_map)
+        for base_module_name, mod_name in self.class_index.lookup(classpath):
+            if base_module_name in dependency_bases:
+                visited.add(mod_name)
+                self.load_module(mod_name)
+                if classpath in self._classes.get(base_module_name, ()):
+                    return base_module_name
+
         # soooooo sloowwwwwwww
         # otherwise try to start loading modules to look
         for mod_name in dependencies:
@@ -725,7 +989,7 @@ class Loader(object):
             return None
         # If it's already loaded, return a straight reference
         if module._resolved:
-            module_names = [x.name for x in module.imports]
+            module_names = map(module_name, module.imports)
         else:
             module_names = module.raw_imports
         module_names = [module.name,] + module_names
@@ -826,12 +1090,14 @@ class Loader(object):
     def add_new_search_path(self, new_path):
         self.search_path.append(new_path)
         self._init_module_path_map()
+        self._class_index = None
 
     def set_cache_root(self, cache_root):
         '''Initialization of a cache root after the loader has been created.'''
         assert self.cache_root == None
         self._init_cache_root(cache_root)
         self._init_module_path_map()
+        self._class_index = None
 
     def open_name_db(self, db_path):
         # if we already have one open, save and close it
@@ -985,9 +1251,19 @@ class Resolver(object):
                 urc.name = class_
                 return urc
         elif isinstance(class_, utils.UnresolvedClass):
-            mod_byte, class_byte = class_.class_id
+            class_id = class_.class_id
         else:
-            mod_byte, class_byte = class_
+            class_id = tuple(class_)
+
+        # Every class ID is resolved only once (this is hit for every type/class reference we have)
+        try:
+            return self._cache['crefs'][class_id]
+        except KeyError:
+            cdef = self._cache['crefs'][class_id] = self._get_class_by_id(*class_id)
+            return cdef
+
+    def _get_class_by_id(self, mod_byte, class_byte):
+        M = self._M
 
         # Maybe the class ref is stuffed in the "extra" class field
         # this is the case for raw cod sectors on phones
@@ -1003,19 +1279,13 @@ class Resolver(object):
 
         # Unless the mod byte is 0 (local) or 255 (???) or a sibling
         if mod_byte not in (0, 255) and \
-            M.imports[mod_byte - 1].name not in M.siblings:
-            # Otherwise, start with a Class-Ref list lookup
-            # class_byte maxes out at 255, while index may be > 255
-            # Ergo, we must check all indices such that (index & 0xff) == class_byte
-            index, max = class_byte, len(M.class_refs)
-            while index < max:
-                cr = M.class_refs[index]
-                if (cr.mod_index == mod_byte) and (cr.extra == (0, 0)):
-                    # If the module index of the ref matches the one in our class ID, it's the class
-                    # (Unless its extra fields are not (0, 0); then it has been remapped somehow...)
-                    return cr.get_class()
-                # Otherwise, try the next possible match
-                index += 256
+            module_name(M.imports[mod_byte - 1]) not in M.siblings:
+            # Otherwise, start with a Class-Ref lookup
+            # (Refs whose extra fields are not (0, 0) have been remapped somehow, and are not in the table...)
+            try:
+                return M._crtab[(mod_byte, class_byte)].get_class()
+            except KeyError:
+                pass
 
         # Try a module-based lookup (if the mod-byte is not 255)
         if mod_byte != 255:
@@ -1049,6 +1319,23 @@ class Resolver(object):
 
 # Main COD abstract types
 #----------------------------------------------------------
+class _ModuleTable(object):
+    '''A Module member table built (by the given Module method) on first access.
+
+        The builder stores the table (and any tables built alongside it) in the
+        module's __dict__, which shadows this (non-data) descriptor from then on;
+        modules restored from cache just assign their tables directly.
+    '''
+    def __init__(self, name, builder):
+        self.name = name
+        self.builder = builder
+
+    def __get__(self, obj, cls=None):
+        if obj is None:
+            return self
+        self.builder(obj)
+        return obj.__dict__[self.name]
+
 
 class Module(object):
 
@@ -1063,6 +1350,7 @@ class Module(object):
 
         self._cf = cod_file
         self._disk = (cod_file.hdr.section_num == 0)  # This COD is in disk, not heap, mode
+        self._stamp = None  # (Only cached modules come with a cache stamp)
         self._L = loader
         self._R = Resolver(self)
         R = self._R
@@ -1081,32 +1369,58 @@ class Module(object):
         self.aliases = map(R.get_escaped_lit, ds.aliases)
         self.raw_imports = [R.get_escaped_lit(n) for n, v in ds.modules[1:]]
         self.raw_import_versions = [R.get_escaped_lit(v) for n, v in ds.modules[1:]]
-        self.exports = [ExportedItem(self, off) for off in ds.exports]
         self.statics = [(sd.address, sd.value) for sd in ds.static_data] # Not sure what these are yet...
 
         # Load our routines before loading the classes
         # (They can get patched-up to go with their appropriate classes later)
         self.routines = [RoutineDef(self, rd) for rd in cs.routines]
         self._routine_map = dict((r.offset, r) for r in self.routines)
+        # (routines not disassembled yet; our fixup table goes once the last one is)
+        self._undisasmed = len(self.routines)
 
         # Load class definitions; register them with our loader
         self.classes = [ClassDef(self, cd) for cd in ds.class_defs]
         map(loader.add_class_def, self.classes)
 
-        # Name-resolve lists of interface methods and classes referenced
-        self.iface_mrefs = [InterfaceMethodRef(self, off) for off in ds.iface_method_refs]
-        self.class_refs = [ClassRef(self, off) for off in ds.class_refs]
+        # (Our exports, interface-method/class refs, fixups and signatures are built on
+        # first use--modules loaded just to look up a class or two never need most of them)
+
+        self._resolved = self._actualized = self._disasmed = False
+
+    # Lazily-built member tables (see _ModuleTable)
+    #----------------------------------------------------------
+    def _build_exports(self):
+        self.exports = [ExportedItem(self, off) for off in self._R._cf.data.exports]
 
-        # Create a offset-reference maps for class/ifacem-refs
+    def _build_iface_mrefs(self):
+        # Name-resolve the list of interface methods referenced (and map them by offset)
+        ds = self._R._cf.data
+        self.iface_mrefs = [InterfaceMethodRef(self, off) for off in ds.iface_method_refs]
         self._iface_mref_map = dict((imr.offset - ds._start, imr) for imr in self.iface_mrefs)
+
+    def _build_class_refs(self):
+        # Name-resolve the list of classes referenced (and map them by offset)
+        ds = self._R._cf.data
+        self.class_refs = [ClassRef(self, off) for off in ds.class_refs]
         self._class_ref_map = dict((cr.offset - ds._start, cr) for cr in self.class_refs)
 
         # Create a (class-ref-extra => class-ref) mapping for alternative class lookup code
         # (Isn't RIM wonderful?)
+        self._crem = {}
         if not self._disk:
             self._crem = dict((cr.extra, cr) for cr in self.class_refs if cr.extra != (0, 0))
 
+        # Create a (mod-byte, class-byte => class-ref) table for the usual class-ref lookup
+        # (Class bytes max out at 255 while class-ref indices may not, so a class byte can name
+        # any ref whose index matches it mod 256; the lowest-indexed un-remapped match wins)
+        self._crtab = {}
+        for index, cr in enumerate(self.class_refs):
+            if cr.extra == (0, 0):
+                self._crtab.setdefault((cr.mod_index, index & 0xff), cr)
+
+    def _build_fixups(self):
         # Parse fixup references (i.e., what the fixups refer to) but don't resolve yet
+        ds = self._R._cf.data
         _instance_field_fixups = itertools.chain(ds.field_fixups, ds.local_field_fixups)
         self.field_fixups = [FixupField(self, fxp) for fxp in _instance_field_fixups]
         self.static_field_fixups = [FixupField(self, fxp) for fxp in ds.static_field_fixups]
@@ -1116,10 +1430,25 @@ class Module(object):
         self.class_ref_fixups = [FixupClassRef(self, fxp) for fxp in ds.class_ref_fixups]
         self.mod_ref_fixups = [FixupModRef(self, fxp) for fxp in ds.mod_code_fixups]
 
-        # And grab our signatures (at least that's what I think they are...)
-        self.signatures = [Signature(self, ti) for ti in cod_file.trailer.items]
-
-        self._resolved = self._actualized = self._disasmed = False
+    def _build_signatures(self):
+        # (At least that's what I think they are...)
+        self.signatures = [Signature(self, ti) for ti in self._R._cf.trailer.items]
+
+    exports = _ModuleTable('exports', _build_exports)
+    iface_mrefs = _ModuleTable('iface_mrefs', _build_iface_mrefs)
+    _iface_mref_map = _ModuleTable('_iface_mref_map', _build_iface_mrefs)
+    class_refs = _ModuleTable('class_refs', _build_class_refs)
+    _class_ref_map = _ModuleTable('_class_ref_map', _build_class_refs)
+    _crem = _ModuleTable('_crem', _build_class_refs)
+    _crtab = _ModuleTable('_crtab', _build_class_refs)
+    field_fixups = _ModuleTable('field_fixups', _build_fixups)
+    static_field_fixups = _ModuleTable('static_field_fixups', _build_fixups)
+    method_fixups = _ModuleTable('method_fixups', _build_fixups)
+    virtual_method_fixups = _ModuleTable('virtual_method_fixups', _build_fixups)
+    static_method_fixups = _ModuleTable('static_method_fixups', _build_fixups)
+    class_ref_fixups = _ModuleTable('class_ref_fixups', _build_fixups)
+    mod_ref_fixups = _ModuleTable('mod_ref_fixups', _build_fixups)
+    signatures = _ModuleTable('signatures', _build_signatures)
 
     def get_base_module_name(self):
         return self.siblings[0]
@@ -1156,25 +1485,32 @@ class Module(object):
         self._L.log(dump)
         '''
 
-        # Load our siblings (this accounts for slight version differences
-        # where a class moved to a different sibling)
-        # For example,
-        #   net/rim/device/alpha/ui/mediaanimation/CoordinatedAnimation
-        # has moved from net_rim_ui_alpha to net_rim_ui_alpha-1
-        # from 6.0.0.141 to 6.0.0.448
-        # loading siblings like this takes some extra time,
-        # but allows some symbolic flexibility between versions
-        for sibling in self.siblings:
-            m = self._L.load_module(sibling)
-            m.resolve()
-
-        # Load our imported modules
-        self.imports = [self._L.load_module(n) for n in self.raw_imports]
+        if self._L.demand_load:
+            # Bind our siblings/imports to lazy handles; each one is loaded (and resolved)
+            # only once a class reference, fixup or superclass actually points into it
+            for sibling in self.siblings:
+                self._L.defer_module(sibling)
+            self.imports = [self._L.defer_module(n) for n in self.raw_imports]
+        else:
+            # Load our siblings (this accounts for slight version differences
+            # where a class moved to a different sibling)
+            # For example,
+            #   net/rim/device/alpha/ui/mediaanimation/CoordinatedAnimation
+            # has moved from net_rim_ui_alpha to net_rim_ui_alpha-1
+            # from 6.0.0.141 to 6.0.0.448
+            # loading siblings like this takes some extra time,
+            # but allows some symbolic flexibility between versions
+            for sibling in self.siblings:
+                m = self._L.load_module(sibling)
+                m.resolve()
+
+            # Load our imported modules
+            self.imports = [self._L.load_module(n) for n in self.raw_imports]
+
+            # Ensure our imports have been resolved
+            for m in self.imports: m.resolve()
         self.import_versions = [v for v in self.raw_import_versions]
 
-        # Ensure our imports have been resolved
-        for m in self.imports: m.resolve()
-
         # Resolve type references for routine parameters and interface method parameters
         _resolver = R.get_class
         for r in self.routines: r.resolve(_resolver)
@@ -1187,7 +1523,8 @@ class Module(object):
         for ep in self.entry_points: ep.resolve(_resolver)
 
         # Remove some unneeded references so that the GC can clean up after us
-        del self._cf, self._class_ref_map
+        # (The class-ref map goes once actualize() has built our fixups)
+        del self._cf
 
         # Create a module-remapping table (we have no idea what we're doing here, but it might work...)
         if not self._disk:
@@ -1213,19 +1550,14 @@ class Module(object):
         # from 6.0.0.141 to 6.0.0.448
         # loading siblings like this takes some extra time,
         # but allows some symbolic flexibility between versions
-        for sibling in self.siblings:
-            m = self._L.load_module(sibling)
-            m.actualize()
+        # (In demand-load mode, classes are actualized one by one as they are needed instead)
+        if not self._L.demand_load:
+            for sibling in self.siblings:
+                m = self._L.load_module(sibling)
+                m.actualize()
         
-        # Start with actualizing the fixups (creating an address-wise map of fixup references
-        # and replacing FixupXXX objects in the fixup arrays with the objects they reference...
-        def _actualize_fixup_list(f_list, f_map, resolver):
-            for i in xrange(0, len(f_list)):
-                f = f_list[i]
-                f_obj = f.resolve(resolver)
-                if f.offsets:
-                    for o in f.offsets:
-                        f_map[o] = f_obj
+        # Start with actualizing the fixups (resolving each FixupXXX object to the object it
+        # references and collecting an address-sorted table of fixup offsets/targets)...
         _fixup_lists = (
             self.field_fixups,
             self.static_field_fixups,
@@ -1235,10 +1567,28 @@ class Module(object):
             self.class_ref_fixups,
             self.mod_ref_fixups,
         )
-        self._fixup_map = {}
+        _fixups = []
         _resolver = self._R.get_class
         for f_list in _fixup_lists:
-            _actualize_fixup_list(f_list, self._fixup_map, _resolver)
+            for f in f_list:
+                f_obj = f.resolve(_resolver)
+                if f.offsets:
+                    _fixups.extend((o, f_obj) for o in f.offsets)
+
+        # The table is a pair of parallel arrays sorted by offset, so each routine can apply
+        # its fixups with one merge pass over its (contiguous) code range at disasm()-time
+        # (The sort is stable, so the last fixup seen for a given offset wins)
+        _fixups.sort(key=operator.itemgetter(0))
+        self._fixup_offsets = array('l')
+        self._fixup_targets = []
+        for o, f_obj in _fixups:
+            if self._fixup_offsets and (self._fixup_offsets[-1] == o):
+                self._fixup_targets[-1] = f_obj
+            else:
+                self._fixup_offsets.append(o)
+                self._fixup_targets.append(f_obj)
+        del _fixups
+        self.__dict__.pop('_class_ref_map', None)
 
         # Now actualize the classes (compute VFTs, etc.)
         for c in self.classes:
@@ -1246,19 +1596,72 @@ class Module(object):
 
         return self
 
-    def disasm(self, auto_resolve = True):
-        '''Trigger disassembly/fixup of all routines defined in this module.'''
+    def disasm(self, auto_resolve = True, eager = False):
+        '''Trigger disassembly/fixup of all routines defined in this module.
+
+            Unless <eager>, each routine is only disassembled (and fixed up) the
+            first time its instructions/handlers are looked at; routines nobody
+            looks at are never decoded.
+        '''
         if self._disasmed: return self
+        self._disasmed = True
+        if not eager:
+            self._L.log("Deferring disassembly of %d routines from module '%s' until first use" % (len(self.routines), self.name))
+            for r in self.routines:
+                r.defer_disasm(auto_resolve = auto_resolve)
+            if not self._undisasmed:
+                self._routine_disasmed(auto_resolve)
+            return self
         self._L.log("Disassembling %d routines from module '%s'" % (len(self.routines), self.name))
 
+        started = time.time()
         for r in self.routines:
             r.disasm(auto_resolve = auto_resolve)
-
-        if auto_resolve:
-            del self._fixup_map, self._iface_mref_map
-        self._disasmed = True
+        elapsed = time.time() - started
+        count = sum(len(r.instructions) for r in self.routines)
+        self._L.log("Disassembled %d instructions in %.3fs (%d instructions/s)" % (count, elapsed, count / max(elapsed, 1e-6)))
         return self
 
+    def release_code(self):
+        '''Free the code and fixup tables kept for routines whose (deferred) disassembly never happened.
+
+            Call once done with a module (e.g., after dumping it); those routines can
+            no longer be disassembled afterwards.
+        '''
+        if not getattr(self, '_undisasmed', 0):
+            return
+        for r in self.routines:
+            r.release_code()
+        self._undisasmed = 0
+        self.__dict__.pop('_fixup_offsets', None)
+        self.__dict__.pop('_fixup_targets', None)
+        self.__dict__.pop('_iface_mref_map', None)
+
+    def _routine_disasmed(self, auto_resolve):
+        '''Note that one more routine has been disassembled (freeing our fixup table after the last one).'''
+        if self._undisasmed:
+            self._undisasmed -= 1
+        if (not self._undisasmed) and auto_resolve:
+            self.__dict__.pop('_fixup_offsets', None)
+            self.__dict__.pop('_fixup_targets', None)
+            self.__dict__.pop('_iface_mref_map', None)
+
+    def get_fixup(self, offset):
+        '''Get the (actualized) fixup target at a given code-section offset.
+
+            Raises KeyError if there is no fixup at that offset.
+        '''
+        i = bisect.bisect_left(self._fixup_offsets, offset)
+        if (i < len(self._fixup_offsets)) and (self._fixup_offsets[i] == offset):
+            return self._fixup_targets[i]
+        raise KeyError(offset)
+
+    def get_fixup_range(self, start, end):
+        '''Get the (offsets, targets) of all fixups in the code-section range [start, end).'''
+        lo = bisect.bisect_left(self._fixup_offsets, start)
+        hi = bisect.bisect_left(self._fixup_offsets, end, lo)
+        return self._fixup_offsets[lo:hi], self._fixup_targets[lo:hi]
+
 
     def __str__(self):
         return "%s v. %s" % (self.name, self.version)
@@ -1456,7 +1859,15 @@ class FixupModRef(Fixup):
     def serialize(self):
         raise NotImplementedError()
 
+# Marks a deferred disassembly given up on (see RoutineDef.release_code())
+_CODE_RELEASED = object()
+
 class RoutineDef(object):
+    __slots__ = [
+        'module', 'parent', 'offset', 'name', 'param_types', 'return_type', 'attrs',
+        'max_stack', 'max_locals', 'stack_size', 'stack_map', '_instructions', '_handlers',
+        'code_offset', 'code', '_raw_handlers', '_body', '_disasmed', '_resolved',
+    ]
 
     # Access flags
     ATTRS = {
@@ -1469,6 +1880,10 @@ class RoutineDef(object):
         return RoutineDef
 
     def __init__(self, module, raw_rd):
+        # Body not decoded yet: (loader, record path) of a cached one, or
+        # (None, auto_resolve) for bytecode awaiting (deferred) disassembly
+        self._body = None
+
         # Bail out if deserializing
         if (module is None) and (raw_rd is None): return
 
@@ -1508,6 +1923,37 @@ class RoutineDef(object):
 
         self._disasmed, self._resolved = False, False
 
+    def _load_body(self):
+        # (_body is only cleared once the body is in hand, so a failure repeats on every access)
+        loader, arg = self._body
+        if loader is None:
+            if arg is _CODE_RELEASED:
+                raise Exception("Routine '%s' was never disassembled (its code has been released)" % self.name)
+            self.disasm(auto_resolve = arg)
+        else:
+            self._instructions, self._handlers = loader._ds_body(self, arg)
+            self._body = None
+
+    def _get_instructions(self):
+        if self._body is not None:
+            self._load_body()
+        return self._instructions
+
+    def _set_instructions(self, instructions):
+        self._instructions = instructions
+
+    instructions = property(_get_instructions, _set_instructions)
+
+    def _get_handlers(self):
+        if self._body is not None:
+            self._load_body()
+        return self._handlers
+
+    def _set_handlers(self, handlers):
+        self._handlers = handlers
+
+    handlers = property(_get_handlers, _set_handlers)
+
     def set_parent(self, class_def):
         assert (self.parent is None), "Routine '%s' already associated with class '%s'!" % (self.get_name(), self.parent)
         self.parent = class_def
@@ -1524,20 +1970,42 @@ class RoutineDef(object):
 
         return self
 
+    def defer_disasm(self, auto_resolve = True):
+        '''Disassemble (and fixup) this routine when its instructions/handlers are first looked at.'''
+        if (not self._disasmed) and (self._body is None):
+            self._body = (None, auto_resolve)
+
+    def release_code(self):
+        '''Drop the code kept for a deferred disassembly that never happened.
+
+            Looking at our instructions/handlers raises from then on.
+        '''
+        if (self._body is not None) and (self._body[0] is None):
+            self._body = (None, _CODE_RELEASED)
+            self.code = self._raw_handlers = None
+
     def disasm(self, auto_resolve = True):
         if self._disasmed: return self
-        self._disasmed = True
 
         # Disassemble/fixup all instructions
-        self.instructions = [instr for instr in disasm.disassembly(self)]
-        # Fixup all instructions
+        # (Nothing is marked done until this all succeeds: a routine that fails to
+        # decode must keep failing, not look like an empty one the next time)
+        instructions = [instr for instr in disasm.disassembly(self)]
+        # Fixup all instructions (merging in the module fixups that fall within our code),
+        # packing the results into a compact stream
         if auto_resolve:
-            self.instructions = [instr.fixup(self, auto_resolve=auto_resolve) for instr in self.instructions]
+            f_offsets, f_targets = self.module.get_fixup_range(self.code_offset, self.code_offset + len(self.code))
+            instructions = disasm.InstructionStream(self.module._L.get_operand_table(self.module),
+                disasm.fixup_instructions(self, instructions, f_offsets, f_targets))
 
         # Parse/fixup exception handlers
         if auto_resolve:
             self.handlers = [ExHandler(self.module, self, xh).fixup(self) for xh in self._raw_handlers]
-        del self._raw_handlers  # No longer needed
+        self.instructions = instructions
+        self._disasmed = True
+        self._body = None
+        del self._raw_handlers, self.code  # No longer needed
+        self.module._routine_disasmed(auto_resolve)
 
         return self
 
@@ -1549,7 +2017,10 @@ class RoutineDef(object):
         mode = utils.format_flags(self.attrs, MODE_FLAGS) or None
         # if a synch or synch static instruction is present, then this is a synchronized function
         if len(self.instructions) > 1:
-            names = [x._name for x in self.instructions]
+            if isinstance(self.instructions, disasm.InstructionStream):
+                names = self.instructions.names()
+            else:
+                names = [x._name for x in self.instructions]
             if 'synch' in names or 'synch_static' in names:
                 # add the synchronized keyword
                 if mode is None:
@@ -1839,7 +2310,7 @@ class StackMapEntry(object):
         return (self.label, self.type.serialize())
 
 class ExHandler(object):
-    __slot__ = ['scope', 'target', '_type_id', '_type_offset', 'type']
+    __slots__ = ['scope', 'target', '_type_id', '_type_offset', 'type']
 
     def __init__(self, module, routine, raw_xh):
         if (module is None) and (routine is None) and (raw_xh is None): return
@@ -1853,7 +2324,7 @@ class ExHandler(object):
     def fixup(self, routine):
         mod = routine.parent.module
         try:
-            self.type = mod._fixup_map[self._type_offset]
+            self.type = mod.get_fixup(self._type_offset)
             assert isinstance(self.type, (ClassDef, ClassRef))
         except KeyError:
             self.type = mod._R.get_class(self._type_id)
@@ -1861,6 +2332,7 @@ class ExHandler(object):
             mod._L.log("WARNING: detected non-class ('%s' [%s]) as a type-fixup for '%s' @ 0x%05x" % (self.type, type(self.type), self, self._type_offset))
             self.type = None
 
+        del self._type_id, self._type_offset  # No longer needed
         return self
 
     def __str__(self):
@@ -1878,6 +2350,13 @@ class ExHandler(object):
         )
 
 class ClassDef(object):
+    __slots__ = [
+        'module', 'package', 'name', '_superclass_id', 'superclass', '_iface_ids', 'ifaces', 'attrs',
+        'fields', 'static_fields', '_static_address_map',
+        'virtual_methods', 'nonvirtual_methods', 'static_methods',
+        'vft', 'fft', '_vft_index', '_hierarchy', 'field_members', 'method_members',
+        '_resolved', '_actualized',
+    ]
 
     ATTRS = {
         0x001: 'public', 0x002: 'private', 0x004: 'protected', 0x008: 'final',
@@ -1944,6 +2423,12 @@ class ClassDef(object):
         # Same with our field-fixup table
         self.fft = []
 
+        # (And the by-signature index of our VFT is only built on demand)
+        self._vft_index = None
+
+        # Our loader's hierarchy index (we register with it when actualized)
+        self._hierarchy = None
+
         # Ditto our member-lookup table
         self.field_members = None
         self.method_members = None
@@ -1971,7 +2456,9 @@ class ClassDef(object):
     def get_member_by_name(self, m_name, m_type=None, is_field=False):
         assert (self._resolved), "Class '%s' must be resolved before by-name member lookup will work!" % self
         # we need to actualize in preparation to get inherited members
+        # (which also gets us our loader's hierarchy, for memoized type comparisons)
         self.actualize()
+        lattice = self._hierarchy.lattice if (self._hierarchy is not None) else None
 
         # Make sure we have a member map
         if self.field_members is None:
@@ -2004,7 +2491,7 @@ class ClassDef(object):
                     c_fields = [c for c in candidates if isinstance(c, FieldDef) if c.type == m_type]
                     if len(c_fields) != 1:
                         # we need to be more OOPish
-                        c_fields = [c for c in candidates if isinstance(c, FieldDef) if m_type.is_super_or_implements_or_equivalent(c.type)]
+                        c_fields = [c for c in candidates if isinstance(c, FieldDef) if m_type.is_super_or_implements_or_equivalent(c.type, lattice)]
                 else:
                     c_fields = [c for c in candidates if isinstance(c, FieldDef)]
                 
@@ -2029,7 +2516,7 @@ class ClassDef(object):
                 else:
                     # Try to match on types
                     for c in c_methods:
-                        if m_type.is_super_or_implements_or_equivalent(c.param_types):
+                        if m_type.is_super_or_implements_or_equivalent(c.param_types, lattice):
                             return c
                     '''
                     else:
@@ -2108,17 +2595,41 @@ class ClassDef(object):
         else:
             raise ValueError("Unresolved method name: (%s, %s, %s)" % (self, m_name, m_type))
 
-    def _get_super_vft(self):
-        '''Get our superclass's virtual function table (VFT).
+    def _get_actualized_super(self):
+        '''Get our superclass, ensuring it has been actualize()'d.
 
-            Returns [] if our superclass was None (i.e., if we are java.lang.Object).
-            Ensures the superclass has been actualize()'d.
+            Returns None if our superclass was None (i.e., if we are java.lang.Object).
         '''
         _superclass = self.superclass.get_class() if (self.superclass is not None) else None
         if _superclass is not None:
-            return _superclass.actualize().vft
-        else:
-            return []
+            _superclass.actualize()
+        return _superclass
+
+    @staticmethod
+    def _vft_key(vm):
+        # Overrides match on name and parameter types (ignoring the implicit "this")
+        return (vm.name, tuple(map(str, vm.param_types[1:])))
+
+    def get_vft_index(self):
+        '''Get a {(name, param-types): VFT-slot} map of our (actualized) VFT.
+
+            Built on demand from our superclass's index (so classes that are never
+            subclassed never pay for one).  Where a key occurs more than once, the
+            index holds its last (highest) slot.
+        '''
+        if self._vft_index is None:
+            self.actualize()
+            _superclass = self._get_actualized_super()
+            if _superclass is not None:
+                index = dict(_superclass.get_vft_index())
+                start = len(_superclass.vft)
+            else:
+                index = {}
+                start = 0
+            for i in xrange(start, len(self.vft)):
+                index[self._vft_key(self.vft[i])] = i
+            self._vft_index = index
+        return self._vft_index
 
     def resolve(self, resolver=None):
         if self._resolved: return self
@@ -2130,6 +2641,7 @@ class ClassDef(object):
         # Resolve all simple types
         self.superclass = resolver(self._superclass_id)
         self.ifaces = map(resolver, self._iface_ids)
+        del self._superclass_id, self._iface_ids  # No longer needed
         for fd in self.fields: fd.resolve(resolver)
         for fd in self.static_fields: fd.resolve(resolver)
 
@@ -2148,30 +2660,36 @@ class ClassDef(object):
         if self._actualized: return self
 
         # Now that we know A: our super class and B: all our members' names, build
-        # a virtual function table for this class...
-        super_vft = self._get_super_vft()
-        self.vft = super_vft[:]
+        # a virtual function table for this class (overrides are found by hashing
+        # into our superclass's VFT index rather than by scanning its VFT)...
+        _superclass = self._get_actualized_super()
+        if _superclass is not None:
+            super_index = _superclass.get_vft_index()
+            self.vft = _superclass.vft[:]
+            self.fft = _superclass.fft[:]
+        else:
+            super_index = {}
+            self.vft = []
+            self.fft = []
         for vm in self.virtual_methods:
-            for i in xrange(-1, -len(super_vft)-1, -1):
-                _svm = super_vft[i]
-                if (vm.name == _svm.name) and (vm.param_types[1:] == _svm.param_types[1:]):
-                    self.vft[len(super_vft) + i] = vm
-                    break
-            else:
+            try:
+                self.vft[super_index[self._vft_key(vm)]] = vm
+            except KeyError:
                 self.vft.append(vm)
 
-        # Likewise, compute the total number of fields we've inherited
-        _class_chain = [self]
-        _super = self.superclass
-        while _super is not None:
-            _class_chain.insert(0, _super)
-            _super = _super.superclass
-        for c in _class_chain:
-            # Field lookup is slot-based, not index-based, so we double-insert wide fields
-            for f in c.fields:
-                if f.type.slots() == 2:
-                    self.fft.append(f)
+        # Likewise, our field table is our (actualized) superclass's plus our own fields
+        # (Field lookup is slot-based, not index-based, so we double-insert wide fields)
+        for f in self.fields:
+            if f.type.slots() == 2:
                 self.fft.append(f)
+            self.fft.append(f)
+
+        # Register ourselves with our loader's hierarchy index
+        H = self._hierarchy = self.module._L.hierarchy
+        H.add(self.name,
+              class_name(self.superclass) if self.superclass else None,
+              [class_name(iface) for iface in self.ifaces],
+              self.module.get_base_module_name())
 
         self._actualized = True
         return self
@@ -2180,9 +2698,10 @@ class ClassDef(object):
         '''Convert our routines' bytecode into disassembled (symbolic) pseudo-assembly code.
 
             All loaded classes/routines must be resolved+actualized prior to disassembly.
+            (As with Module.disasm(), each routine is actually decoded on first use.)
         '''
         for r in itertools.chain(self.virtual_methods, self.nonvirtual_methods, self.static_methods):
-            r.disasm(auto_resolve = auto_resolve)
+            r.defer_disasm(auto_resolve = auto_resolve)
 
     def get_class(self):
         return self
@@ -2284,6 +2803,12 @@ class ClassDef(object):
 
     def is_super(self, other):
         '''Returns True if other is a superclass of self.'''
+        # Ask the hierarchy index first (it only says "don't know" for partially
+        # loaded hierarchies, where we fall back to walking the chain ourselves)
+        if self._hierarchy is not None:
+            answer = self._hierarchy.is_super(self.name, class_name(other))
+            if answer is not None:
+                return answer
         sup = self.superclass
         while sup:
             if str(other) == str(sup):
@@ -2293,6 +2818,10 @@ class ClassDef(object):
 
     def implements(self, other):
         '''Returns True if other is implemented by self.'''
+        if self._hierarchy is not None:
+            answer = self._hierarchy.implements(self.name, class_name(other))
+            if answer is not None:
+                return answer
         for iface in self.ifaces:
             # we implement it
             if str(iface) == str(other):
@@ -2306,9 +2835,9 @@ class ClassDef(object):
         return False
 
     def __cmp__(self, other):
-        sself = str(self)
-        sother = str(other)
-        if str(self) == str(other):
+        sself = self.name
+        sother = class_name(other)
+        if sself == sother:
             return 0
         # gt => more defined (ie String > Object)
         if self.is_super(other):
@@ -0,0 +1,166 @@
+#! /usr/bin/env python
+
+# Copyright (c) 2012, derrotehund361@googlemail.com
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met: 
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer. 
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution. 
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+shard: Coordinating a sharded cod2jar run through a shared directory.
+
+A run is planned into shards (lists of CODs) written under a shared directory;
+any number of workers, on one box or on several boxes sharing the directory
+(e.g., over NFS), then claim shards one at a time and dump each into an output
+folder of its own.  Claims are plain directory creations (atomic, even on NFS),
+so no other coordination service is needed.  Finally the shards' jars and logs
+are merged.
+
+    <root>/load_path             the load path every worker should use
+    <root>/shards/<n>.list       the COD paths of shard <n>
+    <root>/claims/<n>/owner      who claimed shard <n> (host, pid)
+    <root>/done/<n>              exit status of shard <n>, once finished
+    <root>/out/shard-<n>[.jar]   the output of shard <n>
+"""
+
+import os
+import socket
+import zipfile
+
+class ShardError(Exception): pass
+
+class ShardQueue(object):
+    '''The shards of a run, as kept in a shared directory.'''
+
+    def __init__(self, root):
+        self.root = root
+        self._shards_path = os.path.join(root, 'shards')
+        self._claims_path = os.path.join(root, 'claims')
+        self._done_path = os.path.join(root, 'done')
+        self._out_path = os.path.join(root, 'out')
+
+    def create(self, shards, load_path=''):
+        '''Write out a planned run (a list of lists of COD paths).'''
+        if os.path.exists(self._shards_path):
+            raise ShardError("'%s' already holds a sharded run" % self.root)
+        for path in (self._shards_path, self._claims_path, self._done_path, self._out_path):
+            os.makedirs(path)
+        with open(os.path.join(self.root, 'load_path'), 'wt') as fd:
+            fd.write(load_path)
+        for n, cods in enumerate(shards):
+            with open(os.path.join(self._shards_path, '%03d.list' % n), 'wt') as fd:
+                fd.write(''.join('%s\n' % os.path.abspath(c) for c in cods))
+
+    def get_load_path(self):
+        with open(os.path.join(self.root, 'load_path'), 'rt') as fd:
+            return fd.read()
+
+    def shards(self):
+        if not os.path.isdir(self._shards_path):
+            raise ShardError("'%s' holds no sharded run" % self.root)
+        return sorted(int(x[:-5]) for x in os.listdir(self._shards_path) if x.endswith('.list'))
+
+    def get_cods(self, n):
+        with open(os.path.join(self._shards_path, '%03d.list' % n), 'rt') as fd:
+            return [line.strip() for line in fd if line.strip()]
+
+    def output_path(self, n):
+        '''Folder a shard dumps into (jar dumps also leave "<folder>.jar" next to it).'''
+        return os.path.join(self._out_path, 'shard-%03d' % n)
+
+    def claim(self):
+        '''Claim the next unclaimed shard; returns its number (or None once all are claimed).'''
+        for n in self.shards():
+            claim_path = os.path.join(self._claims_path, '%03d' % n)
+            try:
+                os.mkdir(claim_path)
+            except OSError:
+                continue    # (somebody else's)
+            with open(os.path.join(claim_path, 'owner'), 'wt') as fd:
+                fd.write('%s %d\n' % (socket.gethostname(), os.getpid()))
+            return n
+        return None
+
+    def finish(self, n, status):
+        with open(os.path.join(self._done_path, '%03d' % n), 'wt') as fd:
+            fd.write('%d\n' % status)
+
+    def get_status(self, n):
+        '''Get a shard's state: ('done', exit status), ('claimed', owner) or ('pending', None).'''
+        try:
+            with open(os.path.join(self._done_path, '%03d' % n), 'rt') as fd:
+                return 'done', int(fd.read().strip())
+        except IOError:
+            pass
+        claim_path = os.path.join(self._claims_path, '%03d' % n)
+        if os.path.isdir(claim_path):
+            try:
+                with open(os.path.join(claim_path, 'owner'), 'rt') as fd:
+                    return 'claimed', fd.read().strip()
+            except IOError:
+                return 'claimed', '?'
+        return 'pending', None
+
+    def release(self, n):
+        '''Forget a shard's claim, status and output (so it gets redone, e.g. after a worker died).'''
+        import shutil
+        for path in (os.path.join(self._done_path, '%03d' % n), self.output_path(n) + '.jar'):
+            if os.path.isfile(path):
+                os.remove(path)
+        for path in (self.output_path(n), os.path.join(self._claims_path, '%03d' % n)):
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+
+def merge_jars(jar_paths, out_path):
+    '''Combine jars into one (the first copy of a duplicated entry wins); returns (entries, duplicates).'''
+    try:
+        out = zipfile.ZipFile(out_path, 'w', zipfile.ZIP_DEFLATED)
+    except RuntimeError:
+        # could not find zlib
+        out = zipfile.ZipFile(out_path, 'w', zipfile.ZIP_STORED)
+    seen = set()
+    duplicates = 0
+    for jar_path in jar_paths:
+        jar = zipfile.ZipFile(jar_path, 'r')
+        for info in jar.infolist():
+            if info.filename in seen:
+                duplicates += 1
+            else:
+                seen.add(info.filename)
+                out.writestr(info, jar.read(info.filename))
+        jar.close()
+    out.close()
+    return len(seen), duplicates
+
+def merge_logs(queue, out_folder, log_names=('cod2jar.log', 'loader.log', 'hiscan.log')):
+    '''Concatenate each named log of every shard into out_folder; returns the merged paths.'''
+    merged = []
+    for log_name in log_names:
+        merged_path = os.path.join(out_folder, log_name)
+        with open(merged_path, 'wt') as out:
+            for n in queue.shards():
+                log_path = os.path.join(queue.output_path(n), log_name)
+                if os.path.isfile(log_path):
+                    out.write('==== shard %03d ====\n' % n)
+                    with open(log_path, 'rt') as fd:
+                        for line in fd:
+                            out.write(line)
+        merged.append(merged_path)
+    return merged
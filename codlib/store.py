@@ -0,0 +1,245 @@
+#! /usr/bin/env python
+
+# Copyright (c) 2012, derrotehund361@googlemail.com
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met: 
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer. 
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution. 
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+store: Content-addressed, multi-version store of serialized cache records.
+
+Successive OS builds share most of their classes unchanged, so rather than one
+cache per build a store keeps every distinct cache record once, keyed by the
+SHA-1 of its (stamp-less, protocol-2) pickle, and describes each build with a
+small manifest of {record path: digest}:
+
+    <root>/objects.pack                 every distinct record (a packfile)
+    <root>/modules.idx                  (module name, COD hash) -> stamp + records
+    <root>/versions/<version>.manifest  one per OS build
+
+The module index lets a new build skip any module whose COD was already stored
+(by some earlier build); only changed modules get loaded, dumped and stored.
+A manifest path can be used directly as a (read-only) Loader cache root.
+"""
+
+import os
+import cPickle
+from hashlib import sha1
+
+import packfile
+
+STORE_VERSION = 1
+
+OBJECTS_NAME = 'objects.pack'
+MODULES_NAME = 'modules.idx'
+VERSIONS_DIR = 'versions'
+MANIFEST_EXT = '.manifest'
+
+class StoreError(Exception): pass
+
+def is_manifest(path):
+    return path.endswith(MANIFEST_EXT) and os.path.isfile(path)
+
+def _load_pickle(path, default):
+    if not os.path.isfile(path):
+        return default
+    with open(path, 'rb') as fd:
+        data = cPickle.load(fd)
+    if data.get('store_version') != STORE_VERSION:
+        raise StoreError("'%s' was written by an incompatible store (version %r)" % (path, data.get('store_version')))
+    return data
+
+def _save_pickle(path, data):
+    # Write-then-rename so an interrupted save never clobbers the old copy
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as fd:
+        cPickle.dump(data, fd, 2)
+    if os.path.exists(path):
+        os.remove(path)
+    os.rename(tmp_path, path)
+
+class ClassStore(object):
+    '''A content-addressed store of cache records shared by many OS versions.
+
+        Records are only ever added; put() of a record already stored just
+        returns its digest.  Call close() to commit new records and modules.
+        A <read_only> store creates nothing on disk and refuses put().
+    '''
+
+    def __init__(self, root, read_only=False):
+        self.root = root
+        self.read_only = read_only
+        versions_path = os.path.join(root, VERSIONS_DIR)
+        if (not read_only) and (not os.path.isdir(versions_path)):
+            os.makedirs(versions_path)
+        self._objects_path = os.path.join(root, OBJECTS_NAME)
+        if os.path.isfile(self._objects_path):
+            PR = packfile.PackReader(self._objects_path)
+            self._digests = set(PR.names())
+            PR.close()
+        else:
+            self._digests = set()
+        self._modules_path = os.path.join(root, MODULES_NAME)
+        self._modules = _load_pickle(self._modules_path, {'store_version': STORE_VERSION, 'modules': {}})['modules']
+        self._writer = None
+        self._reader = None
+        # (modules added since the index was last saved)
+        self._dirty = False
+        # records added vs. found already stored (since we were opened)
+        self.added = 0
+        self.shared = 0
+
+    def __contains__(self, digest):
+        return digest in self._digests
+
+    def __len__(self):
+        return len(self._digests)
+
+    def versions(self):
+        '''List the versions with a manifest in this store.'''
+        names = os.listdir(os.path.join(self.root, VERSIONS_DIR))
+        return sorted(x[:-len(MANIFEST_EXT)] for x in names if x.endswith(MANIFEST_EXT))
+
+    def manifest_path(self, version):
+        return os.path.join(self.root, VERSIONS_DIR, version + MANIFEST_EXT)
+
+    def open_manifest(self, version):
+        '''Get the manifest of <version> (empty if it has not been stored yet).'''
+        return VersionManifest(self.manifest_path(version), version)
+
+    def put(self, record):
+        '''Store a (stamp-less) record; returns its digest.'''
+        if self.read_only:
+            raise StoreError("cannot add to store '%s' (opened read-only)" % self.root)
+        data = cPickle.dumps(record, 2)
+        digest = sha1(data).hexdigest()
+        if digest in self._digests:
+            self.shared += 1
+        else:
+            if self._writer is None:
+                self._close_reader()
+                self._writer = packfile.PackWriter(self._objects_path)
+            self._writer.append_raw(digest, data)
+            self._digests.add(digest)
+            self.added += 1
+        return digest
+
+    def read(self, digest):
+        '''Get the raw (pickled) bytes of a stored record.'''
+        if self._writer is not None:
+            raise StoreError("cannot read from store '%s' while adding to it" % self.root)
+        if self._reader is None:
+            self._reader = packfile.PackReader(self._objects_path)
+        return self._reader.read(digest)
+
+    def get(self, digest):
+        return cPickle.loads(self.read(digest))
+
+    def find_module(self, name, source_hash):
+        '''Get the stored entry ({'stamp':..., 'records':...}) of a module built from a given COD, if any.'''
+        return self._modules.get((name, source_hash))
+
+    def add_module(self, name, source_hash, entry):
+        if self.read_only:
+            raise StoreError("cannot add to store '%s' (opened read-only)" % self.root)
+        self._modules[(name, source_hash)] = entry
+        self._dirty = True
+
+    def _close_reader(self):
+        if self._reader is not None:
+            self._reader.close()
+            self._reader = None
+
+    def close(self):
+        self._close_reader()
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        if self._dirty:
+            # (only index modules once their records are safely committed)
+            _save_pickle(self._modules_path, {'store_version': STORE_VERSION, 'modules': self._modules})
+            self._dirty = False
+
+class VersionManifest(object):
+    '''The modules (and their record digests) making up one version in a store.'''
+
+    def __init__(self, path, version):
+        self.path = path
+        self.version = version
+        self.modules = _load_pickle(path, {'store_version': STORE_VERSION, 'modules': {}})['modules']
+
+    def add_module(self, name, entry):
+        self.modules[name] = entry
+
+    def save(self):
+        _save_pickle(self.path, {'store_version': STORE_VERSION, 'version': self.version, 'modules': self.modules})
+
+class VersionReader(object):
+    '''Reads the records of one stored version, stamped as if from a plain cache.
+
+        Offers the same names()/read()/load() interface as a PackReader, so a
+        Loader can index it like any other packfile.
+    '''
+
+    def __init__(self, manifest_path):
+        self.path = manifest_path
+        root = os.path.dirname(os.path.dirname(os.path.abspath(manifest_path)))
+        manifest = VersionManifest(manifest_path, None)
+        self.store = ClassStore(root, read_only=True)
+        # dict of record path -> (digest, stamp)
+        self.index = {}
+        for entry in manifest.modules.itervalues():
+            for rel_path, digest in entry['records'].iteritems():
+                self.index[rel_path] = (digest, entry['stamp'])
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def names(self):
+        return self.index.keys()
+
+    def load(self, name):
+        digest, stamp = self.index[name]
+        record = self.store.get(digest)
+        record['stamp'] = stamp
+        return record
+
+    def read(self, name):
+        return cPickle.dumps(self.load(name), 2)
+
+    def close(self):
+        self.store.close()
+
+def export_version(manifest_path, pack_path):
+    '''Export one stored version as a stand-alone packfile cache; returns the record count.'''
+    VR = VersionReader(manifest_path)
+    PW = packfile.PackWriter(pack_path, append=False)
+    try:
+        for name in sorted(VR.names()):
+            PW.append(name, VR.load(name))
+        PW.close()
+    except:
+        # Don't publish a partial pack (an existing one stays put)
+        PW.abort()
+        raise
+    finally:
+        VR.close()
+    return len(VR.index)
@@ -29,6 +29,7 @@ utils: Constants and utility functions for CODng.
 
 from struct import unpack
 from bytecleaver import *
+from hierarchy import INCOMPARABLE
 
 # Quick, limited and fragile parsers whose sole purpose
 # is speedy access of commonly needed pre-parsing info
@@ -221,6 +222,44 @@ def quick_get_siblings(cod_path):
         names.append(_get_lit(f, ds_offset + each))
     return names
 
+def quick_get_class_names(cod_path):
+    '''Quickly parse out the (JTS) names of the classes defined in a COD.'''
+    f = open(cod_path, 'rb')
+    magic = f.read(4)
+    assert magic == '\xde\xc0\xff\xff', "%s does not contain the correct COD file magic" % cod_path
+    # read data section offset
+    f.seek(38)
+    # header size + code size
+    ds_offset = 44 + unpack('<H', f.read(2))[0]
+    # read info from the data header
+    f.seek(ds_offset + 5)
+    num_classes = unpack('<B', f.read(1))[0]
+    # data section offset + data header size
+    f.seek(ds_offset + 52)
+    class_offsets = [unpack('<H', f.read(2))[0] for i in range(num_classes)]
+    # each class def starts with the offsets of its package and class name identifiers
+    name_offsets = []
+    for each in class_offsets:
+        f.seek(ds_offset + each)
+        name_offsets.append(unpack('<HH', f.read(4)))
+
+    # finally, retrieve the names (RIM uses dots; we use JTS)
+    names = []
+    for p, c in name_offsets:
+        package = decode_identifier(_get_lit(f, ds_offset + p)).replace('.', '/')
+        short_name = decode_identifier(_get_lit(f, ds_offset + c)).replace('.', '/')
+        names.append('%s/%s' % (package, short_name) if package else short_name)
+    return names
+
+def quick_get_hash(cod_path):
+    '''Quickly compute the (hex) SHA-1 digest of a COD file's contents.'''
+    from hashlib import sha1
+    h = sha1()
+    with open(cod_path, 'rb') as f:
+        for block in iter(lambda: f.read(65536), ''):
+            h.update(block)
+    return h.hexdigest()
+
 # Utility loading code
 #----------------------------------------------------------
 def load_cod_file(cod_name, search_path=[]):
@@ -460,7 +499,7 @@ class Primitive(object):
 
 class TypeToken(object):
     '''A COD type reference object.'''
-    __slots__ = ['code', 'type', '_array', '_object', 'dims', '_class_id']
+    __slots__ = ['code', 'type', '_array', '_object', 'dims', '_class_id', '_jts']
 
     # Names for type codes
     TYPE_NAME = {
@@ -494,7 +533,21 @@ class TypeToken(object):
         'D': ('double', 12),
     }
 
+    # Primitive orderings used by __cmp__ (gt implies more defined, ie bool > int)
+    TYPE_CMP = {
+        ('I', 'S'): -1,
+        ('I', 'C'): -1,
+        ('I', 'B'): -1,
+        ('I', 'Z'): -1,
+        ('S', 'I'): 1,
+        ('C', 'I'): 1,
+        ('B', 'I'): 1,
+        ('Z', 'I'): 1,
+    }
+
     def __init__(self, C, **kw):
+        # Our JTS string is computed on demand (and cached until we are re-resolved)
+        self._jts = None
         if C is None: return
 
         # Back up to read our header byte
@@ -540,6 +593,8 @@ class TypeToken(object):
                 int[][] -> "[[I"
                 java.lang.String -> "Ljava/lang/String;"
         '''
+        if self._jts is not None:
+            return self._jts
         if self.type is None:
             # A non-standard special case for stack-maps and other places where we can
             # have "wildcard" types in a list...
@@ -555,25 +610,19 @@ class TypeToken(object):
             base = self.type.to_jts()
 
         if self._array:
-            return ('[' * self.dims) + base
+            self._jts = ('[' * self.dims) + base
         else:
-            return base
+            self._jts = base
+        return self._jts
 
     def __repr__(self):
         return "<tt: '%s'>" % str(self)
 
     def __cmp__(self, other):
         # gt implies more defined (ie bool > int)
-        TYPE_CMP = {
-            ('I', 'S'): -1,
-            ('I', 'C'): -1,
-            ('I', 'B'): -1,
-            ('I', 'Z'): -1,
-            ('S', 'I'): 1,
-            ('C', 'I'): 1,
-            ('B', 'I'): 1,
-            ('Z', 'I'): 1,
-        }
+        if self is other:
+            return 0
+        TYPE_CMP = self.TYPE_CMP
 
         sself = str(self)
         sother = str(other)
@@ -617,14 +666,23 @@ class TypeToken(object):
         raise ValueError('Type compare mismatch: %s and %s' % (sself, sother))
 
     def __eq__(self, other):
-        return str(self) == str(other)    # Hacky/inefficient, but it works in all the corner cases...
+        # (Interned tokens usually short-circuit on identity; the cached JTS covers the rest)
+        return (self is other) or (str(self) == str(other))
 
     def __ne__(self, other):
-        return str(self) != str(other)    # Hacky/inefficient, but it works in all the corner cases...
+        return not self.__eq__(other)
+
+    def __hash__(self):
+        # Our JTS (and so our hash) changes when resolve() names our class;
+        # only resolved tokens may go in sets or be used as dict keys
+        if isinstance(self.type, UnresolvedClass):
+            raise TypeError("unhashable unresolved TypeToken: %s" % str(self))
+        return hash(str(self))
 
     def resolve(self, resolver):
         if self._object:
             self.type = resolver(self._class_id)
+            self._jts = None
 
     def serialize(self):
         # TODO: add module name/index for objects 
@@ -679,6 +737,8 @@ class TypeToken(object):
             except KeyError:
                 raise AssertionError("JTS syntax error (unknown type '%s') in '%s'" % (_tchar, jts))
 
+        # (We already know our JTS--so class types need not be loaded to produce it)
+        tt._jts = jts
         return tt
 
     def clone(self):
@@ -691,6 +751,38 @@ class TypeToken(object):
             tt.dims = self.dims
         return tt
 
+class TypeTokenPool(object):
+    '''Interns TypeTokens, so that equal types share one (immutable!) TypeToken object.
+
+        Tokens are keyed by JTS string and object-ness (the "null" wildcard is a '*'
+        that must be an object).  Tokens handed out by a pool must never be modified;
+        clone() one to make a variation, then intern() the result.  Since a class is only
+        known here by its name, tokens for a specific class (or for a name that more than
+        one module defines) must not be interned.
+    '''
+
+    def __init__(self):
+        self._tokens = {}
+
+    def __len__(self):
+        return len(self._tokens)
+
+    def get(self, jts, is_object=None):
+        '''Get the interned token for a JTS string (or None if there is none yet).'''
+        if is_object is None:
+            is_object = jts.lstrip('[').startswith('L')
+        return self._tokens.get((jts, is_object))
+
+    def intern(self, tt):
+        '''Get the canonical token equal to tt (adding a private copy of tt if there is none yet).'''
+        key = (str(tt), tt._object)
+        try:
+            return self._tokens[key]
+        except KeyError:
+            canon = self._tokens[key] = tt.clone()
+            canon._jts = key[0]
+            return canon
+
 class TypeList(list):
     def __init__(self, C, **kw):
         if C is None: return
@@ -746,11 +838,19 @@ class TypeList(list):
         else:
             return str(self)
 
-    def is_super_or_implements_or_equivalent(self, other):
-        '''Returns True if every item in other TypeList is super, implements, or equivalent to every item in this TypeList'''
+    def is_super_or_implements_or_equivalent(self, other, lattice=None):
+        '''Returns True if every item in other TypeList is super, implements, or equivalent to every item in this TypeList
+
+            Comparisons go through lattice (a hierarchy.TypeLattice) if one is given.
+        '''
         if len(self) != len(other):
             return False
         for i in range(len(self)):
+            if lattice is not None:
+                order = lattice.cmp(self[i], other[i])
+                if (order is INCOMPARABLE) or (order < 0):
+                    return False
+                continue
             try:
                 if self[i] < other[i]:
                     # self is super or equivalent to other
@@ -34,6 +34,8 @@ SCRIPTS = [
     'bin/cod_explorer.py',
     'bin/cod_extract.py',
     'bin/cod_info.py',
+    'bin/cod_pack.py',
+    'bin/cod_shard.py',
     'bin/cod2jar.py',
     'bin/download_jad.py',
 ]
@@ -42,6 +44,8 @@ if os.name == "nt":
         'bin/cod_explorer.bat',
         'bin/cod_extract.bat',
         'bin/cod_info.bat',
+        'bin/cod_pack.bat',
+        'bin/cod_shard.bat',
         'bin/cod2jar.bat',
         'bin/download_jad.bat',
     ]